@@ -0,0 +1,26 @@
+"""rates source time
+
+Revision ID: 0a6e3f8b5d41
+Revises: f19b6d3a8c27
+Create Date: 2026-10-18 18:47:12.305961
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "0a6e3f8b5d41"
+down_revision = "f19b6d3a8c27"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.get_bind().execute(
+        sa.text("ALTER TABLE public.rates ADD COLUMN source_time timestamp with time zone;")
+    )
+
+
+def downgrade() -> None:
+    op.get_bind().execute(sa.text("ALTER TABLE public.rates DROP COLUMN source_time;"))
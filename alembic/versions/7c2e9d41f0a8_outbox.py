@@ -0,0 +1,43 @@
+"""outbox
+
+Revision ID: 7c2e9d41f0a8
+Revises: 4b11cc1c3633
+Create Date: 2026-10-18 12:14:03.512907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "7c2e9d41f0a8"
+down_revision = "4b11cc1c3633"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.get_bind().execute(
+        sa.text(
+            """
+        CREATE TABLE public.outbox (
+            id bigserial PRIMARY KEY,
+            kind character varying(64) NOT NULL,
+            idempotency_key character varying(256) NOT NULL UNIQUE,
+            payload jsonb NOT NULL DEFAULT '{}'::jsonb,
+            status character varying(16) NOT NULL DEFAULT 'pending',
+            attempts integer NOT NULL DEFAULT 0,
+            next_attempt_at timestamp with time zone NOT NULL DEFAULT now(),
+            last_error text,
+            created_at timestamp with time zone NOT NULL DEFAULT now(),
+            processed_at timestamp with time zone
+        );
+
+        CREATE INDEX outbox_pending_idx ON public.outbox (next_attempt_at) WHERE status = 'pending';
+        """
+        )
+    )
+
+
+def downgrade() -> None:
+    op.get_bind().execute(sa.text("DROP TABLE public.outbox;"))
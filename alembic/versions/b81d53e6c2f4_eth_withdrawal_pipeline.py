@@ -0,0 +1,50 @@
+"""eth withdrawal pipeline
+
+Revision ID: b81d53e6c2f4
+Revises: 7c2e9d41f0a8
+Create Date: 2026-10-18 15:41:27.118354
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "b81d53e6c2f4"
+down_revision = "7c2e9d41f0a8"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.get_bind().execute(
+        sa.text(
+            """
+        ALTER TABLE public.transactions
+            ADD COLUMN nonce bigint,
+            ADD COLUMN gas_price numeric(30,0),
+            ADD COLUMN raw_tx text,
+            ADD COLUMN sent_at timestamp with time zone,
+            ADD COLUMN replaced_tx_hashes text[] NOT NULL DEFAULT '{}';
+
+        CREATE INDEX transactions_out_in_flight_idx ON public.transactions (nonce)
+            WHERE type = 'out' AND NOT is_confirmed AND tx_hash IS NOT NULL;
+        """
+        )
+    )
+
+
+def downgrade() -> None:
+    op.get_bind().execute(
+        sa.text(
+            """
+        DROP INDEX public.transactions_out_in_flight_idx;
+        ALTER TABLE public.transactions
+            DROP COLUMN nonce,
+            DROP COLUMN gas_price,
+            DROP COLUMN raw_tx,
+            DROP COLUMN sent_at,
+            DROP COLUMN replaced_tx_hashes;
+        """
+        )
+    )
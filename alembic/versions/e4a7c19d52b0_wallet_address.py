@@ -0,0 +1,70 @@
+"""wallet address
+
+Revision ID: e4a7c19d52b0
+Revises: b81d53e6c2f4
+Create Date: 2026-10-18 17:12:09.403518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from eth_account import Account
+
+
+# revision identifiers, used by Alembic.
+revision = "e4a7c19d52b0"
+down_revision = "b81d53e6c2f4"
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 1000
+
+
+def _backfill_eth(conn) -> None:
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.text(
+                """
+            SELECT id, private_key FROM public.wallet
+            WHERE symbol = 'eth' AND private_key IS NOT NULL AND address IS NULL AND id > :last_id
+            ORDER BY id
+            LIMIT :limit
+            """
+            ),
+            {"last_id": last_id, "limit": BATCH_SIZE},
+        ).fetchall()
+        if not rows:
+            return
+        conn.execute(
+            sa.text("UPDATE public.wallet SET address = :address WHERE id = :id"),
+            [{"id": wallet_id, "address": Account.from_key(pk).address} for wallet_id, pk in rows],
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    conn.execute(
+        sa.text(
+            """
+        ALTER TABLE public.wallet ADD COLUMN address character varying(128);
+
+        UPDATE public.wallet SET address = private_key WHERE symbol = 'btc' AND private_key IS NOT NULL;
+
+        CREATE INDEX wallet_symbol_address_idx ON public.wallet (symbol, address);
+        """
+        )
+    )
+    # TRON addresses depend on HEAT_SALT, they are filled by the application on the first read
+    _backfill_eth(conn)
+
+
+def downgrade() -> None:
+    op.get_bind().execute(
+        sa.text(
+            """
+        DROP INDEX public.wallet_symbol_address_idx;
+        ALTER TABLE public.wallet DROP COLUMN address;
+        """
+        )
+    )
@@ -0,0 +1,38 @@
+"""address pool
+
+Revision ID: f19b6d3a8c27
+Revises: e4a7c19d52b0
+Create Date: 2026-10-18 18:03:51.772140
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "f19b6d3a8c27"
+down_revision = "e4a7c19d52b0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.get_bind().execute(
+        sa.text(
+            """
+        CREATE TABLE public.address_pool (
+            id bigserial PRIMARY KEY,
+            symbol character varying(4) NOT NULL,
+            private_key character varying(1000) NOT NULL UNIQUE,
+            address character varying(128),
+            created_at timestamp with time zone NOT NULL DEFAULT NOW()
+        );
+
+        CREATE INDEX address_pool_symbol_id_idx ON public.address_pool (symbol, id);
+        """
+        )
+    )
+
+
+def downgrade() -> None:
+    op.get_bind().execute(sa.text("DROP TABLE public.address_pool;"))
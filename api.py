@@ -5,6 +5,7 @@ from werkzeug.exceptions import InternalServerError, BadRequest, Forbidden
 from jobs.config import Config
 from apis.internal import *
 from utils.logger import logger
+from utils.sql_metrics import instrument_jobs
 import traceback
 
 
@@ -33,5 +34,6 @@ if __name__ == '__main__':
     app.config.from_object(Config())
     scheduler = APScheduler()
     scheduler.init_app(app)
+    instrument_jobs(scheduler)
     scheduler.start()
     app.run(host='0.0.0.0', port=5555)
@@ -1,27 +1,27 @@
-from datetime import timezone, datetime, timedelta
 from distutils.util import strtobool
 from functools import wraps
 
 import jwt
-from flask import request, jsonify
+from flask import request, jsonify, Response
 from werkzeug.exceptions import BadRequest
 
+from crypto.bitcoin_rpc import rpc_metrics
+from crypto.eth import ETH
 from data_handler import dh
-from system.settings import app
-from utils.db_sessions import session_scope
+from system.settings import app, telegram_ids
+from utils.db_sessions import session_scope, init_request_session
+from utils.public_api import public_api
+from utils.report_export import EXPORT_FORMATS
+from utils.sql_metrics import init_sql_metrics, sql_metrics, tracked_stream
 from utils.utils import check_javascript_in_pdf
 
+init_sql_metrics(app)
+# every session_scope() of a request shares one connection and transaction
+init_request_session(app)
 
-def get_user_id_from_tg(telegram_id, session=None):
-    data = TELEGRAM_ID_ID_DICT.get(telegram_id)
-    if data is None or data[1] + timedelta(minutes=1) < datetime.now(timezone.utc):
-        user_id = dh.get_user_id(telegram_id, session)
-        if user_id is not None:
-            TELEGRAM_ID_ID_DICT[telegram_id] = (user_id, datetime.now(timezone.utc))
-    else:
-        user_id = data[0]
 
-    return user_id
+def get_user_id_from_tg(telegram_id, session=None):
+    return dh.get_user_id(telegram_id, session)
 
 
 def requires_telegram_id(f):
@@ -32,8 +32,7 @@ def requires_telegram_id(f):
             return jsonify({'error': 'telegram_id is not specified'}), 400
         user_id = get_user_id_from_tg(telegram_id)
         if user_id is None:
-            if not dh.is_user_exists(telegram_id):
-                return jsonify({'error': 'User not exists'}), 400
+            return jsonify({'error': 'User not exists'}), 400
         dh.update_last_action_time(user_id=user_id, telegram_id=telegram_id)
         return f(*args, telegram_id=telegram_id, **kwargs)
 
@@ -60,9 +59,6 @@ def requires_auth(f):
     return decorated
 
 
-TELEGRAM_ID_ID_DICT = {}
-
-
 def get_user_id(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -100,7 +96,9 @@ def only_admin(rights):
         @wraps(f)
         def decorated(*args, **kwargs):
             user_id = kwargs.pop('user_id')
-            if not dh.is_user_have_rights(user_id, rights):
+            with session_scope() as session:
+                is_permitted = dh.is_user_have_rights(user_id, rights, session)
+            if not is_permitted:
                 return jsonify({'error': 'not permitted'}), 400
             return f(*args, **kwargs)
         return decorated
@@ -725,15 +723,26 @@ def get_control_updates(symbol, session):
 
 @app.route('/reports-all/<string:t>', methods=['GET'])
 @requires_auth
-@json_response
-def get_all_reports(symbol, t, session):
+def get_all_reports(symbol, t):
     from_date = request.args.get('from')
     to_date = request.args.get('to')
     if from_date:
         from_date = int(float(from_date))
     if to_date:
         to_date = int(float(to_date))
-    return dh.get_all_reports(symbol, t, from_date=from_date, to_date=to_date, session=session)
+    export_format = request.args.get('format')
+    if export_format is None:
+        with session_scope() as session:
+            return jsonify(dh.get_all_reports(symbol, t, from_date=from_date, to_date=to_date, session=session))
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({'error': f'format should be one of {", ".join(EXPORT_FORMATS)}'}), 400
+    # streamed with constant memory, whatever the size of the report
+    serialize, mimetype = EXPORT_FORMATS[export_format]
+    rows = dh.stream_report(symbol, t, from_date=from_date, to_date=to_date)
+    return Response(
+        tracked_stream(request.endpoint, serialize(rows)), mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={t}.{export_format}'}
+    )
 
 
 @app.route('/reports/<int:user_id>', methods=['GET'])
@@ -932,3 +941,38 @@ def upload_media(symbol, user_id, session):
 @json_response
 def healthcheck(session):
     return {}
+
+
+@app.route('/public-api-metrics', methods=['GET'])
+@requires_auth
+@json_response
+def get_public_api_metrics(symbol, session):
+    return public_api.metrics()
+
+
+@app.route('/eth-gas-price', methods=['GET'])
+@requires_auth
+@json_response
+def get_eth_gas_price(symbol, session):
+    net_commission = session.execute("SELECT net_commission FROM crypto_settings WHERE symbol = 'eth'").scalar()
+    return ETH.get_gas_price_info(net_commission)
+
+
+@app.route('/btc-rpc-metrics', methods=['GET'])
+@requires_auth
+@json_response
+def get_btc_rpc_metrics(symbol, session):
+    return rpc_metrics()
+
+
+@app.route('/telegram-id-cache-metrics', methods=['GET'])
+@requires_auth
+@json_response
+def get_telegram_id_cache_metrics(symbol, session):
+    return telegram_ids.stats()
+
+
+@app.route('/metrics', methods=['GET'])
+@requires_auth
+def get_metrics(symbol):
+    return Response(sql_metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,67 @@
+"""
+Measures address validation throughput: the local validators without and with the LRU cache, and optionally the
+validateaddress round trip to the BTC node it replaces.
+
+    python -m benchmarks.address_validation --iterations 20000
+    python -m benchmarks.address_validation --iterations 200 --node
+
+Needs no database, --node needs BTC_NODE.
+"""
+import argparse
+import time
+
+from crypto.address_validation import validate_address
+
+ADDRESSES = {
+    'btc': [
+        '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa',
+        '3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLy',
+        'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4',
+        'bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqzk5jj0',
+        '1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNb',
+    ],
+    'eth': [
+        '0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed',
+        '0x5aaeb6053f3e94c9b9a09f33669435e7ef1beaed',
+        '0x5aaeb6053F3E94C9b9A09f33669435E7Ef1BeAed',
+    ],
+    'usdt': [
+        'TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t',
+        'TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6u',
+    ],
+}
+
+
+def run(func, iterations, symbols=tuple(ADDRESSES)):
+    calls = [(symbol, address) for symbol in symbols for address in ADDRESSES[symbol]]
+    started = time.perf_counter()
+    for i in range(iterations):
+        func(*calls[i % len(calls)])
+    elapsed = time.perf_counter() - started
+    return {'per_second': iterations / elapsed, 'us_per_call': elapsed / iterations * 10 ** 6}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--node', action='store_true', help='also measure validateaddress on the BTC node')
+    args = parser.parse_args()
+
+    results = {
+        'local': run(validate_address.__wrapped__, args.iterations),
+        'local cached': run(validate_address, args.iterations),
+    }
+    if args.node:
+        from crypto.btc import BTC
+        results['btc node'] = run(
+            lambda symbol, address: BTC.is_address_valid(address), min(args.iterations, 100), symbols=('btc',)
+        )
+
+    print('address validation')
+    print(f"{'variant':<16}{'calls/s':>14}{'us/call':>12}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['per_second']:>14.0f}{r['us_per_call']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import statistics
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from system.settings import Session, db
+
+
+@contextmanager
+def rollback_session():
+    # benchmarks seed their own data and never leave it behind
+    session = Session()
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+
+
+@contextmanager
+def count_queries(engine=db):
+    counter = {'queries': 0}
+
+    def _count(*args, **kwargs):
+        counter['queries'] += 1
+
+    event.listen(engine, 'before_cursor_execute', _count)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', _count)
+
+
+def measure(func, session, repeat=5):
+    # every run happens inside a savepoint, so functions that mark rows as processed see the same data each time
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        session.begin_nested()
+        with count_queries() as counter:
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = counter['queries']
+        session.rollback()
+    return {'queries': queries, 'median_ms': statistics.median(timings), 'best_ms': min(timings)}
+
+
+def print_report(title, results):
+    print(title)
+    print(f"{'variant':<16}{'queries':>10}{'median ms':>14}{'best ms':>12}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['queries']:>10}{r['median_ms']:>14.2f}{r['best_ms']:>12.2f}")
@@ -0,0 +1,214 @@
+"""
+Compares the batched DataHandler.get_updates with the former per-notification fan-out.
+
+    python -m benchmarks.get_updates --notifications 2000
+
+Seeds users, deals, messages, transactions and notifications in a transaction that is rolled back at the end,
+so it is safe to run against a development database.
+"""
+import argparse
+import random
+
+from benchmarks.common import rollback_session, measure, print_report
+from crypto.manager import manager
+from data_handler import dh
+from system.constants import DISPUTE_TIME, STATES
+from utils.utils import get_deal_id, get_lot_id, get_nickname, generate_ref_code
+
+SYMBOL = 'btc'
+DEAL_TYPES = ('deal', 'dispute', 'closed_dispute', 'income_referral', 'timeout', 'cancel_deal')
+
+
+# the former per-row loaders, one or two queries per notification
+
+def _legacy_message(message_id, session):
+    q = f"""
+        SELECT sender.id, message, receiver.id, media_id
+        FROM usermessage um
+        LEFT JOIN "user" sender ON um.sender_id = sender.id
+        LEFT JOIN "user" receiver ON um.receiver_id = receiver.id
+        WHERE um.id = {message_id}
+    """
+    sender_id, message, receiver_id, media_id = session.execute(q).fetchone()
+    if media_id:
+        url = session.execute("SELECT url FROM media WHERE id = :mid", {'mid': media_id}).scalar()
+    else:
+        url = None
+    return {'sender_id': sender_id, 'message': message, 'receiver_id': receiver_id, 'media_url': url}
+
+
+def _legacy_transaction(transaction_id, session):
+    q = f"""
+        SELECT user_id, type, amount_units, tx_hash, symbol
+        FROM transactions t
+        LEFT JOIN wallet w ON t.wallet_id = w.id
+        WHERE t.id = {transaction_id}
+    """
+    user_id, t, amount_units, tx_hash, symbol = session.execute(q).fetchone()
+    res = {'user_id': user_id, 'amount': amount_units, 'type': t}
+    if t == 'out':
+        res['link'] = manager.get_link(symbol, tx_hash)
+    return res
+
+
+def _legacy_deal_timeout(deal_id, session, user_id):
+    identificator = session.execute(f'SELECT identificator FROM deal d WHERE d.id = {deal_id}').fetchone()[0]
+    return {'deal_id': identificator, 'user_id': user_id}
+
+
+def _legacy_deal_referral(deal_id, session, user_id, symbol):
+    q = """
+        SELECT identificator, referral_commission_buyer_subunits, buyer_id
+        FROM deal d
+        WHERE d.id = :did
+        LIMIT 1
+    """
+    identificator, ref_comm, referral_id = session.execute(q, {'did': deal_id}).fetchone()
+    return {
+        'identificator': identificator,
+        'user_id': user_id,
+        'referral_id': referral_id,
+        'amount': manager.from_subunit(symbol, ref_comm)
+    }
+
+
+def _legacy_deal(deal_id, session, user_id):
+    q = 'SELECT seller_id, buyer_id, identificator FROM deal WHERE id = :did LIMIT 1'
+    seller_id, buyer_id, identificator = session.execute(q, {'did': deal_id}).fetchone()
+    return {'user_id': user_id, 'opponent': seller_id if seller_id != user_id else buyer_id, 'deal_id': identificator}
+
+
+def _legacy_dispute(deal_id, session, user_id, admin=False):
+    identificator = session.execute('SELECT identificator FROM deal WHERE id = :did LIMIT 1', {'did': deal_id}).scalar()
+    return {'user_id': user_id, 'deal_id': identificator, 'dispute_time': DISPUTE_TIME, 'admin': admin}
+
+
+def _legacy_closed_dispute(deal_id, session, user_id, admin=False):
+    q = """
+        SELECT deal.identificator, (SELECT type FROM lot WHERE id = lot_id), deal.state
+        FROM deal
+        WHERE deal.id = :did
+        LIMIT 1
+    """
+    identificator, lot_type, state = session.execute(q, {'did': deal_id}).fetchone()
+    winner = 'seller' if state == STATES[-1] else 'buyer'
+    return {'user_id': user_id, 'winner': winner, 'deal_id': identificator, 'admin': admin}
+
+
+def _legacy_get_updates(symbol, session):
+    updates = session.execute(
+        """
+            SELECT user_id, n.id, type, deal_id, transaction_id, message_id, join_id, promocodeactivation_id
+            FROM notification n
+            WHERE NOT telegram_notified AND symbol = :sym
+        """, {'sym': symbol}
+    ).fetchall()
+    res = []
+    for user_id, notification_id, t, deal_id, transaction_id, message_id, _, _ in updates:
+        if t == 'message':
+            res.append(_legacy_message(message_id, session))
+        elif t == 'transaction':
+            res.append(_legacy_transaction(transaction_id, session))
+        elif t == 'deal':
+            res.append(_legacy_deal(deal_id, session, user_id))
+        elif t == 'dispute':
+            res.append(_legacy_dispute(deal_id, session, user_id))
+        elif t == 'closed_dispute':
+            res.append(_legacy_closed_dispute(deal_id, session, user_id))
+        elif t == 'income_referral':
+            res.append(_legacy_deal_referral(deal_id, session, user_id, symbol))
+        else:
+            res.append(_legacy_deal_timeout(deal_id, session, user_id))
+        session.execute(f'UPDATE notification SET telegram_notified = TRUE WHERE id = {notification_id}')
+    res.append(dh._get_earnings(symbol, session))
+    res.append(dh._get_secondary_node_updates(session))
+    res.append(dh._get_control_usermessages(symbol, session))
+    return res
+
+
+def _create_user(session, currency):
+    return session.execute(
+        """
+            INSERT INTO "user" (telegram_id, nickname, ref_kw, currency, is_verify)
+            VALUES (:tid, :nickname, :ref_kw, :currency, TRUE)
+            RETURNING id
+        """, {'tid': random.randint(10 ** 8, 10 ** 9), 'nickname': get_nickname('bench'),
+              'ref_kw': generate_ref_code(), 'currency': currency}
+    ).scalar()
+
+
+def seed(session, notifications):
+    # keep seeded notifications the only pending ones for the benchmark symbol
+    session.execute('UPDATE notification SET telegram_notified = TRUE WHERE symbol = :sym', {'sym': SYMBOL})
+    currency = session.execute('SELECT id FROM currency LIMIT 1').scalar()
+    seller_id, buyer_id = _create_user(session, currency), _create_user(session, currency)
+    wallet_id = session.execute(
+        "INSERT INTO wallet (user_id, symbol, private_key) VALUES (:uid, :sym, :pk) RETURNING id",
+        {'uid': seller_id, 'sym': SYMBOL, 'pk': get_lot_id()}
+    ).scalar()
+    lot_id = session.execute(
+        """
+            INSERT INTO lot (identificator, limit_from, limit_to, rate, user_id, symbol, currency, type)
+            VALUES (:identificator, 100, 1000, 100, :uid, :sym, :currency, 'sell')
+            RETURNING id
+        """, {'identificator': get_lot_id(), 'uid': seller_id, 'sym': SYMBOL, 'currency': currency}
+    ).scalar()
+    for i in range(notifications):
+        kind = i % 3
+        values = {'uid': buyer_id, 'sym': SYMBOL, 'deal_id': None, 'transaction_id': None, 'message_id': None}
+        if kind == 0:
+            values['type'] = 'message'
+            values['message_id'] = session.execute(
+                """
+                    INSERT INTO usermessage (sender_id, receiver_id, message, symbol, controled)
+                    VALUES (:sender, :receiver, 'hello', :sym, TRUE)
+                    RETURNING id
+                """, {'sender': seller_id, 'receiver': buyer_id, 'sym': SYMBOL}
+            ).scalar()
+        elif kind == 1:
+            values['type'] = 'transaction'
+            values['transaction_id'] = session.execute(
+                """
+                    INSERT INTO transactions (wallet_id, type, to_address, amount_units, tx_hash)
+                    VALUES (:wid, 'in', 'address', 1, :tx_hash)
+                    RETURNING id
+                """, {'wid': wallet_id, 'tx_hash': get_lot_id()}
+            ).scalar()
+        else:
+            values['type'] = DEAL_TYPES[i % len(DEAL_TYPES)]
+            values['deal_id'] = session.execute(
+                """
+                    INSERT INTO deal (
+                        identificator, amount_currency, amount_subunit, amount_subunit_frozen, buyer_id, seller_id,
+                        symbol, currency, lot_id, rate, requisite
+                    )
+                    VALUES (:identificator, 100, 100000, 100000, :buyer, :seller, :sym, :currency, :lot_id, 100, '1')
+                    RETURNING id
+                """, {'identificator': get_deal_id(), 'buyer': buyer_id, 'seller': seller_id, 'sym': SYMBOL,
+                      'currency': currency, 'lot_id': lot_id}
+            ).scalar()
+        session.execute(
+            """
+                INSERT INTO notification (user_id, symbol, type, deal_id, transaction_id, message_id)
+                VALUES (:uid, :sym, :type, :deal_id, :transaction_id, :message_id)
+            """, values
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--notifications', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with rollback_session() as session:
+        seed(session, args.notifications)
+        results = {
+            'per-row': measure(lambda: _legacy_get_updates(SYMBOL, session), session, args.repeat),
+            'batched': measure(lambda: dh.get_updates(SYMBOL, session), session, args.repeat),
+        }
+    print_report(f'get_updates, {args.notifications} pending notifications', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Compares the former deals report, fetched whole with user and lot mappings, with the streamed NDJSON export.
+
+    python -m benchmarks.report_export --deals 1000000
+
+Seeds the deals in a transaction that is rolled back at the end, so it is safe to run against a development
+database. Reports the time and the peak Python memory of building the whole response body.
+"""
+import argparse
+import time
+import tracemalloc
+
+from benchmarks.common import rollback_session
+from data_handler import dh
+from system.settings import app
+from utils.report_export import to_ndjson
+from utils.utils import get_nickname, generate_ref_code, get_lot_id
+
+SYMBOL = 'btc'
+
+
+def _legacy_deals_report(session):
+    deals = session.execute(
+        """
+            SELECT d.identificator, lot_id, amount_currency, currency, d.created_at, state, end_time,
+                buyer_id, seller_id, amount_subunit,
+                buyer_commission_subunits + seller_commission_subunits - referral_commission_seller_subunits - referral_commission_buyer_subunits
+            FROM deal d
+            WHERE symbol = :symbol
+            ORDER BY d.id
+        """, {'symbol': SYMBOL}
+    ).fetchall()
+    user_id_nickname = dict(session.execute('SELECT id, nickname FROM "user"').fetchall())
+    lot_id_idents = dict(session.execute('SELECT id, identificator FROM lot').fetchall())
+    return [
+        {
+            'id': deal, 'lot': lot_id_idents[lot], 'amount': f'{amount_currency} {currency.upper()}',
+            'created': created, 'end': end_time, 'status': state, 'buyer': user_id_nickname[buyer],
+            'seller': user_id_nickname[seller], 'income': income, 'crypto': amount_subunit
+        }
+        for deal, lot, amount_currency, currency, created, state, end_time, buyer, seller, amount_subunit, income in deals
+    ]
+
+
+def _create_user(session, currency):
+    return session.execute(
+        """
+            INSERT INTO "user" (telegram_id, nickname, ref_kw, currency, is_verify)
+            VALUES ((random() * 10 ^ 9)::bigint, :nickname, :ref_kw, :currency, TRUE)
+            RETURNING id
+        """, {'nickname': get_nickname('bench'), 'ref_kw': generate_ref_code(), 'currency': currency}
+    ).scalar()
+
+
+def seed(session, deals):
+    currency = session.execute('SELECT id FROM currency LIMIT 1').scalar()
+    seller_id, buyer_id = _create_user(session, currency), _create_user(session, currency)
+    lot_id = session.execute(
+        """
+            INSERT INTO lot (identificator, limit_from, limit_to, rate, user_id, symbol, currency, type)
+            VALUES (:identificator, 100, 1000, 100, :uid, :sym, :currency, 'sell')
+            RETURNING id
+        """, {'identificator': get_lot_id(), 'uid': seller_id, 'sym': SYMBOL, 'currency': currency}
+    ).scalar()
+    session.execute(
+        """
+            INSERT INTO deal (
+                identificator, amount_currency, amount_subunit, amount_subunit_frozen, buyer_id, seller_id,
+                symbol, currency, lot_id, rate, requisite
+            )
+            SELECT md5(random()::text), 100, 100000, 100000, :buyer, :seller, :sym, :currency, :lot_id, 100, '1'
+            FROM generate_series(1, :deals)
+        """, {'buyer': buyer_id, 'seller': seller_id, 'sym': SYMBOL, 'currency': currency, 'lot_id': lot_id,
+              'deals': deals}
+    )
+
+
+def _profile(func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': elapsed, 'peak_mb': peak / 2 ** 20, 'bytes': size}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--deals', type=int, default=1000000)
+    args = parser.parse_args()
+
+    with rollback_session() as session:
+        seed(session, args.deals)
+        results = {
+            'fetchall': _profile(lambda: len(app.json.dumps(_legacy_deals_report(session)))),
+            # the chunks are dropped once counted, like a WSGI server writing them to the socket
+            'streamed': _profile(
+                lambda: sum(len(chunk) for chunk in to_ndjson(dh._iter_deals_report(SYMBOL, '', session)))
+            ),
+        }
+    print(f'deals report, {args.deals} deals')
+    print(f"{'variant':<16}{'seconds':>10}{'peak MB':>12}{'body MB':>12}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['seconds']:>10.2f}{r['peak_mb']:>12.1f}{r['bytes'] / 2 ** 20:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
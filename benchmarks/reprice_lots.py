@@ -0,0 +1,95 @@
+"""
+Compares the set-based lot repricing with the former per-lot statements and per-pair clamping.
+
+    python -m benchmarks.reprice_lots --lots 100000
+
+Seeds rates, a currency and coefficient lots in a transaction that is rolled back at the end,
+so it is safe to run against a development database.
+"""
+import argparse
+import random
+from collections import defaultdict
+
+from benchmarks.common import rollback_session, measure, print_report
+from jobs.lots.update_rate import reprice_lots
+from utils.utils import get_nickname, generate_ref_code
+
+CURRENCY = 'bnc'
+SYMBOLS = ('btc', 'eth', 'usdt')
+
+
+def _legacy_reprice_lots(session):
+    rates = defaultdict(lambda: defaultdict(int))
+    for symbol, currency, rate in session.execute("SELECT symbol, currency, rate FROM rates").fetchall():
+        rates[symbol][currency] = rate
+    lots = session.execute(
+        'SELECT id, rate, symbol, currency, coefficient FROM lot WHERE coefficient IS NOT NULL AND NOT is_deleted'
+    ).fetchall()
+    q = ""
+    for lid, rate, symbol, currency, coeff in lots:
+        q += f"UPDATE lot SET rate = {rates[symbol][currency] * coeff} WHERE id = {lid};"
+    session.execute(q)
+
+    for currency, symbol, rate in session.execute("SELECT currency, symbol, rate FROM rates").fetchall():
+        variation = session.execute(
+            "SELECT rate_variation FROM currency WHERE id = :currency", {'currency': currency}
+        ).scalar() * rate
+        session.execute(
+            "UPDATE lot SET rate = :maximum WHERE rate > :maximum AND currency = :currency AND symbol = :symbol",
+            {'maximum': rate + variation, 'currency': currency, 'symbol': symbol}
+        )
+        session.execute(
+            "UPDATE lot SET rate = :minimum WHERE rate < :minimum AND currency = :currency AND symbol = :symbol",
+            {'minimum': rate - variation, 'currency': currency, 'symbol': symbol}
+        )
+
+
+def seed(session, lots):
+    session.execute(
+        "INSERT INTO currency (id, usd_rate, rate_variation) VALUES (:cur, 90, 0.15) ON CONFLICT DO NOTHING",
+        {'cur': CURRENCY}
+    )
+    for symbol in SYMBOLS:
+        session.execute(
+            """
+                INSERT INTO rates (symbol, currency, rate) VALUES (:sym, :cur, :rate)
+                ON CONFLICT (symbol, currency) DO UPDATE SET rate = EXCLUDED.rate
+            """, {'sym': symbol, 'cur': CURRENCY, 'rate': random.randint(100, 10 ** 6)}
+        )
+    user_id = session.execute(
+        """
+            INSERT INTO "user" (telegram_id, nickname, ref_kw, currency, is_verify)
+            VALUES (:tid, :nickname, :ref_kw, :currency, TRUE)
+            RETURNING id
+        """, {'tid': random.randint(10 ** 8, 10 ** 9), 'nickname': get_nickname('bench'),
+              'ref_kw': generate_ref_code(), 'currency': CURRENCY}
+    ).scalar()
+    # a tenth of the lots has a fixed rate, a few of them out of the allowed variation
+    session.execute(
+        """
+            INSERT INTO lot (identificator, limit_from, limit_to, rate, coefficient, user_id, symbol, currency, type)
+            SELECT md5(random()::text), 100, 1000, 1 + random() * 10 ^ 6,
+                CASE WHEN i % 10 = 0 THEN NULL ELSE 0.9 + random() * 0.2 END,
+                :uid, (ARRAY['btc', 'eth', 'usdt'])[1 + i % 3], :cur, 'sell'
+            FROM generate_series(1, :lots) i
+        """, {'uid': user_id, 'cur': CURRENCY, 'lots': lots}
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lots', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with rollback_session() as session:
+        seed(session, args.lots)
+        results = {
+            'per-lot': measure(lambda: _legacy_reprice_lots(session), session, args.repeat),
+            'set-based': measure(lambda: reprice_lots(session), session, args.repeat),
+        }
+    print_report(f'lot repricing, {args.lots} lots', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Overhead of the per-request SQL instrumentation on short statements, the worst case for it.
+
+    python -m benchmarks.sql_metrics --queries 5000
+
+Runs the same statements with the event hooks removed, with the hooks inside a unit (a request or job run)
+and with the hooks outside of one (background threads).
+"""
+import argparse
+
+from benchmarks.common import rollback_session, measure, print_report
+from system.settings import db
+from utils.sql_metrics import install, uninstall, unit
+
+
+def _run(session, queries):
+    for i in range(queries):
+        session.execute('SELECT id, nickname FROM "user" WHERE id = :id', {'id': i})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with rollback_session() as session:
+        results = {'no hooks': measure(lambda: _run(session, args.queries), session, args.repeat)}
+        install(db)
+        try:
+            with unit('benchmark'):
+                results['in a unit'] = measure(lambda: _run(session, args.queries), session, args.repeat)
+            results['background'] = measure(lambda: _run(session, args.queries), session, args.repeat)
+        finally:
+            uninstall(db)
+    print_report(f'sql metrics overhead, {args.queries} statements', results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Local address validation, no node round trip: base58check and bech32/bech32m (BIP-173, BIP-350) for BTC,
+EIP-55 checksums for ETH and base58check for TRON.
+"""
+from functools import lru_cache
+from os import environ
+
+import base58
+from eth_utils import is_hex_address, to_checksum_address
+
+ADDRESS_VALIDATION_CACHE_SIZE = int(environ.get('ADDRESS_VALIDATION_CACHE_SIZE', 10_000))
+
+BECH32_CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+BECH32_CONST = 1
+BECH32M_CONST = 0x2bc830a3
+
+if environ.get('TEST'):
+    BTC_BASE58_VERSIONS = {0x6f, 0xc4}
+    BTC_HRP = 'tb'
+else:
+    BTC_BASE58_VERSIONS = {0x00, 0x05}
+    BTC_HRP = 'bc'
+TRON_VERSION = 0x41
+
+
+def _bech32_polymod(values):
+    generator = (0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3)
+    chk = 1
+    for value in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            chk ^= generator[i] if ((top >> i) & 1) else 0
+    return chk
+
+
+def _bech32_decode(address):
+    """
+    (hrp, data, checksum constant) or None, the constant tells bech32 from bech32m
+    """
+    if any(ord(c) < 33 or ord(c) > 126 for c in address) or (address.lower() != address and address.upper() != address):
+        return None
+    address = address.lower()
+    pos = address.rfind('1')
+    if pos < 1 or pos + 7 > len(address) or len(address) > 90:
+        return None
+    if not all(c in BECH32_CHARSET for c in address[pos + 1:]):
+        return None
+    hrp = address[:pos]
+    data = [BECH32_CHARSET.find(c) for c in address[pos + 1:]]
+    expanded_hrp = [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+    const = _bech32_polymod(expanded_hrp + data)
+    if const not in (BECH32_CONST, BECH32M_CONST):
+        return None
+    return hrp, data[:-6], const
+
+
+def _convert_bits(data, from_bits, to_bits):
+    acc, bits, result = 0, 0, []
+    max_value = (1 << to_bits) - 1
+    for value in data:
+        if value >> from_bits:
+            return None
+        acc = (acc << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            result.append((acc >> bits) & max_value)
+    # segwit programs are padded with at most 4 zero bits
+    if bits >= from_bits or ((acc << (to_bits - bits)) & max_value):
+        return None
+    return result
+
+
+def _is_segwit_address_valid(address, hrp):
+    decoded = _bech32_decode(address)
+    if decoded is None or decoded[0] != hrp or not decoded[1]:
+        return False
+    _, data, const = decoded
+    version, program = data[0], _convert_bits(data[1:], 5, 8)
+    if program is None or version > 16 or not 2 <= len(program) <= 40:
+        return False
+    if version == 0:
+        return const == BECH32_CONST and len(program) in (20, 32)
+    return const == BECH32M_CONST
+
+
+def _base58check_payload(address):
+    try:
+        return base58.b58decode_check(address)
+    except ValueError:
+        return None
+
+
+def is_btc_address_valid(address):
+    if address.lower().startswith(BTC_HRP + '1'):
+        return _is_segwit_address_valid(address, BTC_HRP)
+    payload = _base58check_payload(address)
+    return payload is not None and len(payload) == 21 and payload[0] in BTC_BASE58_VERSIONS
+
+
+def is_eth_address_valid(address):
+    if not is_hex_address(address):
+        return False
+    digits = address[2:] if address[:2].lower() == '0x' else address
+    # mixed case addresses must carry a valid EIP-55 checksum
+    return digits.islower() or digits.isupper() or digits.isdigit() or to_checksum_address(digits)[2:] == digits
+
+
+def is_tron_address_valid(address):
+    payload = _base58check_payload(address)
+    return payload is not None and len(payload) == 21 and payload[0] == TRON_VERSION
+
+
+VALIDATORS = {
+    'btc': is_btc_address_valid,
+    'eth': is_eth_address_valid,
+    'trx': is_tron_address_valid,
+    'usdt': is_tron_address_valid,
+}
+
+
+@lru_cache(maxsize=ADDRESS_VALIDATION_CACHE_SIZE)
+def validate_address(symbol, address):
+    """
+    True or False, None when there is no local validator for the symbol
+    """
+    validator = VALIDATORS.get(symbol)
+    if validator is None:
+        return None
+    if not isinstance(address, str) or not address.isascii():
+        return False
+    return validator(address)
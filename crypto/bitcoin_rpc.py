@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+from os import environ
+
+import requests
+from bitcoinrpc.authproxy import JSONRPCException
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BTC_RPC_POOL_SIZE = int(environ.get('BTC_RPC_POOL_SIZE', 10))
+BTC_RPC_CONNECT_TIMEOUT = float(environ.get('BTC_RPC_CONNECT_TIMEOUT', 3))
+BTC_RPC_READ_TIMEOUT = float(environ.get('BTC_RPC_READ_TIMEOUT', 30))
+BTC_RPC_SLOW_READ_TIMEOUT = float(environ.get('BTC_RPC_SLOW_READ_TIMEOUT', 120))
+# wallet scans and transaction building take long on a big wallet
+SLOW_METHODS = frozenset({
+    'listtransactions', 'listsinceblock', 'listunspent', 'sendtoaddress', 'sendmany',
+    'walletcreatefundedpsbt', 'walletprocesspsbt',
+})
+
+
+def _encode_decimal(o):
+    if isinstance(o, Decimal):
+        return float(round(o, 8))
+    raise TypeError(f'{o!r} is not JSON serializable')
+
+
+class BitcoinRPC:
+    """
+    Keep-alive JSON-RPC client of one bitcoind. Only connection errors are retried, a call that may have reached
+    the node (sendtoaddress, sendmany) is never sent twice. Latency and errors are collected per method.
+    Methods are called as attributes, like with AuthServiceProxy: rpc.getbalance('*', 1)
+    """
+
+    def __init__(self, url, pool_size=BTC_RPC_POOL_SIZE, timeouts=None):
+        self.url = url
+        self.timeouts = timeouts or {}
+        self.session = requests.Session()
+        retry = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.3, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._ids = iter(range(1, 2 ** 63))
+        self._metrics = defaultdict(lambda: {'count': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0})
+        self._lock = threading.Lock()
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+        return lambda *params: self.call(method, *params)
+
+    def _timeout(self, methods):
+        read_timeout = max(
+            self.timeouts.get(m, BTC_RPC_SLOW_READ_TIMEOUT if m in SLOW_METHODS else BTC_RPC_READ_TIMEOUT)
+            for m in methods
+        )
+        return BTC_RPC_CONNECT_TIMEOUT, read_timeout
+
+    def _post(self, payload, methods):
+        started = time.monotonic()
+        failed = True
+        try:
+            res = self.session.post(
+                self.url,
+                data=json.dumps(payload, default=_encode_decimal),
+                headers={'Content-Type': 'application/json'},
+                timeout=self._timeout(methods),
+            )
+            # bitcoind answers rpc errors with 404/500 and a json body
+            if res.status_code not in (200, 404, 500):
+                res.raise_for_status()
+            data = res.json(parse_float=Decimal)
+            failed = isinstance(data, dict) and data.get('error') is not None
+            return data
+        finally:
+            elapsed = time.monotonic() - started
+            for method in methods:
+                self._record(method, elapsed, failed)
+
+    def _request(self, method, params):
+        with self._lock:
+            request_id = next(self._ids)
+        return {'version': '1.1', 'method': method, 'params': list(params), 'id': request_id}
+
+    def call(self, method, *params):
+        data = self._post(self._request(method, params), [method])
+        if data.get('error') is not None:
+            raise JSONRPCException(data['error'])
+        return data['result']
+
+    def batch(self, calls):
+        """
+        Sends (method, *params) calls in one request, results come in the order of calls.
+        The first failed call raises JSONRPCException
+        """
+        if not calls:
+            return []
+        payload = [self._request(method, params) for method, *params in calls]
+        data = self._post(payload, [method for method, *_ in calls])
+        if isinstance(data, dict):
+            raise JSONRPCException(data.get('error') or {'code': -32700, 'message': 'invalid batch response'})
+        by_id = {item['id']: item for item in data}
+        results = []
+        for request in payload:
+            item = by_id[request['id']]
+            if item.get('error') is not None:
+                raise JSONRPCException(item['error'])
+            results.append(item['result'])
+        return results
+
+    def _record(self, key, elapsed, failed):
+        with self._lock:
+            item = self._metrics[key]
+            item['count'] += 1
+            item['errors'] += int(failed)
+            item['total_time'] += elapsed
+            item['max_time'] = max(item['max_time'], elapsed)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                key: {
+                    'count': item['count'],
+                    'errors': item['errors'],
+                    'avg_time': item['total_time'] / item['count'] if item['count'] else 0,
+                    'max_time': item['max_time'],
+                }
+                for key, item in self._metrics.items()
+            }
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def rpc_client(env_name):
+    """
+    One pooled client per node, the url is read from env on first use
+    """
+    with _clients_lock:
+        if env_name not in _clients:
+            _clients[env_name] = BitcoinRPC(environ[env_name])
+        return _clients[env_name]
+
+
+def rpc_metrics():
+    with _clients_lock:
+        clients = dict(_clients)
+    return {env_name: client.metrics() for env_name, client in clients.items()}
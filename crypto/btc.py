@@ -1,16 +1,16 @@
 from decimal import Decimal
 from os import environ as env
 
-from bitcoinrpc.authproxy import AuthServiceProxy
+from crypto.bitcoin_rpc import rpc_client
 
 
 class BTC:
     """
     PK IS ADDRESS!
     """
-    RPC = lambda: AuthServiceProxy(env['BTC_NODE'])
-    SECONDARY_RPC = lambda: AuthServiceProxy(env['SECONDARY_BTC_NODE'])
-    PAYMENTS_RPC = lambda: AuthServiceProxy(env['PAYMENTS_BTC_NODE'])
+    RPC = lambda: rpc_client('BTC_NODE')
+    SECONDARY_RPC = lambda: rpc_client('SECONDARY_BTC_NODE')
+    PAYMENTS_RPC = lambda: rpc_client('PAYMENTS_BTC_NODE')
     LINK = 'https://live.blockcypher.com/btc-testnet/tx/' if env.get('TEST') else "https://www.blockchain.com/btc/tx/"
     DECIMALS = 8
 
@@ -40,10 +40,12 @@ class BTC:
 
     @classmethod
     def finalize_transaction(cls, psbt):
-        res = cls.RPC().walletprocesspsbt(psbt)
-        res = cls.RPC().finalizepsbt(res['psbt'])
+        # every step needs the previous result, so these can't be batched, they share one kept-alive connection
+        rpc = cls.RPC()
+        res = rpc.walletprocesspsbt(psbt)
+        res = rpc.finalizepsbt(res['psbt'])
         hex_str = res['hex']
-        res = cls.RPC().decoderawtransaction(hex_str)
+        res = rpc.decoderawtransaction(hex_str)
         print(res)
         return res, hex_str
 
@@ -55,6 +57,10 @@ class BTC:
     def get_new_pk(cls):
         return cls._get_new_address()
 
+    @classmethod
+    def get_new_pks(cls, count):
+        return cls.RPC().batch([('getnewaddress',)] * count)
+
     @classmethod
     def from_subunit(cls, val: Decimal):
         return Decimal(str(val)) / Decimal('10')**Decimal('8')
@@ -96,17 +102,37 @@ class BTC:
     def get_cpayment_node_balance(cls):
         return cls.PAYMENTS_RPC().getbalance()
 
+    @staticmethod
+    def _unconfirmed_deposits(txs):
+        return sum([item['amount'] for item in txs if item['category'] == 'receive' and item['confirmations'] == 0])
+
     @classmethod
     def get_secondary_deposits(cls):
-        sec_txs = cls.SECONDARY_RPC().listtransactions('*', 10)
-        txs = filter(lambda item: item['category'] == 'receive' and item['confirmations'] == 0, sec_txs)
-        return sum([item['amount'] for item in txs])
+        return cls._unconfirmed_deposits(cls.SECONDARY_RPC().listtransactions('*', 10))
 
     @classmethod
     def get_cpayment_node_deposits(cls):
-        sec_txs = cls.PAYMENTS_RPC().listtransactions('*', 100)
-        txs = filter(lambda item: item['category'] == 'receive' and item['confirmations'] == 0, sec_txs)
-        return sum([item['amount'] for item in txs])
+        return cls._unconfirmed_deposits(cls.PAYMENTS_RPC().listtransactions('*', 100))
+
+    @classmethod
+    def get_secondary_funds(cls):
+        """
+        Balance plus unconfirmed deposits of the secondary node in one batch request
+        """
+        balance, txs = cls.SECONDARY_RPC().batch([('getbalance',), ('listtransactions', '*', 10)])
+        return balance + cls._unconfirmed_deposits(txs)
+
+    @classmethod
+    def get_cpayment_node_funds(cls):
+        balance, txs = cls.PAYMENTS_RPC().batch([('getbalance',), ('listtransactions', '*', 100)])
+        return balance + cls._unconfirmed_deposits(txs)
+
+    @classmethod
+    def get_node_funds(cls, limit=30):
+        """
+        (last transactions, confirmed balance, unconfirmed balance) of the main node in one batch request
+        """
+        return tuple(cls.RPC().batch([('listtransactions', '*', limit), ('getbalance', '*', 1), ('getbalance', '*', 0)]))
 
     @classmethod
     def get_node_balance(cls, confirmations=0):
@@ -120,6 +146,19 @@ class BTC:
     def get_all_transactions(cls, limit=30):
         return cls.RPC().listtransactions("*", limit)
 
+    @classmethod
+    def list_since_block(cls, block_hash, target_confirmations=1):
+        """
+        Wallet transactions in blocks after block_hash and in the mempool, lastblock of the result is the cursor
+        for the next call, it stays target_confirmations - 1 blocks behind the tip
+        """
+        return cls.RPC().listsinceblock(block_hash, target_confirmations)
+
+    @classmethod
+    def get_block_hash(cls, depth=0):
+        rpc = cls.RPC()
+        return rpc.getblockhash(max(rpc.getblockcount() - depth, 0))
+
     @classmethod
     def create_tx_out(cls, address, amount_btc, blocks_target=5):
         return cls.SECONDARY_RPC().sendtoaddress(address, amount_btc, '', '', False, False, blocks_target)
@@ -5,8 +5,12 @@ import time
 
 from web3.exceptions import TransactionNotFound
 
+from crypto.gas_oracle import GasPriceOracle
 from utils.logger import logger
 
+BALANCE_BATCH_SIZE = int(env.get('ETH_BALANCE_BATCH_SIZE', 100))
+GAS_PRICE_TIMEOUT = float(env.get('GAS_PRICE_TIMEOUT', 5))
+
 if env.get('TEST'):
     web3 = Web3(HTTPProvider('https://goerli.infura.io/v3/36748d0ec5e0460db2e5d3e699601bee'))
     chain = 5
@@ -14,6 +18,12 @@ else:
     web3 = Web3(HTTPProvider('https://mainnet.infura.io/v3/39eb4de888bf411c8cc901ed11516e45'))
     chain = 1
 
+rpc_session = requests.Session()
+
+
+class RPCBatchError(Exception):
+    pass
+
 
 class ETH:
     DECIMALS = 18
@@ -60,19 +70,78 @@ class ETH:
 
         return web3.eth.getBalance(address)
 
+    @classmethod
+    def _rpc_batch(cls, method, params_list, strict=False):
+        """
+        Calls one JSON-RPC method for every params list in a single batch request,
+        results come back in the same order, None where the node answered with an error.
+        With strict, an errored or missing item raises RPCBatchError instead, for callers that
+        must not read it as "not found"
+        """
+        if not params_list:
+            return []
+        payload = [
+            {'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params}
+            for i, params in enumerate(params_list)
+        ]
+        response = rpc_session.post(web3.provider.endpoint_uri, json=payload, timeout=30)
+        response.raise_for_status()
+        results = [None] * len(params_list)
+        answered = set()
+        for item in response.json():
+            if 'error' in item:
+                logger.error(f'{method} failed for {params_list[item["id"]]}: {item["error"]}')
+                if strict:
+                    raise RPCBatchError(f'{method} failed for {params_list[item["id"]]}: {item["error"]}')
+            else:
+                results[item['id']] = item.get('result')
+                answered.add(item['id'])
+        if strict and len(answered) != len(params_list):
+            raise RPCBatchError(f'{method}: {len(params_list) - len(answered)} items without an answer')
+        return results
+
+    @classmethod
+    def get_balances(cls, addresses):
+        """
+        Balances in wei for up to BALANCE_BATCH_SIZE addresses with one JSON-RPC batch request.
+        Addresses the node failed to answer for are left out of the result.
+        """
+        results = cls._rpc_batch('eth_getBalance', [[address, 'latest'] for address in addresses])
+        return {address: int(result, 16) for address, result in zip(addresses, results) if result is not None}
+
+    @classmethod
+    def get_receipts(cls, tx_hashes):
+        """
+        Receipts of mined transactions by hash, one batch request for all of them.
+        Raises RPCBatchError when the node failed for any of them
+        """
+        results = cls._rpc_batch('eth_getTransactionReceipt', [[tx_hash] for tx_hash in tx_hashes], strict=True)
+        return {tx_hash: receipt for tx_hash, receipt in zip(tx_hashes, results) if receipt}
+
+    @classmethod
+    def get_known_txs(cls, tx_hashes):
+        """
+        Hashes the node knows about, mined or still in its mempool.
+        Raises RPCBatchError when the node failed for any of them
+        """
+        results = cls._rpc_batch('eth_getTransactionByHash', [[tx_hash] for tx_hash in tx_hashes], strict=True)
+        return {tx_hash for tx_hash, tx in zip(tx_hashes, results) if tx}
+
+    @classmethod
+    def get_address(cls):
+        return cls.get_address_from_pk(cls.PK)
+
+    @classmethod
+    def get_nonce(cls, address, block_identifier='pending'):
+        return web3.eth.getTransactionCount(address, block_identifier)
+
     @classmethod
     def get_gas_price(cls, default_net_commission):
-        try:
-            gas_price = int(requests.get(
-                'https://api.etherscan.io/api?module=gastracker&action=gasoracle'
-            ).json()['result']['FastGasPrice'])
-            logger.info(f'Got gas price from etherscan: {gas_price}')
-        except Exception as e:
-            logger.error(e)
-            gas_price = default_net_commission
-        gas_price = min(gas_price, 200)
-        gas_price = max(gas_price, 20)
-        return gas_price
+        return gas_oracle.get(default_net_commission)['gas_price']
+
+    @classmethod
+    def get_gas_price_info(cls, default_net_commission):
+        return gas_oracle.get(default_net_commission)
 
     @classmethod
     def get_net_commission(cls, gas_price, units=False):
@@ -110,6 +179,27 @@ class ETH:
         tx_hash = web3.eth.sendRawTransaction(signed_txn.rawTransaction)
         return tx_hash.hex()
 
+    @classmethod
+    def sign_tx_out(cls, address, value, gas_price, nonce):
+        """
+        Signs a transfer of value wei with gas_price wei from the system address, nothing is sent.
+        Returns the hash and the raw transaction, so both can be stored before broadcasting
+        """
+        tx = {
+            'to': web3.toChecksumAddress(address),
+            'value': int(value),
+            'gas': cls.gas,
+            'gasPrice': int(gas_price),
+            'nonce': nonce,
+            'chainId': chain
+        }
+        signed_txn = web3.eth.account.signTransaction(tx, private_key=cls.PK)
+        return signed_txn.hash.hex(), signed_txn.rawTransaction.hex()
+
+    @classmethod
+    def send_raw_tx(cls, raw_tx):
+        return web3.eth.sendRawTransaction(raw_tx).hex()
+
     @classmethod
     def create_tx_in(cls, pk, gas_price, **kwargs):
         balance = cls.get_balance(pk=pk)
@@ -159,3 +249,17 @@ class ETH:
             time.sleep(2)
 
         # raise Exception('Can not find transaction')
+
+
+def _etherscan_gas_price():
+    return requests.get(
+        'https://api.etherscan.io/api?module=gastracker&action=gasoracle', timeout=GAS_PRICE_TIMEOUT
+    ).json()['result']['FastGasPrice']
+
+
+def _node_gas_price():
+    wei = int(ETH._rpc_batch('eth_gasPrice', [[]])[0], 16)
+    return -(-wei // 10 ** 9)
+
+
+gas_oracle = GasPriceOracle([('etherscan', _etherscan_gas_price), ('node', _node_gas_price)])
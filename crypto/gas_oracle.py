@@ -0,0 +1,65 @@
+import threading
+import time
+from os import environ
+
+from utils.logger import logger
+
+GAS_ORACLE_REFRESH_INTERVAL = float(environ.get('GAS_ORACLE_REFRESH_INTERVAL', 15))
+# a value older than this is not used, callers get their default instead
+GAS_ORACLE_MAX_AGE = float(environ.get('GAS_ORACLE_MAX_AGE', 120))
+MIN_GAS_PRICE = 20  # gwei
+MAX_GAS_PRICE = 200  # gwei
+
+
+class GasPriceOracle:
+    """
+    Gas price in gwei refreshed by a background thread from the first source that answers, callers are served
+    the last good value from memory and never wait for a source. The thread starts on the first get().
+    """
+
+    def __init__(self, sources, refresh_interval=GAS_ORACLE_REFRESH_INTERVAL, max_age=GAS_ORACLE_MAX_AGE):
+        self._sources = sources
+        self._refresh_interval = refresh_interval
+        self._max_age = max_age
+        self._value = None
+        self._source = None
+        self._updated_at = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        for name, fetch in self._sources:
+            try:
+                value = int(fetch())
+            except Exception as e:
+                logger.error(f'gas price from {name} failed: {e}')
+                continue
+            with self._lock:
+                self._value, self._source, self._updated_at = value, name, time.monotonic()
+            return True
+        return False
+
+    def _run(self):
+        while True:
+            self.refresh()
+            time.sleep(self._refresh_interval)
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='gas-price-oracle', daemon=True)
+                self._thread.start()
+
+    def get(self, default):
+        """
+        {'gas_price', 'source', 'age'}, the default with source 'default' when there is no fresh value,
+        the price is clamped to MIN_GAS_PRICE..MAX_GAS_PRICE either way
+        """
+        self._ensure_started()
+        with self._lock:
+            age = time.monotonic() - self._updated_at if self._updated_at is not None else None
+            if age is not None and age <= self._max_age:
+                value, source = self._value, self._source
+            else:
+                value, source = default, 'default'
+        return {'gas_price': min(max(int(value), MIN_GAS_PRICE), MAX_GAS_PRICE), 'source': source, 'age': age}
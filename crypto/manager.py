@@ -1,7 +1,15 @@
+from functools import lru_cache
+from os import environ
+
+from crypto.address_validation import validate_address
 from crypto.eth import ETH
 from crypto.btc import BTC
 # from crypto.usdt import USDT
 
+ADDRESS_CACHE_SIZE = int(environ.get('ADDRESS_CACHE_SIZE', 50_000))
+# ask the node about addresses the local validator rejects, for a rollout period
+ADDRESS_VALIDATION_NODE_FALLBACK = environ.get('ADDRESS_VALIDATION_NODE_FALLBACK', '').lower() in ('1', 'true')
+
 
 class Manager:
     def __init__(self):
@@ -19,7 +27,9 @@ class Manager:
         f = getattr(self.currencies[symbol], 'to_subunit')
         return f(val)
 
+    @lru_cache(maxsize=ADDRESS_CACHE_SIZE)
     def get_address_from_pk(self, symbol, pk):
+        # an address never changes for a key, the wallet.address column keeps it between restarts
         f = getattr(self.currencies[symbol], 'get_address_from_pk')
         return f(pk)
 
@@ -31,9 +41,18 @@ class Manager:
         f = getattr(self.currencies[symbol], 'get_new_pk')
         return f()
 
+    def get_new_pks(self, symbol, count):
+        currency = self.currencies[symbol]
+        if hasattr(currency, 'get_new_pks'):
+            return currency.get_new_pks(count)
+        return [currency.get_new_pk() for _ in range(count)]
+
     def is_address_valid(self, symbol, address):
-        f = getattr(self.currencies[symbol], 'is_address_valid')
-        return f(address)
+        is_valid = validate_address(symbol, address)
+        if is_valid is None or (not is_valid and ADDRESS_VALIDATION_NODE_FALLBACK):
+            f = getattr(self.currencies[symbol], 'is_address_valid')
+            return f(address)
+        return is_valid
 
     def get_link(self, symbol, tx_hash):
         f = getattr(self.currencies[symbol], 'get_link')
@@ -0,0 +1,28 @@
+import threading
+
+
+class NonceManager:
+    """
+    Hands out nonces of one sending address from a local counter, the node is asked only on the first use
+    and after reset(), e.g. when a nonce turned out to be taken by a transaction sent from elsewhere.
+    """
+
+    def __init__(self, fetch_nonce):
+        self._fetch_nonce = fetch_nonce
+        self._next = None
+        self._lock = threading.Lock()
+
+    def reserve(self, floor=0):
+        """
+        floor is the lowest nonce that may be handed out, the one after the last nonce already in use
+        """
+        with self._lock:
+            if self._next is None:
+                self._next = self._fetch_nonce()
+            nonce = self._next = max(self._next, floor)
+            self._next += 1
+            return nonce
+
+    def reset(self):
+        with self._lock:
+            self._next = None
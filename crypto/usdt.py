@@ -3,7 +3,7 @@ from decimal import Decimal
 from os import environ as env
 
 # from tronapi import Tron as tron_helper
-# from tronpy.keys import PrivateKey
+# from tronpy.keys import PrivateKey, to_base58check_address, to_hex_address
 
 # from crypto.trx import TRX, tron
 
@@ -18,6 +18,8 @@ class USDT(TRX):
         contract = tron.get_contract('TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t')
 
     DECIMALS = 18 if is_test else 6
+    # keccak256('Transfer(address,address,uint256)')
+    TRANSFER_TOPIC = 'ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
 
     @classmethod
     def from_subunit(cls, val):
@@ -51,6 +53,29 @@ class USDT(TRX):
         balance = cls.contract.functions.balanceOf(address)
         return balance
 
+    @classmethod
+    def get_latest_block_number(cls):
+        return tron.get_latest_block_number()
+
+    @classmethod
+    def get_transfers(cls, block_number):
+        """
+        (txid, to_address, amount in subunits) of the contract Transfer events in the block, one request per block
+        """
+        # logs carry the contract and topic addresses as hex without the 41 prefix
+        contract = to_hex_address(cls.contract.contract_address)[2:]
+        infos = tron.provider.make_request('wallet/gettransactioninfobyblocknum', {'num': block_number})
+        transfers = []
+        for info in infos or []:
+            if info.get('receipt', {}).get('result', 'SUCCESS') != 'SUCCESS':
+                continue
+            for log in info.get('log', []):
+                topics = log.get('topics', [])
+                if log.get('address') != contract or len(topics) != 3 or topics[0] != cls.TRANSFER_TOPIC:
+                    continue
+                transfers.append((info['id'], to_base58check_address('41' + topics[2][-40:]), int(log['data'], 16)))
+        return transfers
+
     @classmethod
     def create_tx_in(cls, pk):
         system_address = cls.get_address_from_pk(cls.PK)
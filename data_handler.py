@@ -1,5 +1,6 @@
 import re
 import math
+from collections import defaultdict
 from datetime import datetime, timedelta
 from datetime import timezone
 from decimal import Decimal
@@ -15,29 +16,33 @@ from crypto.trx import TRX
 from system.constants import (
     ONLINE_MINUTES, PROFITS_CHAT, MESSAGES_CHAT, RATING_SMILES, MINUS_RATING_SMILE, CONTROL_CHATS,
     LOT_TYPE_BUY, LOT_TYPE_SELL, STATES, DISPUTE_TIME, MIN_PROMOCODE_AMOUNT,
-    EARNINGS_CHAT, DealTypes, Action, OperationTypes, DEAL_CONTROL_CHAT, WITHDRAWAL_DEFAULT_LIMITS)
-from system.funds_changer import change_frozen, change_balance, freeze, unfreeze
-from system.settings import TEST
+    EARNINGS_CHAT, DealTypes, Action, OperationTypes, DEAL_CONTROL_CHAT, WITHDRAWAL_DEFAULT_LIMITS,
+    NOTIFICATION_UPDATE_TYPES)
+from system import address_pool
+from system.funds_changer import change_frozen, change_balance, change_funds_many, freeze, unfreeze
+from system.settings import TEST, cache, telegram_ids
 from utils.binance_client import binance_client
-from utils.db_sessions import session_scope
-from utils.emails import receipt
+from utils.db import stream_rows
+from utils.db_sessions import session_scope, on_commit
 from utils.logger import logger
+from utils.last_action import last_actions
+from utils.loaders import loader_for, loading, USER_COLUMNS, LOT_COLUMNS
+from utils.order_book import order_book
+from utils.outbox import enqueue
 from utils.notifications_queue import create_deal_notification, create_closed_dispute_notification, \
     create_message_notification
 # from utils.s3 import upload_file_to_s3, insert_dynamo
 from utils.utils import (
     generate_nickname, generate_promocode, generate_lot_id,
     generate_deal_id, generate_ref_code, generate_campaign_id,
-    create_operation, get_purchase, complete_purchase, complete_payment_v2, complete_sell, get_sell,
+    create_operation, get_purchase, get_sell,
     create_deal_commission,
-    update_deal_commission, date_iter, find_object_by_datetime, update_sale_v2, complete_sale_v2,
+    update_deal_commission, date_iter, find_object_by_datetime,
     get_merchant_commission, get_merchant, get_sale_v2, get_cpayment, get_withdrawal, localize_datetime,
     update_purchase, update_payment_v2, get_payment_v2
 )
 from utils.validators import is_amount_precision_right_for_symbol
 
-LAST_USER_ACTION_TIME = {}
-
 
 class DataHandler:
     def __init__(self):
@@ -56,166 +61,22 @@ class DataHandler:
             WHERE symbol = :sym AND currency = :cur
             LIMIT 1
         """
-        return session.execute(q, {'sym': symbol, 'cur': currency}).scalar()
+        return cache.get_or_load(
+            'rates', (symbol, currency), lambda: session.execute(q, {'sym': symbol, 'cur': currency}).scalar()
+        )
 
     def is_user_exists(self, telegram_id, session=None):
+        q = 'SELECT EXISTS(SELECT 1 FROM "user" WHERE telegram_id = :tid)'
         if session:
-            return session.execute(f'SELECT EXISTS(SELECT 1 from "user" where telegram_id = {telegram_id})').scalar()
+            return session.execute(q, {'tid': telegram_id}).scalar()
         else:
             with session_scope() as session:
-                return session.execute(
-                    f'SELECT EXISTS(SELECT 1 from "user" where telegram_id = {telegram_id})'
-                ).scalar()
+                return session.execute(q, {'tid': telegram_id}).scalar()
 
     def is_wallet_exists(self, symbol, user_id, session):
         q = f"SELECT EXISTS(SELECT 1 from wallet where user_id = {user_id} AND symbol = '{symbol}')"
         return session.execute(q).scalar()
 
-    def get_message_for_update(self, message_id, session):
-        q = f"""
-            SELECT sender.id, message, receiver.id, media_id
-            FROM usermessage um
-            LEFT JOIN "user" sender ON um.sender_id = sender.id
-            LEFT JOIN "user" receiver ON um.receiver_id = receiver.id
-            WHERE um.id = {message_id}
-        """
-        sender_id, message, receiver_id, media_id = session.execute(q).fetchone()
-        if media_id:
-            url = session.execute("SELECT url FROM media WHERE id = :mid", {'mid': media_id}).scalar()
-        else:
-            url = None
-        return {'sender_id': sender_id, 'message': message, 'receiver_id': receiver_id, 'media_url': url}
-
-    def get_new_referral_for_update(self, user_id, session):
-        q = """
-            SELECT nickname
-            FROM "user" u
-            JOIN wallet w on u.id = w.user_id
-            WHERE referred_from_id = :uid
-            ORDER BY u.id DESC
-            LIMIT 1
-        """
-        ref = session.execute(q, {'uid': user_id}).fetchone()[0]
-        return {'user_id': user_id, 'referral': ref}
-
-    def get_promocode_for_update(self, user_id, promocodeactivation_id, symbol, session):
-        q = """
-            SELECT amount, (SELECT nickname FROM "user" WHERE id = w.user_id), code
-            FROM promocodeactivations pa
-            JOIN promocodes p ON pa.promocode_id = p.id
-            JOIN wallet w ON w.id = pa.wallet_id 
-            WHERE pa.id = :paid
-        """
-        amount, activator, code = session.execute(q, {'paid': promocodeactivation_id}).fetchone()
-        res = {'user_id': user_id, 'amount': manager.from_subunit(symbol, amount), 'activator': activator, 'code': code}
-        return res
-
-    def get_transaction_for_update(self, transaction_id, session):
-        q = f"""
-            SELECT user_id, type, amount_units, tx_hash, symbol
-            FROM transactions t
-            LEFT JOIN wallet w ON t.wallet_id = w.id
-            WHERE t.id = {transaction_id}
-        """
-        user_id, t, amount_units, tx_hash, symbol = session.execute(q).fetchone()
-        res = {'user_id': user_id, 'amount': amount_units, 'type': t}
-        if t == 'out':
-            res['link'] = self.crypto_manager.get_link(symbol, tx_hash)
-        return res
-
-    def get_deal_timeout_for_update(self, deal_id, session, user_id):
-        q = f"""
-            SELECT identificator
-            FROM deal d
-            WHERE d.id = {deal_id}
-        """
-        identificator = session.execute(q).fetchone()[0]
-        res = {'deal_id': identificator, 'user_id': user_id}
-        return res
-
-    def get_deal_referral_for_update(self, deal_id, session, user_id, symbol):
-        q = f"""
-            SELECT identificator, referral_commission_buyer_subunits, buyer_id
-            FROM deal d
-            WHERE d.id = :did
-            LIMIT 1
-        """
-        identificator, ref_comm, referral_id = session.execute(q, {'did': deal_id}).fetchone()
-        res = {
-            'identificator': identificator,
-            'user_id': user_id,
-            'referral_id': referral_id,
-            'amount': self.crypto_manager.from_subunit(symbol, ref_comm)
-        }
-        return res
-
-    def get_deal_for_update(self, deal_id, session, user_id):
-        q = f"""
-            SELECT seller_id, buyer_id, identificator
-            FROM deal
-            WHERE id = :did
-            LIMIT 1
-        """
-        seller_id, buyer_id, identificator = session.execute(q, {'did': deal_id}).fetchone()
-        res = {
-            'user_id': user_id,
-            'opponent': seller_id if seller_id != user_id else buyer_id,
-            'deal_id': identificator
-        }
-        return res
-
-    def get_dispute_for_update(self, deal_id, session, user_id, admin=False):
-        q = f"""
-            SELECT identificator
-            FROM deal
-            WHERE id = :did
-            LIMIT 1
-        """
-        identificator = session.execute(q, {'did': deal_id}).scalar()
-        res = {
-            'user_id': user_id,
-            'deal_id': identificator,
-            'dispute_time': DISPUTE_TIME,
-            'admin': admin
-        }
-        return res
-
-    def get_closed_dispute_for_update(self, deal_id, session, user_id, admin=False):
-        q = f"""
-            SELECT deal.identificator, (SELECT type FROM lot WHERE id = lot_id), deal.state
-            FROM deal
-            WHERE deal.id = :did
-            LIMIT 1
-        """
-        identificator, lot_type, state = session.execute(q, {'did': deal_id}).fetchone()
-        if state == STATES[-1]:
-            winner = 'seller'
-        else:
-            winner = 'buyer'
-
-        res = {
-            'user_id': user_id,
-            'winner': winner,
-            'deal_id': identificator,
-            'admin': admin
-        }
-        return res
-
-    def get_accounts_join_for_update(self, accounts_join_id, session):
-        token, web, tg = session.execute(
-            """
-                SELECT token, account_web, account_tg
-                FROM accounts_join
-                WHERE id = :id
-            """, {'id': accounts_join_id}
-        ).fetchone()
-        res = {
-            'tg_account': tg,
-            'web_account': web,
-            'token': token
-        }
-        return res
-
     def _get_control_messages(self, symbol, session):
         q = """
             SELECT it.id, nickname, message, it.created_at, balance, frozen, instance, change_balance, change_frozen
@@ -316,11 +177,115 @@ class DataHandler:
 
         return answ
 
+    def _get_messages_for_updates(self, message_ids, session):
+        if not message_ids:
+            return {}
+        q = """
+            SELECT um.id, sender.id, message, receiver.id, m.url
+            FROM usermessage um
+            LEFT JOIN "user" sender ON um.sender_id = sender.id
+            LEFT JOIN "user" receiver ON um.receiver_id = receiver.id
+            LEFT JOIN media m ON um.media_id = m.id
+            WHERE um.id = ANY(:ids)
+        """
+        return {
+            umid: {'sender_id': sender_id, 'message': message, 'receiver_id': receiver_id, 'media_url': url}
+            for umid, sender_id, message, receiver_id, url in session.execute(q, {'ids': message_ids})
+        }
+
+    def _get_new_referrals_for_updates(self, user_ids, session):
+        if not user_ids:
+            return {}
+        q = """
+            SELECT DISTINCT ON (referred_from_id) referred_from_id, nickname
+            FROM "user" u
+            JOIN wallet w on u.id = w.user_id
+            WHERE referred_from_id = ANY(:uids)
+            ORDER BY referred_from_id, u.id DESC
+        """
+        return {
+            user_id: {'user_id': user_id, 'referral': ref}
+            for user_id, ref in session.execute(q, {'uids': user_ids})
+        }
+
+    def _get_promocodes_for_updates(self, promocodeactivation_ids, symbol, session):
+        if not promocodeactivation_ids:
+            return {}
+        q = """
+            SELECT pa.id, amount, (SELECT nickname FROM "user" WHERE id = w.user_id), code
+            FROM promocodeactivations pa
+            JOIN promocodes p ON pa.promocode_id = p.id
+            JOIN wallet w ON w.id = pa.wallet_id
+            WHERE pa.id = ANY(:paids)
+        """
+        return {
+            paid: {'amount': manager.from_subunit(symbol, amount), 'activator': activator, 'code': code}
+            for paid, amount, activator, code in session.execute(q, {'paids': promocodeactivation_ids})
+        }
+
+    def _get_transactions_for_updates(self, transaction_ids, session):
+        if not transaction_ids:
+            return {}
+        q = """
+            SELECT t.id, user_id, type, amount_units, tx_hash, symbol
+            FROM transactions t
+            LEFT JOIN wallet w ON t.wallet_id = w.id
+            WHERE t.id = ANY(:tids)
+        """
+        res = {}
+        for tid, user_id, t, amount_units, tx_hash, symbol in session.execute(q, {'tids': transaction_ids}):
+            res[tid] = {'user_id': user_id, 'amount': amount_units, 'type': t}
+            if t == 'out':
+                res[tid]['link'] = self.crypto_manager.get_link(symbol, tx_hash)
+        return res
+
+    def _get_deals_for_updates(self, deal_ids, session):
+        if not deal_ids:
+            return {}
+        q = """
+            SELECT id, identificator, seller_id, buyer_id, referral_commission_buyer_subunits, state
+            FROM deal
+            WHERE id = ANY(:dids)
+        """
+        return {row['id']: dict(row) for row in session.execute(q, {'dids': deal_ids})}
+
+    def _get_accounts_joins_for_updates(self, accounts_join_ids, session):
+        if not accounts_join_ids:
+            return {}
+        q = """
+            SELECT id, token, account_web, account_tg
+            FROM accounts_join
+            WHERE id = ANY(:ids)
+        """
+        accounts_joins = {}
+        for ajid, token, web, tg in session.execute(q, {'ids': accounts_join_ids}):
+            self._invalidate_joined_accounts(tg, web)
+            accounts_joins[ajid] = {'tg_account': tg, 'web_account': web, 'token': token}
+        return accounts_joins
+
+    def _invalidate_joined_accounts(self, *user_ids):
+        # a join moves the telegram id between the joined users. It is written outside this service, only the
+        # process delivering the update sees it early, the others wait out TELEGRAM_ID_CACHE_TTL
+        for user_id in user_ids:
+            if user_id is not None:
+                telegram_ids.invalidate_value(user_id)
+
+    def _mark_notifications_as_sent(self, notification_ids, session):
+        if not notification_ids:
+            return set()
+        q = """
+            UPDATE notification
+            SET telegram_notified = TRUE
+            WHERE id = ANY(:ids) AND NOT telegram_notified
+            RETURNING id
+        """
+        return {nid for nid, in session.execute(q, {'ids': notification_ids})}
+
     def get_updates(self, symbol, session):
-        q = f"""
+        q = """
             SELECT user_id, n.id, type, deal_id, transaction_id, message_id, join_id, promocodeactivation_id
             FROM notification n
-            WHERE NOT telegram_notified AND symbol = '{symbol}'
+            WHERE NOT telegram_notified AND symbol = :sym
         """
         res = {
             'messages': [],
@@ -339,37 +304,81 @@ class DataHandler:
             },
             'secondary_node': []
         }
-        updates = session.execute(q).fetchall()
-        for user_id, notification_id, t, deal_id, transaction_id, message_id, accounts_join_id, promocodeactivation_id in updates:
+        updates = session.execute(q, {'sym': symbol}).fetchall()
+        if any(t not in NOTIFICATION_UPDATE_TYPES for _, _, t, *_ in updates):
+            raise ValueError('Wrong type')
+
+        # claim rows before loading them, so concurrent pollers never send the same notification twice
+        claimed = self._mark_notifications_as_sent([row[1] for row in updates], session)
+        updates = [row for row in updates if row[1] in claimed]
+
+        ids_by_type = defaultdict(list)
+        for user_id, _, t, deal_id, transaction_id, message_id, accounts_join_id, promocodeactivation_id in updates:
             if t == 'message':
-                res['messages'].append(self.get_message_for_update(message_id, session))
+                ids_by_type['messages'].append(message_id)
             elif t == 'new-referral':
-                res['new-referral'].append(self.get_new_referral_for_update(user_id, session))
+                ids_by_type['new-referral'].append(user_id)
             elif t == 'promocode':
-                res['promocodes'].append(self.get_promocode_for_update(user_id, promocodeactivation_id, symbol, session))
+                ids_by_type['promocodes'].append(promocodeactivation_id)
             elif t == 'transaction':
-                res['transactions'].append(self.get_transaction_for_update(transaction_id, session))
+                ids_by_type['transactions'].append(transaction_id)
+            elif t == 'accounts_join':
+                ids_by_type['accounts_join'].append(accounts_join_id)
+            else:
+                ids_by_type['deals'].append(deal_id)
+
+        messages = self._get_messages_for_updates(ids_by_type['messages'], session)
+        referrals = self._get_new_referrals_for_updates(ids_by_type['new-referral'], session)
+        promocodes = self._get_promocodes_for_updates(ids_by_type['promocodes'], symbol, session)
+        transactions = self._get_transactions_for_updates(ids_by_type['transactions'], session)
+        accounts_joins = self._get_accounts_joins_for_updates(ids_by_type['accounts_join'], session)
+        deals = self._get_deals_for_updates(ids_by_type['deals'], session)
+
+        for user_id, _, t, deal_id, transaction_id, message_id, accounts_join_id, promocodeactivation_id in updates:
+            if t == 'message':
+                res['messages'].append(messages[message_id])
+            elif t == 'new-referral':
+                res['new-referral'].append(referrals[user_id])
+            elif t == 'promocode':
+                res['promocodes'].append({'user_id': user_id, **promocodes[promocodeactivation_id]})
+            elif t == 'transaction':
+                res['transactions'].append(transactions[transaction_id])
+            elif t == 'accounts_join':
+                res['accounts_join'].append(accounts_joins[accounts_join_id])
             elif t == 'deal':
-                res['deals']['deals'].append(self.get_deal_for_update(deal_id, session, user_id))
-            elif t == 'dispute':
-                res['deals']['disputes'].append(self.get_dispute_for_update(deal_id, session, user_id))
-            elif t == 'closed_dispute':
-                res['deals']['closed_disputes'].append(self.get_closed_dispute_for_update(deal_id, session, user_id))
-            elif t == 'closed_dispute_admin':
-                res['deals']['closed_disputes'].append(self.get_closed_dispute_for_update(deal_id, session, user_id, admin=True))
-            elif t == 'dispute_notification':
-                res['deals']['dispute_notifications'].append(self.get_dispute_for_update(deal_id, session, user_id))
+                deal = deals[deal_id]
+                res['deals']['deals'].append({
+                    'user_id': user_id,
+                    'opponent': deal['seller_id'] if deal['seller_id'] != user_id else deal['buyer_id'],
+                    'deal_id': deal['identificator']
+                })
+            elif t in ('dispute', 'dispute_notification'):
+                key = 'disputes' if t == 'dispute' else 'dispute_notifications'
+                res['deals'][key].append({
+                    'user_id': user_id,
+                    'deal_id': deals.get(deal_id, {}).get('identificator'),
+                    'dispute_time': DISPUTE_TIME,
+                    'admin': False
+                })
+            elif t in ('closed_dispute', 'closed_dispute_admin'):
+                deal = deals[deal_id]
+                res['deals']['closed_disputes'].append({
+                    'user_id': user_id,
+                    'winner': 'seller' if deal['state'] == STATES[-1] else 'buyer',
+                    'deal_id': deal['identificator'],
+                    'admin': t == 'closed_dispute_admin'
+                })
             elif t == 'income_referral':
-                res['deals']['referrals'].append(self.get_deal_referral_for_update(deal_id, session, user_id, symbol))
-            elif t == 'timeout':
-                res['deals']['timeouts'].append(self.get_deal_timeout_for_update(deal_id, session, user_id))
-            elif t == 'cancel_deal':
-                res['deals']['cancel'].append(self.get_deal_timeout_for_update(deal_id, session, user_id))
-            elif t == 'accounts_join':
-                res['accounts_join'].append(self.get_accounts_join_for_update(accounts_join_id, session))
+                deal = deals[deal_id]
+                res['deals']['referrals'].append({
+                    'identificator': deal['identificator'],
+                    'user_id': user_id,
+                    'referral_id': deal['buyer_id'],
+                    'amount': self.crypto_manager.from_subunit(symbol, deal['referral_commission_buyer_subunits'])
+                })
             else:
-                raise ValueError('Wrong type')
-            session.execute(f'UPDATE notification SET telegram_notified = TRUE WHERE id = {notification_id}')
+                key = 'timeouts' if t == 'timeout' else 'cancel'
+                res['deals'][key].append({'deal_id': deals[deal_id]['identificator'], 'user_id': user_id})
         res['earnings'] = self._get_earnings(symbol, session)
         res['secondary_node'] = self._get_secondary_node_updates(session)
         # res['autowithdrawal'] = self._get_auto_wthd_updates(session)
@@ -425,6 +434,7 @@ class DataHandler:
             'UPDATE wallet SET balance = :value WHERE user_id = :uid AND symbol = :symbol',
             {'value': amount, 'uid': to_user_id, 'symbol': symbol}
         )
+        order_book.users_changed(session, to_user_id)
         return {'success': 'balance updated'}
 
     def set_frozen(self, symbol, to_user_id, admin_id, amount, session):
@@ -491,11 +501,9 @@ class DataHandler:
         if symbol == 'btc':
             dep_addresses = self._get_active_deposit_addresses(session)
             with_addresses = self._get_last_withdrawals_addresses(session)
-            transactions = manager.currencies['btc'].get_all_transactions()
+            transactions, confirmed_balance, unconfirmed_balance = manager.currencies['btc'].get_node_funds()
             sum_deposit = self._get_deposit_sum(transactions, dep_addresses)
             sum_withdraw = self._get_withdrawal_sum(transactions, with_addresses)
-            confirmed_balance = manager.currencies['btc'].get_node_balance(1)
-            unconfirmed_balance = manager.currencies['btc'].get_node_balance(0)
             resp = {
                 'confirmed': confirmed_balance,
                 'unconfirmed': unconfirmed_balance,
@@ -537,8 +545,8 @@ class DataHandler:
         }
         if symbol == 'btc':
             btc_module = manager.currencies['btc']
-            answ['wallet_funds']['secondary'] = btc_module.get_secondary_balance() + btc_module.get_secondary_deposits()
-            answ['wallet_funds']['cpayments'] = btc_module.get_cpayment_node_balance() + btc_module.get_cpayment_node_deposits()
+            answ['wallet_funds']['secondary'] = btc_module.get_secondary_funds()
+            answ['wallet_funds']['cpayments'] = btc_module.get_cpayment_node_funds()
             answ['profit'] = answ['wallet_funds']['funds'] + answ['wallet_funds']['secondary'] + answ['wallet_funds']['cpayments'] - answ['db_funds'] + answ['binance'] - imbalance
         else:
             answ['profit'] = answ['wallet_funds'] - answ['db_funds'] + answ['binance'] - imbalance
@@ -599,6 +607,7 @@ class DataHandler:
                     RETURNING withdraw_active
                 """, {'symbol': symbol}
             ).scalar()
+            on_commit(session, lambda: cache.invalidate('crypto_settings', symbol))
         return {'status': res}
 
     def get_withdraw_status(self, symbol):
@@ -622,6 +631,7 @@ class DataHandler:
             'UPDATE settings SET value = :val WHERE key = :key',
             {'key': 'fast_deal_active', 'val': str(not current_status).lower()}
         )
+        on_commit(session, lambda: cache.invalidate('settings'))
         return {'status': self.get_setting('fast_deal_active', session, return_type=lambda x: bool(strtobool(x)))}
 
     def get_frozen_all(self, symbol, session):
@@ -640,17 +650,23 @@ class DataHandler:
 
     def create_wallet_if_not_exists(self, symbol, user_id, session):
         if not self.is_wallet_exists(symbol, user_id, session):
-            pk = self.crypto_manager.get_new_pk(symbol)
-            session.execute(f"INSERT INTO wallet (user_id, symbol, private_key) VALUES ({user_id}, '{symbol}', '{pk}')")
+            pk, address = address_pool.claim(symbol, session)
+            session.execute(
+                'INSERT INTO wallet (user_id, symbol, private_key, address) VALUES (:uid, :sym, :pk, :address)',
+                {'uid': user_id, 'sym': symbol, 'pk': pk, 'address': address}
+            )
             return {'success': 'wallet created'}
         return {'success': 'wallet was already created'}
 
     def get_user_id(self, telegram_id, session=None):
-        if session:
-            return session.execute(f'SELECT id from "user" where telegram_id = {telegram_id}').scalar()
-        else:
-            with session_scope() as session:
-                return session.execute(f'SELECT id from "user" where telegram_id = {telegram_id}').scalar()
+        def load():
+            q = 'SELECT id FROM "user" WHERE telegram_id = :tid'
+            if session:
+                return session.execute(q, {'tid': telegram_id}).scalar()
+            with session_scope() as s:
+                return s.execute(q, {'tid': telegram_id}).scalar()
+
+        return telegram_ids.get_or_load(int(telegram_id), load)
 
     def is_user_have_rights(self, user_id, rights, session):
         return session.execute(
@@ -668,6 +684,11 @@ class DataHandler:
         return curs
 
     def get_settings(self, symbol, session):
+        # admins are granted outside this service, nothing here could invalidate them, so they are read every time
+        settings = cache.get_or_load('settings', symbol, lambda: self._get_settings(symbol, session))
+        return {**settings, 'admins': self._get_admins(session)}
+
+    def _get_settings(self, symbol, session):
         res = session.execute(
             """
                 SELECT symbol, coin_name, tx_out_commission, min_tx_amount, max_withdraw
@@ -688,7 +709,6 @@ class DataHandler:
             'control_chat': CONTROL_CHATS[symbol],
             'messages_chat': MESSAGES_CHAT,
             'deal_control_chat': DEAL_CONTROL_CHAT,
-            'admins': self._get_admins(session),
             'dispute_time': DISPUTE_TIME,
             'max_withdraw': max_withdraw,
             'base_deal_time': int(session.execute("SELECT value FROM settings WHERE key = 'base_deal_time' LIMIT 1").scalar()),
@@ -752,6 +772,7 @@ class DataHandler:
     def update_delete_status(self, symbol, user_id, is_deleted, session):
         q = 'UPDATE "user" SET is_deleted = :is_del WHERE id = :uid'
         session.execute(q, {'is_del': is_deleted, 'uid': user_id})
+        order_book.users_changed(session, user_id)
         if is_deleted:
             session.execute(
                 f"UPDATE lot SET is_active = FALSE WHERE user_id = :uid AND symbol = :sym",
@@ -761,6 +782,7 @@ class DataHandler:
     def update_verify_status(self, symbol, user_id, is_verify, session):
         q = 'UPDATE "user" SET is_verify = :is_ver WHERE id = :uid'
         session.execute(q, {'is_ver': is_verify, 'uid': user_id})
+        order_book.users_changed(session, user_id)
 
     def update_super_verify_only_status(self, symbol, user_id, super_verify_only, session):
         q = 'UPDATE "user" SET super_verify_only = :super_verify_only WHERE id = :uid'
@@ -787,6 +809,7 @@ class DataHandler:
             'UPDATE "user" SET is_baned = :is_baned WHERE id = :uid',
             {'is_baned': is_baned, 'uid': user_id}
         )
+        order_book.users_changed(session, user_id)
         if is_baned:
             session.execute('UPDATE wallet SET is_active = FALSE WHERE user_id = :uid', {'uid': user_id})
 
@@ -811,6 +834,7 @@ class DataHandler:
     def change_trading_status(self, symbol, user_id, session):
         q = "UPDATE wallet SET is_active = NOT is_active WHERE symbol = :sym AND user_id = :uid RETURNING is_active"
         is_acitve = session.execute(q, {'uid': user_id, 'sym': symbol}).scalar()
+        order_book.users_changed(session, user_id)
         return {'is_active': is_acitve}
 
     def _validate_ban_on_user(self, user_id, receiver_id, session):
@@ -865,23 +889,29 @@ class DataHandler:
             return False
         return True
 
+    def _serialize_lot(self, row, broker_name):
+        return {'id': row['id'], 'identificator': row['identificator'], 'limit_from': row['limit_from'],
+                'limit_to': row['limit_to'], 'details': row['details'], 'broker': broker_name, 'rate': row['rate'],
+                'coefficient': row['coefficient'], 'is_active': row['is_active'], 'is_deleted': row['is_deleted'],
+                'currency': row['currency'], 'type': row['type'], 'user_id': row['user_id'], 'symbol': row['symbol']}
+
     def get_lot(self, identificator, session):
-        q = """
-            SELECT id, identificator, limit_from, limit_to, details, broker_id, rate,
-                   coefficient, is_active, is_deleted, currency, type, user_id, symbol
-            FROM lot
-            WHERE identificator = :id
-            LIMIT 1
-        """
-        res = session.execute(q, {'id': identificator}).fetchone()
+        res = session.execute(f'SELECT {LOT_COLUMNS} FROM lot WHERE identificator = :id LIMIT 1', {'id': identificator})
+        res = res.fetchone()
         if not res:
             raise BadRequest
+        return self._serialize_lot(res, self._get_broker_name_by_id(res['broker_id'], session))
 
-        (lot_id, identificator, limit_from, limit_to, details, broker_id, rate, coefficient, is_active,
-            is_deleted, currency, t, user_id, symbol) = res
-        return {'id': lot_id, 'identificator': identificator, 'limit_from': limit_from, 'limit_to': limit_to, 'details': details,
-                'broker': self._get_broker_name_by_id(broker_id, session), 'rate': rate, 'coefficient': coefficient, 'is_active': is_active,
-                'is_deleted': is_deleted, 'currency': currency, 'type': t, 'user_id': user_id, 'symbol': symbol}
+    def _get_lots(self, identificators, session):
+        loader = loader_for(session)
+        lots = loader.load_lots(identificators)
+        if any(identificator not in lots for identificator in identificators):
+            raise BadRequest
+        brokers = loader.load_brokers([lots[identificator]['broker_id'] for identificator in identificators])
+        return {
+            identificator: self._serialize_lot(row, brokers.get(str(row['broker_id']), {}).get('name'))
+            for identificator, row in lots.items()
+        }
 
     def is_lot_exists(self, user_id, symbol, identificator, session):
         q = """
@@ -957,6 +987,7 @@ class DataHandler:
             raise BadRequest
 
         lot = self.get_lot(identificator, session)
+        order_book.users_changed(session, user_id)
 
         if limit_from is not None and limit_to is not None and limit_to >= limit_from > 0:
             self._update_limits(identificator, limit_from, limit_to, session)
@@ -981,6 +1012,7 @@ class DataHandler:
                 WHERE identificator = '{identificator}'
             """
             session.execute(q)
+            order_book.users_changed(session, user_id)
             return {'success': 'lot deleted'}
 
     def create_new_lot(self, symbol, user_id, coefficient, rate, limit_from, limit_to, _type, broker, session):
@@ -1000,38 +1032,40 @@ class DataHandler:
                 VALUES (:ident, :lim_from, :lim_to, :broker, :rate, :uid, :cur, :type, :coefficient, :sym)
                 """
             session.execute(q, data)
+            order_book.users_changed(session, user_id)
             return self.get_lot(identificator, session)
 
-    def get_user(self, user_id, session, expand_email=False, expand_rating=False):
-        res = session.execute(
-            f"""
-            SELECT id, telegram_id, nickname, lang, is_baned, is_deleted, is_verify,
-                   sky_pay, allow_payment_v2, currency, ref_kw, email, allow_sell, allow_sale_v2,
-                    email, rating, shadow_ban, apply_shadow_ban, super_verify_only
-            FROM "user" 
-            WHERE id = :uid
-            LIMIT 1
-            """, {'uid': user_id}
-        )
-        res = res.fetchone()
-        if not res:
-            raise BadRequest('no such user')
-        id_, telegram_id, nickname, lang, is_baned, is_deleted, is_verify, sky_pay, allow_payment_v2, currency, ref_kw, email, \
-                allow_sell, allow_sale_v2, email, rating, shadow_ban, apply_shadow_ban, super_verify_only = res
-        is_admin = self.is_user_have_rights(user_id, 'low', session)
+    def _serialize_user(self, row, expand_email=False, expand_rating=False):
         data = {
-            'id': id_, 'telegram_id': telegram_id, 'nickname': nickname, 'lang': lang, 'currency': currency,
-            'is_baned': is_baned, 'is_deleted': is_deleted, 'is_verify': is_verify, 'is_admin': is_admin,
-            'ref_code': ref_kw or nickname, 'email': email, 'allow_sell': allow_sell, 'allow_sale_v2': allow_sale_v2, 'sky_pay': sky_pay,
-            'allow_payment_v2': allow_payment_v2, 'shadow_ban': shadow_ban, 'apply_shadow_ban': apply_shadow_ban,
-            'super_verify_only': super_verify_only
+            'id': row['id'], 'telegram_id': row['telegram_id'], 'nickname': row['nickname'], 'lang': row['lang'],
+            'currency': row['currency'], 'is_baned': row['is_baned'], 'is_deleted': row['is_deleted'],
+            'is_verify': row['is_verify'], 'is_admin': row['is_admin'], 'ref_code': row['ref_kw'] or row['nickname'],
+            'email': row['email'], 'allow_sell': row['allow_sell'], 'allow_sale_v2': row['allow_sale_v2'],
+            'sky_pay': row['sky_pay'], 'allow_payment_v2': row['allow_payment_v2'], 'shadow_ban': row['shadow_ban'],
+            'apply_shadow_ban': row['apply_shadow_ban'], 'super_verify_only': row['super_verify_only']
         }
         if expand_email:
-            data['email'] = email
+            data['email'] = row['email']
         if expand_rating:
-            data['rating'] = rating
+            data['rating'] = row['rating']
         return data
 
+    def get_user(self, user_id, session, expand_email=False, expand_rating=False):
+        res = session.execute(f'SELECT {USER_COLUMNS} FROM "user" WHERE id = :uid LIMIT 1', {'uid': user_id})
+        res = res.fetchone()
+        if not res:
+            raise BadRequest('no such user')
+        return self._serialize_user(res, expand_email=expand_email, expand_rating=expand_rating)
+
+    def _get_users(self, user_ids, session, expand_email=False, expand_rating=False):
+        users = loader_for(session).load_users(user_ids)
+        if any(user_id not in users for user_id in user_ids):
+            raise BadRequest('no such user')
+        return {
+            user_id: self._serialize_user(row, expand_email=expand_email, expand_rating=expand_rating)
+            for user_id, row in users.items()
+        }
+
     def get_user_info(self, symbol, nickname, session):
         q = f"""
             SELECT id, telegram_id, nickname, lang, is_baned, is_deleted, is_verify, super_verify_only, currency,
@@ -1121,9 +1155,10 @@ class DataHandler:
             WHERE symbol = :sym AND (buyer_id = :uid OR seller_id = :uid) AND state not in ('deleted', 'closed')
         """
         active_deals = session.execute(q, {'sym': symbol, 'uid': user_id}).fetchall()
+        brokers = loader_for(session).load_brokers([broker_id for _, broker_id, *_ in active_deals])
         answ = []
         for identificator, broker_id, currency, amount_currency, dispute_exists, state in active_deals:
-            d = {'identificator': identificator, 'broker': self._get_broker_name_by_id(broker_id, session),
+            d = {'identificator': identificator, 'broker': brokers.get(str(broker_id), {}).get('name'),
                  'currency': currency, 'amount_currency': amount_currency, 'dispute_exists': dispute_exists,
                  'state': state}
             answ.append(d)
@@ -1146,59 +1181,19 @@ class DataHandler:
 
     def buy(self, symbol, user_id, session):
         user = self.get_user(user_id, session)
-        subunits_in_unit = self.crypto_manager.to_subunit(symbol=symbol, val=1)
-        q = """
-            SELECT broker_id, MIN(l.rate), COUNT(l.id) 
-            FROM lot l
-            LEFT JOIN "user" u ON l.user_id = u.id
-            LEFT JOIN wallet w on u.id = w.user_id
-            WHERE l.symbol = :sym AND w.symbol = :sym AND l.is_active AND NOT l.is_deleted AND l.type = 'sell' AND 
-                l.currency = :cur AND NOT u.is_baned AND limit_to >= limit_from AND
-                NOT u.is_deleted AND w.is_active AND limit_from/rate*:sub <= w.balance AND 100/rate*:sub <= w.balance AND
-                NOT stealth AND is_verify
-            GROUP BY l.broker_id
-            ORDER BY COUNT(l.id) DESC;
-        """
-        kw = {'sym': symbol, 'cur': user['currency'], 'sub': subunits_in_unit}
-        data = session.execute(q, kw).fetchall()
-        answ = []
-        for broker_id, rate, cnt in data:
-            answ.append(
-                {'broker': {'id': broker_id, 'name': self._get_broker_name_by_id(broker_id, session)},
-                 'rate': rate,
-                 'cnt': cnt
-                 }
-            )
-        return answ
+        brokers = order_book.get_brokers(symbol, user['currency'], LOT_TYPE_SELL, session)
+        return [
+            {'broker': {'id': item['id'], 'name': item['name']}, 'rate': item['rate'], 'cnt': item['cnt']}
+            for item in brokers
+        ]
 
     def sell(self, symbol, user_id, session):
         user = self.get_user(user_id, session)
-        q = f"""
-            SELECT broker_id, MAX(l.rate), COUNT(l.id) 
-            FROM lot l
-            LEFT JOIN "user" u ON l.user_id = u.id
-            LEFT JOIN wallet w on u.id = w.user_id and w.symbol = l.symbol
-            WHERE l.symbol = :sym AND w.symbol = :sym AND l.is_active AND NOT l.is_deleted
-                AND l.type = 'buy' AND l.currency = :cur AND NOT u.is_baned
-                AND limit_to >= limit_from AND NOT u.is_deleted AND w.is_active AND NOT stealth AND is_verify
-            GROUP BY broker_id
-            ORDER BY COUNT(l.id) DESC;
-        """
-        kw = {'sym': symbol, 'cur': user['currency']}
-        data = session.execute(q, kw).fetchall()
-        answ = []
-        for broker_id, rate, cnt in data:
-            answ.append(
-                {
-                    'broker': {
-                        'id': broker_id,
-                        'name': self._get_broker_name_by_id(broker_id, session)
-                    },
-                    'rate': rate,
-                    'cnt': cnt
-                }
-            )
-        return answ
+        brokers = order_book.get_brokers(symbol, user['currency'], LOT_TYPE_BUY, session)
+        return [
+            {'broker': {'id': item['id'], 'name': item['name']}, 'rate': item['rate'], 'cnt': item['cnt']}
+            for item in brokers
+        ]
 
     def _is_online(self, t):
         return datetime.utcnow() - t < timedelta(minutes=ONLINE_MINUTES)
@@ -1213,49 +1208,30 @@ class DataHandler:
 
     def broker_lots_buy(self, symbol, user_id, broker, session):
         user = self.get_user(user_id, session)
-        q = """
-            SELECT identificator, limit_from, limit_to, l.currency, balance, rate, is_verify, u.id, last_action
-            FROM lot l
-            LEFT JOIN "user" u ON l.user_id = u.id
-            LEFT JOIN wallet w on u.id = w.user_id and w.symbol = l.symbol
-            WHERE l.symbol = :sym AND l.is_active AND NOT l.is_deleted AND l.type = 'sell' AND l.broker_id = :broker
-                AND l.currency = :cur AND NOT u.is_baned AND NOT u.is_deleted AND w.is_active AND NOT stealth AND is_verify
-            ORDER BY rate
-        """
-        data = session.execute(q, {'sym': symbol, 'broker': broker, 'cur': user['currency']}).fetchall()
+        lots = order_book.get_lots(symbol, user['currency'], LOT_TYPE_SELL, broker, session)
         answ = []
-        for identificator, limit_from, limit_to, currency, balance, rate, is_verify, uid, last_action in data:
-            limit_to = self._get_maximum_limit(symbol, limit_to, rate, seller_balance=balance)
-            if limit_to < limit_from or limit_to <= 100:
+        for lot in lots:
+            limit_to = self._get_maximum_limit(symbol, lot['limit_to'], lot['rate'], seller_balance=lot['balance'])
+            if limit_to < lot['limit_from'] or limit_to <= 100:
                 continue
-            d = {'limit_from': limit_from, 'limit_to': limit_to, 'rate': rate, 'is_verify': is_verify,
-                 'owner': user['id'] == uid, 'is_online': self._is_online(last_action), 'identificator': identificator,
-                 'currency': currency}
+            d = {'limit_from': lot['limit_from'], 'limit_to': limit_to, 'rate': lot['rate'],
+                 'is_verify': lot['is_verify'], 'owner': user['id'] == lot['user_id'],
+                 'is_online': self._is_online(lot['last_action']), 'identificator': lot['identificator'],
+                 'currency': lot['currency']}
             answ.append(d)
         return answ
 
     def broker_lots_sell(self, symbol, user_id, broker, session):
         user = self.get_user(user_id, session)
-        q = """
-            SELECT identificator, limit_from, limit_to, l.currency, balance, rate, is_verify, u.id, last_action, type
-            FROM lot l
-            LEFT JOIN "user" u ON l.user_id = u.id
-            LEFT JOIN wallet w on u.id = w.user_id and w.symbol = l.symbol
-            WHERE l.symbol = :sym AND l.is_active AND NOT l.is_deleted AND l.type = 'buy' AND l.broker_id = :broker
-                AND l.currency = :cur AND NOT u.is_baned AND NOT u.is_deleted AND w.is_active AND limit_to >= limit_from
-                AND NOT stealth AND is_verify
-            ORDER BY rate DESC
-        """
-        data = session.execute(q, {'sym': symbol, 'broker': broker, 'cur': user['currency']}).fetchall()
+        lots = order_book.get_lots(symbol, user['currency'], LOT_TYPE_BUY, broker, session)
         answ = []
-        for identificator, limit_from, limit_to, currency, balance, rate, is_verify, uid, last_action, ltype in data:
-            if ltype == 'sell':
-                total_balance_currency = manager.from_subunit(symbol, balance) * rate
-                if total_balance_currency < limit_from:
-                    continue
-            d = {'limit_from': limit_from, 'limit_to': limit_to, 'rate': rate, 'is_verify': is_verify,
-                 'owner': user['id'] == uid, 'is_online': self._is_online(last_action), 'identificator': identificator,
-                 'currency': currency}
+        for lot in lots:
+            if lot['limit_to'] < lot['limit_from']:
+                continue
+            d = {'limit_from': lot['limit_from'], 'limit_to': lot['limit_to'], 'rate': lot['rate'],
+                 'is_verify': lot['is_verify'], 'owner': user['id'] == lot['user_id'],
+                 'is_online': self._is_online(lot['last_action']), 'identificator': lot['identificator'],
+                 'currency': lot['currency']}
             answ.append(d)
         return answ
 
@@ -1480,13 +1456,26 @@ class DataHandler:
         return session.execute(q, {'sym': symbol, 'uid': user_id}).scalar()
 
     def regenerate_wallet_if_needed(self, wallet_id, session):
-        new_wallet = manager.get_new_pk('btc')
-        return session.execute('UPDATE wallet SET private_key = :pk, regenerate_wallet = FALSE WHERE id = :id RETURNING private_key', {'pk': new_wallet, 'id': wallet_id}).scalar()
+        pk, address = address_pool.claim('btc', session)
+        session.execute(
+            'UPDATE wallet SET private_key = :pk, address = :address, regenerate_wallet = FALSE WHERE id = :id',
+            {'pk': pk, 'address': address, 'id': wallet_id}
+        )
+        return pk, address
+
+    def get_wallet_address(self, wallet_id, symbol, pk, address, session):
+        """
+        Stored address of the wallet, a wallet created before the address column is derived once and saved
+        """
+        if address is None and pk:
+            address = self.crypto_manager.get_address_from_pk(symbol, pk)
+            session.execute('UPDATE wallet SET address = :address WHERE id = :id', {'address': address, 'id': wallet_id})
+        return address
 
 
     def get_wallet(self, symbol, user_id, session):
         q = f"""
-            SELECT id, balance, frozen, is_active, private_key, w_limit, symbol, regenerate_wallet
+            SELECT id, balance, frozen, is_active, private_key, w_limit, symbol, regenerate_wallet, address
             FROM wallet 
             WHERE user_id = :uid AND symbol = :sym
             LIMIT 1
@@ -1496,14 +1485,14 @@ class DataHandler:
         if res is None:
             self.create_wallet_if_not_exists(symbol, user_id, session)
             res = session.execute(q, {'uid': user_id, 'sym': symbol}).fetchone()
-        _id, balance, frozen, is_active, pk, withdrawal_limit, symbol, regenerate_wallet = res
+        _id, balance, frozen, is_active, pk, withdrawal_limit, symbol, regenerate_wallet, address = res
         if symbol == 'btc' and regenerate_wallet:
-            self.regenerate_wallet_if_needed(_id, session)
+            pk, address = self.regenerate_wallet_if_needed(_id, session)
         balance = self.crypto_manager.from_subunit(symbol, balance)
         currency = self.get_user(user_id, session)['currency']
         balance_currency = self.get_rate(symbol, currency, session) * balance
         frozen = self.crypto_manager.from_subunit(symbol, frozen)
-        address = self.crypto_manager.get_address_from_pk(symbol, pk) if pk else None
+        address = self.get_wallet_address(_id, symbol, pk, address, session)
         last_address = self.get_last_tx_address(symbol, user_id, session)
         return {
             'balance': balance, 'balance_currency': balance_currency,
@@ -1516,11 +1505,11 @@ class DataHandler:
     def deposit_criptamat(self, symbol, user_id, session):
         if symbol != 'usdt':
             raise BadRequest
-        pk = session.execute(
-            "SELECT private_key FROM wallet WHERE user_id = :uid AND symbol = 'usdt'",
+        wallet_id, pk, address = session.execute(
+            "SELECT id, private_key, address FROM wallet WHERE user_id = :uid AND symbol = 'usdt'",
             {'uid': user_id}
-        ).scalar()
-        address = self.crypto_manager.get_address_from_pk(symbol, pk)
+        ).fetchone()
+        address = self.get_wallet_address(wallet_id, symbol, pk, address, session)
         data = {
             "key": "ca7fda4b-2021-4f5c-af75-b84032a8dab3",
             "url": "",
@@ -1552,13 +1541,13 @@ class DataHandler:
 
     def get_transit(self, symbol, user_id, session):
         q = """
-            SELECT private_key 
+            SELECT id, private_key, address
             FROM wallet 
             WHERE user_id = :uid AND symbol = :sym 
             LIMIT 1
         """
-        pk = session.execute(q, {'uid': user_id, 'sym': symbol}).scalar()
-        address = self.crypto_manager.get_address_from_pk(symbol, pk)
+        wallet_id, pk, address = session.execute(q, {'uid': user_id, 'sym': symbol}).fetchone()
+        address = self.get_wallet_address(wallet_id, symbol, pk, address, session)
         balance = self.crypto_manager.from_subunit(symbol, self.crypto_manager.get_balance(symbol, pk))
         return {'balance': balance, 'address': address, 'pk': pk}
 
@@ -1696,6 +1685,9 @@ class DataHandler:
                 )
 
     def get_crypto_settings(self, session, symbol):
+        return cache.get_or_load('crypto_settings', symbol, lambda: self._get_crypto_settings(session, symbol))
+
+    def _get_crypto_settings(self, session, symbol):
         res = session.execute(
             """
                 SELECT symbol, tx_out_commission, min_tx_amount, withdraw_active, net_commission, buyer_commission, seller_commission
@@ -1715,22 +1707,25 @@ class DataHandler:
                 {'tid': telegram_id, 'nick': nickname, 'ref': ref_code}
             ).scalar()
             for i, sym in enumerate(self.crypto_manager.currencies.keys()):
-                pk = self.crypto_manager.get_new_pk(sym)
-                if referred_id:
-                    q = f"""
-                        INSERT INTO wallet (user_id, symbol, private_key, referred_from_id)
-                        VALUES ({user_id}, '{sym}', '{pk}', {referred_id})
+                pk, address = address_pool.claim(sym, session)
+                if referred_id and i == 0:
+                    session.execute(
+                        "INSERT INTO notification (user_id, symbol, type) VALUES (:uid, :sym, :type)",
+                        {'uid': referred_id, 'sym': symbol, 'type': 'new-referral'}
+                    )
+                session.execute(
                     """
-                    if i == 0:
-                        session.execute(
-                            "INSERT INTO notification (user_id, symbol, type) VALUES (:uid, :sym, :type)",
-                            {'uid': referred_id, 'sym': symbol, 'type': 'new-referral'}
-                        )
-                else:
-                    q = f"INSERT INTO wallet (user_id, symbol, private_key) VALUES ({user_id}, '{sym}', '{pk}')"
-                session.execute(q)
+                        INSERT INTO wallet (user_id, symbol, private_key, address, referred_from_id)
+                        VALUES (:uid, :sym, :pk, :address, :ref)
+                    """, {
+                        'uid': user_id, 'sym': sym, 'pk': pk, 'address': address, 'ref': referred_id
+                    }
+                )
 
             self._handle_campaign(session, user_id, campaign)
+            on_commit(session, lambda: telegram_ids.invalidate(int(telegram_id)))
+        else:
+            user_id = self.get_user_id(telegram_id, session)
 
         return self.get_user(user_id, session)
 
@@ -1922,6 +1917,9 @@ class DataHandler:
         return session.execute(f"SELECT commission FROM commissions WHERE type = '{t}'").scalar()
 
     def get_brokers(self, session, currency=None):
+        return cache.get_or_load('brokers', currency, lambda: self._get_brokers(session, currency))
+
+    def _get_brokers(self, session, currency=None):
         if currency is None:
             data = session.execute(
                 "SELECT id, name FROM broker WHERE NOT is_deleted"
@@ -1938,26 +1936,23 @@ class DataHandler:
         return [{'id': str(b['id']), 'name': b['name']} for b in data]
 
     def get_currencies(self, session):
-        data = session.execute(
-            "SELECT id FROM currency WHERE is_active"
-        ).fetchall()
-        return [dict(item) for item in data]
+        return cache.get_or_load(
+            'currencies', 'active',
+            lambda: [dict(item) for item in session.execute("SELECT id FROM currency WHERE is_active").fetchall()]
+        )
 
-    def _is_user_verify(self, user_id):
-        with session_scope() as session:
-            is_verify = session.execute('SELECT is_verify FROM "user" WHERE id = :uid', {'uid': user_id}).scalar()
-        return is_verify
+    def _is_user_verify(self, user_id, session):
+        return session.execute('SELECT is_verify FROM "user" WHERE id = :uid', {'uid': user_id}).scalar()
 
-    def _validate_user_spam(self, user_id, lot_id):
-        if not self._is_user_verify(user_id):
-            with session_scope() as session:
-                this_minute_deals_with_current_lot = session.execute(
-                    """
-                        SELECT count(*)
-                        FROM deal d
-                        WHERE (buyer_id = :uid OR seller_id = :uid) AND lot_id = :lid AND created_at > now() - INTERVAL '1 minute'
-                    """, {'uid': user_id, 'lid': lot_id}
-                ).scalar()
+    def _validate_user_spam(self, user_id, lot_id, session):
+        if not self._is_user_verify(user_id, session):
+            this_minute_deals_with_current_lot = session.execute(
+                """
+                    SELECT count(*)
+                    FROM deal d
+                    WHERE (buyer_id = :uid OR seller_id = :uid) AND lot_id = :lid AND created_at > now() - INTERVAL '1 minute'
+                """, {'uid': user_id, 'lid': lot_id}
+            ).scalar()
             if this_minute_deals_with_current_lot > 0:
                 raise BadRequest('limit of this lot exceeded')
 
@@ -1982,7 +1977,7 @@ class DataHandler:
 
         lot = self.get_lot(lot_id, session)
 
-        self._validate_user_spam(user_id, lot['id'])
+        self._validate_user_spam(user_id, lot['id'], session)
 
         if lot['symbol'] != symbol:
             raise BadRequest
@@ -2035,6 +2030,12 @@ class DataHandler:
     def _serialize_deal(self, res, many, expand_id, session, expand_email=False, with_merchant=False):
         if not many:
             res = [res]
+        with loading(session):
+            users = self._get_users(
+                [row['buyer_id'] for row in res] + [row['seller_id'] for row in res], session,
+                expand_email=expand_email, expand_rating=True
+            )
+            lots = self._get_lots([row['lot_id'] for row in res], session)
         answ = []
         for local_res in res:
             (
@@ -2047,9 +2048,8 @@ class DataHandler:
                 'identificator': identificator, 'amount_currency': amount_currency, 'end_time': end_time, 'rate': rate,
                 'amount': self.crypto_manager.from_subunit(symbol, amount_subunit), 'created': created_at,
                 'requisite': requisite, 'state': state,
-                'buyer': self.get_user(buyer_id, session, expand_email=expand_email, expand_rating=True),
-                'seller': self.get_user(seller_id, session, expand_email=expand_email, expand_rating=True),
-                'lot': self.get_lot(lot_id, session), 'currency': currency, 'symbol': symbol,
+                'buyer': dict(users[buyer_id]), 'seller': dict(users[seller_id]),
+                'lot': dict(lots[lot_id]), 'currency': currency, 'symbol': symbol,
                 'buyer_commission': self.crypto_manager.from_subunit(symbol, buyer_commission_subunits),
                 'seller_commission': self.crypto_manager.from_subunit(symbol, seller_commission_subunits),
                 'referral_commission_buyer': self.crypto_manager.from_subunit(symbol, referral_commission_buyer_subunits),
@@ -2083,7 +2083,7 @@ class DataHandler:
             data = {'did': deal_id}
         q = f"""
             SELECT id, d.identificator, amount_currency, amount_subunit, d.created_at, end_time, d.rate, requisite, state,
-                buyer_id, seller_id, (SELECT identificator FROM lot WHERE id = lot_id), currency,
+                buyer_id, seller_id, (SELECT identificator FROM lot WHERE id = lot_id) AS lot_id, currency,
                 buyer_commission_subunits, seller_commission_subunits,
                 referral_commission_buyer_subunits, referral_commission_seller_subunits, symbol, type, address, 
                 payment_id, sell_id, sale_v2_id, payment_v2_id
@@ -2127,9 +2127,10 @@ class DataHandler:
             return {}
 
         disp_id, initiator_id, opponent_id, created_at = disp
+        users = self._get_users([initiator_id, opponent_id] if opponent_id else [initiator_id], session)
         answ = {
-            'initiator': self.get_user(initiator_id, session),
-            'opponent': self.get_user(opponent_id, session) if opponent_id else {},
+            'initiator': users[initiator_id],
+            'opponent': users[opponent_id] if opponent_id else {},
             'created_at': created_at
         }
         if expand_id:
@@ -2215,9 +2216,15 @@ class DataHandler:
             uid = deal['seller']['id'] if user_id == deal['buyer']['id'] else deal['buyer']['id']
             create_deal_notification(uid, did, session, n_type='cancel_deal')
         if deal['type'] == DealTypes.sky_sale_v2:
-            update_sale_v2(user_id=-1, sale_v2_id=deal['sale_v2_id'], data={'status': 0, 'deal': None})
+            enqueue(
+                session, 'update_sale_v2', f'deal:{did}:update_sale_v2',
+                sale_v2_id=deal['sale_v2_id'], data={'status': 0, 'deal': None}
+            )
         elif deal['type'] == DealTypes.sky_pay_v2:
-            update_payment_v2(user_id=-1, payment_v2_id=deal['payment_v2_id'], data={'status': 0, 'deal': None})
+            enqueue(
+                session, 'update_payment_v2', f'deal:{did}:update_payment_v2',
+                payment_v2_id=deal['payment_v2_id'], data={'status': 0, 'deal': None}
+            )
         return {'success': 'deal canceled'}
 
     def close_deal_admin(self, symbol, deal_id, winner, session):
@@ -2345,7 +2352,19 @@ class DataHandler:
         buyer_id = deal['buyer_id']
 
         print('change frozen')
-        change_frozen(user_id=seller_id, msg=msg, symbol=symbol, amount_subunits=-amount_frozen, session=session)
+        legs = [{'user_id': seller_id, 'symbol': symbol, 'msg': msg, 'frozen_subunits': -amount_frozen}]
+        # plain and fast deals move the buyer's funds in the same round trip as the seller's
+        if deal['type'] == DealTypes.plain:
+            legs.append({
+                'user_id': buyer_id, 'symbol': symbol, 'msg': msg,
+                'balance_subunits': manager.to_subunit(symbol, to_balance)
+            })
+        elif deal['type'] == DealTypes.fast:
+            legs.append({
+                'user_id': buyer_id, 'symbol': symbol, 'msg': msg,
+                'frozen_subunits': manager.to_subunit(symbol, to_balance)
+            })
+        change_funds_many(legs, session=session)
         if deal['type'] != DealTypes.sky_sale_v2:
             create_operation(
                 session, seller_id, deal['identificator'], symbol, deal['currency'],
@@ -2356,8 +2375,6 @@ class DataHandler:
         merchant_commission = 0
 
         if deal['type'] == DealTypes.plain:
-            print('change balance')
-            change_balance(user_id=buyer_id, msg=msg, symbol=symbol, amount=to_balance, session=session)
             print('create operation')
             create_operation(
                 session, buyer_id, deal['identificator'],
@@ -2369,7 +2386,6 @@ class DataHandler:
             wallet_id = self._get_wallet_id(session, buyer_id, symbol)
             settings = self.get_settings(symbol, session)
             comm = Decimal(str(settings['commission']))
-            change_frozen(user_id=buyer_id, msg=msg, symbol=symbol, amount=to_balance, session=session)
             self._create_transaction(session, wallet_id=wallet_id, address=deal['address'], amount_units=to_balance - comm)
 
         elif deal['type'] == DealTypes.sky_pay:
@@ -2385,11 +2401,12 @@ class DataHandler:
 
             commission_currency = 0 if payment['address'] or not service_commission else service_commission * Decimal(str(payment['amount']))
 
+            btc_payout = None
             if payment['address']:
                 if symbol == 'btc':
                     to_send = round(to_balance - comm, manager.currencies['btc'].DECIMALS)
                     if not environ.get('TEST'):
-                        tx_hash = manager.currencies['btc'].create_tx_out(payment['address'], to_send)
+                        btc_payout = {'address': payment['address'], 'amount': to_send}
                 else:
                     wallet_id = self.get_wallet(symbol, buyer_id, session)['id']
                     change_frozen(user_id=buyer_id, msg=msg, symbol=symbol,
@@ -2404,7 +2421,15 @@ class DataHandler:
                              commission_currency=commission_currency,
                              amount_currency=payment['amount'] if payment['is_currency_amount'] else deal['amount_currency'],
                              label=payment['label'], trader_commission=seller_commission)
-            complete_purchase(receiver_id, deal['payment_id'], tx_hash, to_balance - comm, deal['rate'])
+            purchase = {
+                'user_id': receiver_id, 'purchase_id': deal['payment_id'],
+                'received_crypto': to_balance - comm, 'rate': deal['rate']
+            }
+            if btc_payout:
+                # the purchase is completed with the tx hash once the coins are sent
+                enqueue(session, 'sky_pay_btc_payout', f'btc_payout:{deal["identificator"]}', **btc_payout, **purchase)
+            else:
+                enqueue(session, 'complete_purchase', f'complete_purchase:{deal["payment_id"]}', tx_hash=tx_hash, **purchase)
             try:
                 if 'noemail.fkfl' not in deal['buyer']['email']:
                     broker = self._get_broker_name_by_id(deal['broker_id'], session)
@@ -2429,7 +2454,10 @@ class DataHandler:
                              commission_currency=commission_currency,
                              amount_currency=payment['amount'] if payment['is_currency_amount'] else deal['amount_currency'],
                              label=payment['label'], trader_commission=seller_commission)
-            complete_payment_v2(receiver_id, deal['payment_v2_id'], final_to_balance)
+            enqueue(
+                session, 'complete_payment_v2', f'complete_payment_v2:{deal["payment_v2_id"]}',
+                user_id=receiver_id, payment_v2_id=deal['payment_v2_id'], received_crypto=final_to_balance
+            )
 
         elif deal['type'] == DealTypes.sky_sale:
             sell = get_sell(buyer_id, deal['sell_id'])
@@ -2440,7 +2468,7 @@ class DataHandler:
             balance = self.get_balance(seller_id, session=session)
             if balance > 0:
                 change_balance(user_id=seller_id, msg=msg, symbol=symbol, amount_subunits=-balance, session=session)
-            complete_sell(receiver_id, deal['sell_id'], session)
+            enqueue(session, 'complete_sell', f'complete_sell:{deal["sell_id"]}', user_id=receiver_id, sell_id=deal['sell_id'])
 
         elif deal['type'] == DealTypes.sky_sale_v2:
             msg = f'SKY SALE_V2: {msg}, {deal["sale_v2_id"]}'
@@ -2453,7 +2481,10 @@ class DataHandler:
             comm = service_commission * to_balance
             merchant_commission = comm
             sent_crypto = self.crypto_manager.from_subunit(symbol, amount_frozen) + comm
-            complete_sale_v2(user_id=seller_id, sale_v2_id=deal['sale_v2_id'], sent_crypto=sent_crypto, session=session)
+            enqueue(
+                session, 'complete_sale_v2', f'complete_sale_v2:{deal["sale_v2_id"]}',
+                user_id=seller_id, sale_v2_id=deal['sale_v2_id'], sent_crypto=sent_crypto
+            )
 
             try:
                 change_balance(user_id=seller_id, msg=msg, symbol=symbol, amount=-comm, session=session)
@@ -2492,7 +2523,8 @@ class DataHandler:
             "SELECT website, image_url FROM merchant WHERE user_id = :uid",
             {'uid': merchant_id}
         ).fetchone()
-        receipt(
+        enqueue(
+            session, 'receipt', f'receipt:{deal["identificator"]}',
             recipient=recipient,
             paid=deal['amount_currency'],
             received=received,
@@ -2820,13 +2852,10 @@ class DataHandler:
             data.append(d)
         return data
 
-    def _get_user_id_nickname_mapping(self, session):
-        return dict(session.execute('SELECT id, nickname FROM "user"').fetchall())
-
-    def _get_lot_id_identificator_mapping(self, session):
-        return dict(session.execute('SELECT id, identificator FROM lot').fetchall())
-
     def _get_deals_report(self, symbol, date_condition, session):
+        return list(self._iter_deals_report(symbol, date_condition, session))
+
+    def _iter_deals_report(self, symbol, date_condition, session):
         state_names = {
             'proposed': 'предложена',
             'confirmed': 'подтверждена',
@@ -2836,32 +2865,30 @@ class DataHandler:
         }
         date_condition = date_condition.replace('created_at', 'd.created_at')
         q = f"""
-            SELECT d.identificator, lot_id, amount_currency, currency, d.created_at, state, end_time, 
-                buyer_id, seller_id, amount_subunit,
+            SELECT d.identificator, l.identificator, amount_currency, d.currency, d.created_at, state, end_time, 
+                buyer.nickname, seller.nickname, amount_subunit,
                 buyer_commission_subunits + seller_commission_subunits - referral_commission_seller_subunits - referral_commission_buyer_subunits
             FROM deal d
-            WHERE symbol = :symbol {date_condition}
+            LEFT JOIN lot l ON l.id = d.lot_id
+            LEFT JOIN "user" buyer ON buyer.id = d.buyer_id
+            LEFT JOIN "user" seller ON seller.id = d.seller_id
+            WHERE d.symbol = :symbol {date_condition}
             ORDER BY d.id
         """
-        deals = session.execute(q, {'symbol': symbol}).fetchall()
-        user_id_nickname = self._get_user_id_nickname_mapping(session)
-        lot_id_idents = self._get_lot_id_identificator_mapping(session)
-        res = []
-        for deal, lot, amount_currency, currency, created, state, end_time, buyer, seller, amount_subunit, income in deals:
-            d = {
+        rows = stream_rows(session, q, {'symbol': symbol})
+        for deal, lot, amount_currency, currency, created, state, end_time, buyer, seller, amount_subunit, income in rows:
+            yield {
                 'id': deal,
-                'lot': lot_id_idents[lot],
+                'lot': lot,
                 'amount': f'{amount_currency} {currency.upper()}',
                 'created': created,
                 'end': end_time,
                 'status': state_names[state],
-                'buyer': user_id_nickname[buyer],
-                'seller': user_id_nickname[seller],
+                'buyer': buyer,
+                'seller': seller,
                 'income': f'{manager.from_subunit(symbol, income)} {symbol.upper()}',
                 'crypto': f'{manager.from_subunit(symbol, amount_subunit)} {symbol.upper()}'
             }
-            res.append(d)
-        return res
 
     def _get_promocodes_report(self, symbol, date_condition, session):
         date_condition = date_condition.replace('created_at', 'p.created_at')
@@ -2959,18 +2986,19 @@ class DataHandler:
         return res
 
     def _get_transactions_report(self, symbol, date_condition, session):
-        res = session.execute(
-            f"""
-                SELECT type, to_address, commission, tx_hash, created_at, processed_at, amount_units, is_confirmed, is_deleted
-                FROM transactions t
-                JOIN wallet w on t.wallet_id = w.id
-                WHERE symbol = :symbol {date_condition}
-                ORDER BY t.id
-            """, {'symbol': symbol}
-        ).fetchall()
-        answ = []
-        for t, to_address, commission, tx_hash, created_at, processed_at, amount_units, is_confirmed, is_deleted in res:
-            d = {
+        return list(self._iter_transactions_report(symbol, date_condition, session))
+
+    def _iter_transactions_report(self, symbol, date_condition, session):
+        q = f"""
+            SELECT type, to_address, commission, tx_hash, created_at, processed_at, amount_units, is_confirmed, is_deleted
+            FROM transactions t
+            JOIN wallet w on t.wallet_id = w.id
+            WHERE symbol = :symbol {date_condition}
+            ORDER BY t.id
+        """
+        rows = stream_rows(session, q, {'symbol': symbol})
+        for t, to_address, commission, tx_hash, created_at, processed_at, amount_units, is_confirmed, is_deleted in rows:
+            yield {
                 'type': t,
                 'to_address': to_address,
                 'commission': commission,
@@ -2981,10 +3009,11 @@ class DataHandler:
                 'is_confirmed': is_confirmed,
                 'is_deleted': is_deleted
             }
-            answ.append(d)
-        return answ
 
     def _get_lots_report(self, symbol, date_condition, session):
+        return list(self._iter_lots_report(symbol, date_condition, session))
+
+    def _iter_lots_report(self, symbol, date_condition, session):
         date_condition = date_condition.replace('created_at', 'lot.created_at')
         q = f"""
             SELECT identificator, name, rate, nickname, lot.created_at, is_active, coefficient
@@ -2994,9 +3023,9 @@ class DataHandler:
             WHERE symbol = :sym {date_condition}
             ORDER BY lot.id DESC
         """
-        res = []
-        for identificator, broker, rate, nickname, created_at, is_active, coefficient in session.execute(q, {'sym': symbol}).fetchall():
-            d = {
+        rows = stream_rows(session, q, {'sym': symbol})
+        for identificator, broker, rate, nickname, created_at, is_active, coefficient in rows:
+            yield {
                 'id': identificator,
                 'broker': broker,
                 'rate': rate,
@@ -3005,10 +3034,11 @@ class DataHandler:
                 'active': is_active,
                 'coefficient': coefficient
             }
-            res.append(d)
-        return res
 
     def _get_exchange_report(self, symbol, date_condition, session):
+        return list(self._iter_exchange_report(symbol, date_condition, session))
+
+    def _iter_exchange_report(self, symbol, date_condition, session):
         date_condition = date_condition.replace('created_at', 'e.created_at')
         q = f"""
             SELECT e.id as id, e.created_at as created_at, nickname, from_symbol, to_symbol, rate, amount_sent, amount_received, commission
@@ -3017,9 +3047,9 @@ class DataHandler:
             WHERE to_symbol = :sym {date_condition}
             ORDER BY e.created_at DESC
         """
-        res = []
-        for eid, created_at, nickname, from_symbol, to_symbol, rate, amount_sent, amount_received, commission in session.execute(q, {'sym': symbol}).fetchall():
-            d = {
+        rows = stream_rows(session, q, {'sym': symbol})
+        for eid, created_at, nickname, from_symbol, to_symbol, rate, amount_sent, amount_received, commission in rows:
+            yield {
                 'id': eid,
                 'created_at': created_at,
                 'nickname': nickname,
@@ -3030,19 +3060,19 @@ class DataHandler:
                 'amount_received': amount_received,
                 'commission': commission
             }
-            res.append(d)
-        return res
 
     def _get_users_report(self, symbol, date_condition, session):
+        return list(self._iter_users_report(symbol, date_condition, session))
+
+    def _iter_users_report(self, symbol, date_condition, session):
         q = f"""
             SELECT nickname, lang, telegram_id, created_at, is_deleted, is_baned, is_verify, rating
             FROM "user"
             WHERE TRUE {date_condition}
             ORDER BY id DESC
         """
-        res = []
-        for nickname, lang, telegram_id, created_at, is_deleted, is_baned, is_verify, rating in session.execute(q).fetchall():
-            d = {
+        for nickname, lang, telegram_id, created_at, is_deleted, is_baned, is_verify, rating in stream_rows(session, q):
+            yield {
                 'nickname': nickname,
                 'lang': lang,
                 'telegram_id': telegram_id,
@@ -3051,10 +3081,11 @@ class DataHandler:
                 'verify': is_verify,
                 'rating': rating
             }
-            res.append(d)
-        return res
 
     def _get_control_report(self, symbol, date_condition, session):
+        return list(self._iter_control_report(symbol, date_condition, session))
+
+    def _iter_control_report(self, symbol, date_condition, session):
         q = f"""
             SELECT identificator as id,
                (SELECT nickname FROM "user" WHERE id = d.buyer_id) as buyer,
@@ -3063,10 +3094,10 @@ class DataHandler:
                state, requisite, created_at, end_time, amount_currency, payment_id, sell_id, ip
             FROM deal d
             WHERE symbol = :sym {date_condition}
-            ORDER BY created_at;
+            ORDER BY created_at
         """
-        data = session.execute(q, {'sym': symbol}).fetchall()
-        return [dict(item) for item in data]
+        for item in stream_rows(session, q, {'sym': symbol}):
+            yield dict(item)
 
     def _get_revenue_and_deals_by_campaign(self, campaign_id, session):
         q = """
@@ -3118,17 +3149,37 @@ class DataHandler:
     def withdraw_from_payments_node(self, symbol, address, amount):
         return {'link': manager.get_link(symbol, manager.currencies[symbol].create_tx_out_payments(address, amount))}
 
-    def get_all_reports(self, symbol, t, session, from_date=None, to_date=None):
-        print(t)
-        method = getattr(self, f'_get_{t}_report')
-        kw = {'session': session}
+    def _get_report_kwargs(self, method, from_date, to_date):
+        kw = {}
         if 'date_condition' in method.__code__.co_varnames and isinstance(from_date, int) and isinstance(to_date, int):
             kw['date_condition'] = f' AND created_at BETWEEN to_timestamp({from_date}) AND to_timestamp({to_date})'
         if 'year' in method.__code__.co_varnames and 'month' in method.__code__.co_varnames and isinstance(from_date, int):
             date = datetime.fromtimestamp(from_date)
             kw['year'] = date.year
             kw['month'] = date.month
-        return method(symbol, **kw)
+        return kw
+
+    def get_all_reports(self, symbol, t, session, from_date=None, to_date=None):
+        method = getattr(self, f'_get_{t}_report')
+        return method(symbol, session=session, **self._get_report_kwargs(method, from_date, to_date))
+
+    def stream_report(self, symbol, t, from_date=None, to_date=None):
+        """
+        Rows of a report one by one, for the export mode. The rows are consumed after the request is finished,
+        so they are read in a session of their own.
+        """
+        method = getattr(self, f'_get_{t}_report', None)
+        if method is None:
+            raise BadRequest(f'unknown report {t}')
+        kw = self._get_report_kwargs(method, from_date, to_date)
+        # aggregated reports are small and have no row iterator
+        rows = getattr(self, f'_iter_{t}_report', method)
+
+        def generate():
+            with session_scope() as session:
+                yield from rows(symbol, session=session, **kw)
+
+        return generate()
 
     def upload_media(self, symbol, user_id, file, session, content_type=None):
         url = upload_file_to_s3(file, content_type)
@@ -3138,22 +3189,7 @@ class DataHandler:
         return {'id': mid}
 
     def update_last_action_time(self, user_id=None, telegram_id=None):
-        with session_scope() as session:
-            if user_id is not None:
-                last_action = LAST_USER_ACTION_TIME.get(user_id)
-                if not last_action or last_action < datetime.now(timezone.utc) - timedelta(minutes=1):
-                    session.execute(
-                        'UPDATE "user" SET last_action = NOW() WHERE id = :uid',
-                        {'uid': user_id}
-                    )
-                    LAST_USER_ACTION_TIME[user_id] = datetime.now(timezone.utc)
-            elif telegram_id is not None:
-                session.execute(
-                    'UPDATE "user" SET last_action = NOW() WHERE telegram_id = :tid',
-                    {'tid': telegram_id}
-                )
-            else:
-                raise ValueError('telegram_id and user_id are none')
+        last_actions.touch(user_id=user_id, telegram_id=telegram_id)
 
 
 dh = DataHandler()
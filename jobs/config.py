@@ -237,6 +237,15 @@ class Config:
             'max_instances': 1,
         },
 
+        # OUTBOX
+        {
+            'id': 'Outbox dispatch',
+            'func': 'jobs.outbox.dispatch:dispatch_outbox',
+            'trigger': 'interval',
+            'seconds': 10,
+            'max_instances': 1,
+        },
+
         # CLEAN
         {
             'id': 'Notifications cleaner',
@@ -245,6 +254,13 @@ class Config:
             'minutes': 5,
             'max_instances': 1,
         },
+        {
+            'id': 'Outbox cleaner',
+            'func': 'jobs.outbox.dispatch:clean_outbox',
+            'trigger': 'interval',
+            'hours': 1,
+            'max_instances': 1,
+        },
 
         # DEPRECATE PAYMENTS
         {
@@ -338,6 +354,13 @@ class Config:
         },
 
         # IP
+        {
+            'id': 'Address pool refill',
+            'func': 'jobs.system.address_pool:refill_address_pool',
+            'trigger': 'interval',
+            'minutes': 1,
+            'max_instances': 1
+        },
         {
             'id': 'Ban IP',
             'func': 'jobs.system.autoban_ip:ban_ips',
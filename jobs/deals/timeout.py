@@ -3,7 +3,8 @@ from system.funds_changer import unfreeze
 from utils.db_sessions import session_scope
 from utils.logger import logger
 from utils.notifications_queue import create_timeout_notification
-from utils.utils import update_sale_v2, update_purchase, update_payment_v2
+from utils.order_book import order_book
+from utils.outbox import enqueue
 
 
 PAYMENT_V2_DEAL_TIME = 15
@@ -41,11 +42,17 @@ def _delete_deal(session, deal_id, identificator, seller_id, buyer_id, amount_fr
     msg = f'Deal {identificator} timeout'
     if payment_id:
         msg += f', {payment_id}'
-        update_purchase(user_id=-1, purchase_id=payment_id, data={'status': 0})
+        enqueue(session, 'update_purchase', f'deal:{deal_id}:update_purchase', purchase_id=payment_id, data={'status': 0})
     if sale_v2_id:
-        update_sale_v2(user_id=-1, sale_v2_id=sale_v2_id, data={'status': 0, 'deal': None})
+        enqueue(
+            session, 'update_sale_v2', f'deal:{deal_id}:update_sale_v2',
+            sale_v2_id=sale_v2_id, data={'status': 0, 'deal': None}
+        )
     if payment_v2_id:
-        update_payment_v2(user_id=-1, payment_v2_id=payment_v2_id, data={'status': 0, 'deal': None})
+        enqueue(
+            session, 'update_payment_v2', f'deal:{deal_id}:update_payment_v2',
+            payment_v2_id=payment_v2_id, data={'status': 0, 'deal': None}
+        )
     unfreeze(
         user_id=seller_id, msg=msg, symbol=symbol,
         amount_subunits=amount_frozen, session=session
@@ -57,10 +64,15 @@ def _delete_deal(session, deal_id, identificator, seller_id, buyer_id, amount_fr
         create_timeout_notification(user_id, symbol, deal_id, identificator, session)
 
     if state == STATES[0]:
-        session.execute(
-            'UPDATE wallet SET is_active = FALSE WHERE user_id = (SELECT user_id FROM lot WHERE id = :lid) AND symbol = :sym',
-            {'sym': symbol, 'lid': lot_id}
-        )
+        lot_owner_id = session.execute(
+            """
+                UPDATE wallet SET is_active = FALSE
+                WHERE user_id = (SELECT user_id FROM lot WHERE id = :lid) AND symbol = :sym
+                RETURNING user_id
+            """, {'sym': symbol, 'lid': lot_id}
+        ).scalar()
+        if lot_owner_id is not None:
+            order_book.users_changed(session, lot_owner_id)
 
 
 def update_deals():
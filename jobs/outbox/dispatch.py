@@ -0,0 +1,12 @@
+from utils.db_sessions import session_scope
+from utils.outbox import dispatch, OUTBOX_BATCH_SIZE
+
+
+def dispatch_outbox():
+    while dispatch() == OUTBOX_BATCH_SIZE:
+        pass
+
+
+def clean_outbox():
+    with session_scope() as session:
+        session.execute("DELETE FROM outbox WHERE status = 'done' AND processed_at < NOW() - INTERVAL '7 days'")
@@ -1,59 +1,70 @@
+from datetime import datetime, timezone
 from decimal import Decimal
 
 from utils.binance_client import binance_client
-from utils.db_sessions import session_scope
+from system.settings import cache
+from utils.db import values_list
+from utils.db_sessions import session_scope, on_commit
 from utils.logger import logger
 
+SYMBOLS = ('ETH', 'BTC', 'USDT')
+CURRENCIES = ('RUB', 'USD', 'UAH')
+
+
+def _binance_symbol(symbol, currency):
+    return symbol + (currency + 'T' if currency == 'USD' else currency)
+
 
 def get_rates():
+    """
+    {symbol: {currency: (rate, source time)}} from one bulk ticker request
+    """
+    pairs = {(s.lower(), c.lower()): _binance_symbol(s, c) for s in SYMBOLS for c in CURRENCIES}
+    tickers = binance_client.get_tickers(sorted(b for b in set(pairs.values()) if b != 'USDTUSDT'))
+    now = datetime.now(timezone.utc)
     rates = {}
-    for symbol in ('ETH', 'BTC', 'USDT'):
-        rates[symbol.lower()] = {}
-        for currency in ('RUB', 'USD', 'UAH'):
-            binance_symbol = symbol + currency
-            if currency == 'USD':
-                binance_symbol += 'T'
-            if binance_symbol == 'USDTUSDT':
-                rates[symbol.lower()][currency.lower()] = 1
-            else:
-                rates[symbol.lower()][currency.lower()] = binance_client.get_symbol_price(binance_symbol)
+    for (symbol, currency), binance_symbol in pairs.items():
+        rate = (Decimal(1), now) if binance_symbol == 'USDTUSDT' else tickers[binance_symbol]
+        rates.setdefault(symbol, {})[currency] = rate
     logger.debug(f'UPDATE RATE, new rate = {rates}')
     return rates
 
 
 def _get_currencies(session):
-    curs = [item['id'] for item in session.execute('SELECT id FROM currency').fetchall()]
-    return curs
+    return dict(session.execute('SELECT id, usd_rate FROM currency').fetchall())
 
 
 def upload_to_database(rates: dict, session):
     logger.info(f'UPDATE RATE, new rate = {rates}')
-    # {btc: {rub: 1, usd: 2}}
-    for symbol, currencies in rates.items():
-        for currency, rate in currencies.items():
-            session.execute(
-                """
-                    INSERT INTO rates (symbol, rate, currency)
-                    VALUES (:sym, :rate, :cur)
-                    ON CONFLICT (symbol, currency) 
-                    DO
-                        UPDATE SET rate = :rate
-                """, {'sym': symbol, 'rate': rate, 'cur': currency}
-            )
-
-
-def extend_rates(rates_dict, currencies, session):
-    available_rates = set(rates_dict['btc'].keys())
-    non_rated_currencies = set(currencies).difference(available_rates)
-    for cur in non_rated_currencies:
-        usd_rate = session.execute('SELECT usd_rate FROM currency WHERE id = :cur', {'cur': cur}).scalar()
-        for crypto in rates_dict.keys():
-            rates_dict[crypto][cur] = Decimal(str(rates_dict[crypto]['usd'])) * usd_rate
+    # {btc: {rub: (1, source_time), usd: (2, source_time)}}
+    rows = [
+        (symbol, currency, rate, source_time)
+        for symbol, currencies in rates.items()
+        for currency, (rate, source_time) in currencies.items()
+    ]
+    values, params = values_list(rows)
+    session.execute(
+        f"""
+            INSERT INTO rates (symbol, currency, rate, source_time)
+            VALUES {values}
+            ON CONFLICT (symbol, currency)
+            DO
+                UPDATE SET rate = EXCLUDED.rate, source_time = EXCLUDED.source_time, updated_at = NOW()
+        """, params
+    )
+
+
+def extend_rates(rates_dict, currencies):
+    # currencies without a binance pair are derived from the usd rate and carry its source time
+    for cur in set(currencies).difference(rates_dict['btc']):
+        for crypto in rates_dict:
+            usd_rate, source_time = rates_dict[crypto]['usd']
+            rates_dict[crypto][cur] = (Decimal(str(usd_rate)) * currencies[cur], source_time)
 
 
 def update_rates():
+    rates = get_rates()
     with session_scope() as session:
-        currencies = _get_currencies(session)
-        rates = get_rates()
-        extend_rates(rates, currencies, session)
+        extend_rates(rates, _get_currencies(session))
         upload_to_database(rates, session)
+        on_commit(session, lambda: cache.invalidate('rates'))
@@ -1,7 +1,8 @@
 from crypto.manager import manager
 from data_handler import dh
 from utils.db_sessions import session_scope
-from utils.utils import update_rates, update_actual_rates
+from utils.logger import logger
+from utils.utils import update_rates_many, update_actual_rates_many
 
 
 def _get_best_rates_buy(symbol, currency, session):
@@ -37,7 +38,13 @@ def _get_best_rates_sell(symbol, currency, session):
     return session.execute(q, kw).fetchall()
 
 
+def _log_errors(job, errors):
+    for e in errors:
+        logger.warning(f'{job}: public api call failed, {e}')
+
+
 def update_v2_rates():
+    items = []
     with session_scope() as session:
         for currency in dh.get_currencies(session):
             currency = currency['id']
@@ -51,11 +58,13 @@ def update_v2_rates():
                         broker_name = broker_id_to_name.get(str(item['broker']))
                         if broker_name:
                             data_to_send.append({'broker': broker_name, 'rate': item['rate']})
-                    update_rates(data=data_to_send, symbol=symbol, currency=currency, lot_type=lot_type)
+                    items.append((data_to_send, symbol, currency, lot_type))
+    # the public api has no multi-pair endpoint, posts are sent over the pooled connections concurrently
+    _log_errors('update_v2_rates', update_rates_many(items))
 
 
 def update_v2_actual_rates():
     with session_scope() as session:
         rates = session.execute('SELECT symbol, rate, currency FROM rates').fetchall()
-        for rate in rates:
-            update_actual_rates(data={'rate': rate['rate']}, symbol=rate['symbol'], currency=rate['currency'])
+    items = [({'rate': rate['rate']}, rate['symbol'], rate['currency']) for rate in rates]
+    _log_errors('update_v2_actual_rates', update_actual_rates_many(items))
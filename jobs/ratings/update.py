@@ -1,7 +1,7 @@
 import math
-import time
 from decimal import Decimal
 
+from utils.db import bulk_update
 from utils.db_sessions import session_scope
 from utils.logger import logger
 
@@ -26,7 +26,8 @@ def _get_rating_points(user):
 
 def _get_users(session):
     q = """
-        SELECT id, deals_cnt, deals_revenue, total_likes as likes, total_dislikes as dislikes
+        SELECT id, rating, deals_cnt, COALESCE(deals_revenue, 0) AS deals_revenue,
+            total_likes as likes, total_dislikes as dislikes
         FROM "user" 
         WHERE last_action > NOW() - INTERVAL '3 hours' AND NOT is_temporary AND
             nickname NOT LIKE 'fd%' AND nickname NOT LIKE 'fs%'
@@ -34,13 +35,15 @@ def _get_users(session):
     return [dict(item) for item in session.execute(q).fetchall()]
 
 
+def _get_changed_ratings(users):
+    ratings = [(user['id'], user['rating'], _get_rating_points(user)) for user in users]
+    return [(user_id, new_rating) for user_id, rating, new_rating in ratings if rating != new_rating]
+
+
 def update_ratings():
     with session_scope() as session:
         users = _get_users(session)
         logger.info(f'users to update ratings {len(users)}')
-    for user in users:
-        rating = _get_rating_points(user)
-        with session_scope() as session:
-            session.execute(f'UPDATE "user" SET rating = {rating} WHERE id = {user["id"]};')
-        time.sleep(0.5)
-    logger.info(f'Ratings calculated')
+        ratings = _get_changed_ratings(users)
+        bulk_update(session, '"user"', 'id', {'rating': 'integer'}, ratings)
+    logger.info(f'Ratings calculated, {len(ratings)} changed')
@@ -1,34 +1,33 @@
 from utils.db_sessions import session_scope
+from utils.logger import logger
 
 
-def _get_users(session):
-    q = """
-        SELECT id
-        FROM "user" 
-        WHERE last_action > NOW() - INTERVAL '3 hours' AND NOT is_temporary AND
-            nickname NOT LIKE 'fd%' AND nickname NOT LIKE 'fs%'
-    """
-    return [dict(item) for item in session.execute(q).fetchall()]
-
-
-def _get_deals_count_revenue(user_id, session):
+def update_deals_cnt():
     q = """
-        SELECT COUNT(*), COALESCE(SUM(amount_currency), 0)
-        FROM deal
-        WHERE (buyer_id = :uid OR seller_id = :uid) AND state = 'closed'
+        WITH active AS (
+            SELECT id
+            FROM "user"
+            WHERE last_action > NOW() - INTERVAL '3 hours' AND NOT is_temporary AND
+                nickname NOT LIKE 'fd%' AND nickname NOT LIKE 'fs%'
+        ), closed AS (
+            SELECT buyer_id AS user_id, amount_currency
+            FROM deal
+            WHERE state = 'closed' AND buyer_id IN (SELECT id FROM active)
+            UNION ALL
+            SELECT seller_id, amount_currency
+            FROM deal
+            WHERE state = 'closed' AND seller_id IN (SELECT id FROM active) AND seller_id <> buyer_id
+        )
+        UPDATE "user" u
+        SET deals_cnt = s.deals, deals_revenue = s.revenue
+        FROM (
+            SELECT a.id, COUNT(c.user_id) AS deals, COALESCE(SUM(c.amount_currency), 0) AS revenue
+            FROM active a
+            LEFT JOIN closed c ON c.user_id = a.id
+            GROUP BY a.id
+        ) s
+        WHERE u.id = s.id AND (u.deals_cnt, u.deals_revenue) IS DISTINCT FROM (s.deals, s.revenue)
     """
-    return session.execute(q, {'uid': user_id}).fetchone()
-
-
-def update_deals_cnt():
     with session_scope() as session:
-        users = _get_users(session)
-    for user in users:
-        with session_scope() as session:
-            deals, revenue = _get_deals_count_revenue(user['id'], session)
-            q = """
-                UPDATE "user" u
-                SET deals_cnt = :deals, deals_revenue = :revenue
-                WHERE id = :uid
-            """
-            session.execute(q, {'uid': user['id'], 'deals': deals, 'revenue': revenue})
+        updated = session.execute(q).rowcount
+    logger.info(f'Deals count updated for {updated} users')
@@ -7,7 +7,7 @@ from utils.logger import logger
 
 
 def update():
-    balance = BTC.get_secondary_balance() + BTC.get_secondary_deposits()
+    balance = BTC.get_secondary_funds()
     threshold = '0.05'
     deposit = '0.05'
     if balance < Decimal(threshold):
@@ -0,0 +1,33 @@
+import os
+
+from crypto.manager import manager
+from system.address_pool import ADDRESS_POOL_LOW_WATER, ADDRESS_POOL_REFILL_BATCH, ADDRESS_POOL_TARGET, add, get_size
+from utils.db_sessions import session_scope
+from utils.frozen_control_bot import bot
+from utils.logger import logger
+
+alert_chat_id = os.getenv('ADDRESS_POOL_ALERT_CHAT_ID', os.getenv('FROZEN_CONTROL_CHAT_ID'))
+
+
+def _alert(text):
+    logger.warning(text)
+    try:
+        bot.send_message(chat_id=alert_chat_id, text=text)
+    except Exception as e:
+        logger.exception(e)
+
+
+def refill_address_pool():
+    for symbol in manager.currencies:
+        with session_scope() as session:
+            size = get_size(symbol, session)
+        if size < ADDRESS_POOL_LOW_WATER:
+            _alert(f'Address pool {symbol}: {size} keys left, low water mark is {ADDRESS_POOL_LOW_WATER}')
+        try:
+            # every batch is committed on its own, so a node failure keeps what was generated before it
+            while size < ADDRESS_POOL_TARGET:
+                with session_scope() as session:
+                    size += add(symbol, min(ADDRESS_POOL_REFILL_BATCH, ADDRESS_POOL_TARGET - size), session)
+        except Exception as e:
+            logger.exception(e)
+            _alert(f'Address pool {symbol}: refill failed at {size} keys: {e}')
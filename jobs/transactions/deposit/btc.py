@@ -1,12 +1,26 @@
 from decimal import Decimal
+from os import environ
 
 from crypto.btc import BTC
+from system.cache import AddressIndex
+from system.settings import app
 from system.constants import TRANSACTION_TYPE, Action
 from system.funds_changer import change_balance
 from utils.db_sessions import session_scope
 from utils.logger import logger
 from utils.utils import create_operation, _apply_shadow_ban_if_needed
 
+# the cursor stays this many blocks behind the tip, so the latest blocks are scanned again after a reorg
+BTC_SCAN_TARGET_CONFIRMATIONS = int(environ.get('BTC_SCAN_TARGET_CONFIRMATIONS', 6))
+# depth of the first scan when there is no cursor yet
+BTC_SCAN_BOOTSTRAP_BLOCKS = int(environ.get('BTC_SCAN_BOOTSTRAP_BLOCKS', 144))
+CURSOR_KEY = 'btc_scan_last_block'
+
+addresses = AddressIndex(
+    ttl=int(environ.get('BTC_ADDRESS_INDEX_TTL', 600)),
+    bypass=lambda: app.config.get('TESTING', False)
+)
+
 
 def _create_deposit(user_id, wallet_id, amount, txid, address, *, session):
     q = """
@@ -26,38 +40,64 @@ def _create_deposit(user_id, wallet_id, amount, txid, address, *, session):
     _apply_shadow_ban_if_needed(user_id, session)
 
 
-def deposit():
+def _get_cursor(session):
+    return session.execute('SELECT value FROM settings WHERE key = :key', {'key': CURSOR_KEY}).scalar()
+
+
+def _set_cursor(block_hash, session):
+    session.execute(
+        """
+            INSERT INTO settings (key, value) VALUES (:key, :value)
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """, {'key': CURSOR_KEY, 'value': block_hash}
+    )
+
+
+def _get_known_deposits(txids, session):
+    rows = session.execute(
+        "SELECT tx_hash, to_address FROM transactions WHERE type = 'in' AND tx_hash = ANY(:txids)",
+        {'txids': txids}
+    ).fetchall()
+    return {(tx_hash, to_address) for tx_hash, to_address in rows}
+
+
+def _load_wallets(session):
+    def load(addrs):
+        rows = session.execute(
+            "SELECT address, user_id, id FROM wallet WHERE symbol = 'btc' AND address = ANY(:addrs)",
+            {'addrs': addrs}
+        ).fetchall()
+        return {address: (user_id, wallet_id) for address, user_id, wallet_id in rows}
+    return load
+
+
+def deposit(node=BTC):
+    """
+    Scans wallet transactions since the stored block, the cursor is saved in the same transaction as the deposits,
+    so a failed run is repeated from the same block
+    """
     with session_scope() as session:
-        last_tx_count = session.execute("SELECT value FROM settings WHERE key = 'btc_scan_last_tx_count' LIMIT 1").scalar()
-        if last_tx_count is None:
-            last_tx_count = 50
+        cursor = _get_cursor(session) or node.get_block_hash(BTC_SCAN_BOOTSTRAP_BLOCKS)
         min_tx_amount = session.execute("SELECT min_tx_amount FROM crypto_settings WHERE symbol = 'btc' LIMIT 1").scalar()
-    all_deposit_transactions = filter(lambda item: item['category'] == 'receive', BTC.get_all_transactions(int(last_tx_count)))
-    for tx in all_deposit_transactions:
-        if tx['confirmations'] > 0 and Decimal(tx['amount']) >= Decimal(str(min_tx_amount)):
-            with session_scope() as session:
-                is_exists = session.execute(
-                    """
-                        SELECT EXISTS(
-                            SELECT 1 
-                            FROM transactions 
-                            WHERE tx_hash = :txid AND 
-                                type = 'in' AND 
-                                (to_address = :address OR to_address = 'SKY')
-                        )
-                    """,
-                    {'txid': tx['txid'], 'address': tx['address']}
-                ).scalar()
-                if not is_exists:
-                    logger.info(f'new tx in with hash {tx["txid"]}, amount = {tx["amount"]}')
-                    res = session.execute(
-                        "SELECT user_id, id FROM wallet WHERE symbol = 'btc' AND private_key = :addr",
-                        {'addr': tx['address']}
-                    ).fetchone()
-                    if res:
-                        user_id, wallet_id = res
-                        _create_deposit(user_id, wallet_id, tx['amount'], tx['txid'], tx['address'], session=session)
-                        session.execute(
-                            "UPDATE wallet SET total_received = total_received + :amount WHERE id = :wid",
-                            {'amount': tx['amount'], 'wid': wallet_id}
-                        )
+        result = node.list_since_block(cursor, BTC_SCAN_TARGET_CONFIRMATIONS)
+        txs = [
+            tx for tx in result['transactions']
+            if tx['category'] == 'receive' and tx['confirmations'] > 0 and
+            Decimal(str(tx['amount'])) >= Decimal(str(min_tx_amount))
+        ]
+        if txs:
+            known = _get_known_deposits(list({tx['txid'] for tx in txs}), session)
+            wallets = addresses.resolve([tx['address'] for tx in txs], _load_wallets(session))
+            for tx in txs:
+                if (tx['txid'], tx['address']) in known or (tx['txid'], 'SKY') in known:
+                    continue
+                known.add((tx['txid'], tx['address']))
+                logger.info(f'new tx in with hash {tx["txid"]}, amount = {tx["amount"]}')
+                if tx['address'] in wallets:
+                    user_id, wallet_id = wallets[tx['address']]
+                    _create_deposit(user_id, wallet_id, tx['amount'], tx['txid'], tx['address'], session=session)
+                    session.execute(
+                        "UPDATE wallet SET total_received = total_received + :amount WHERE id = :wid",
+                        {'amount': tx['amount'], 'wid': wallet_id}
+                    )
+        _set_cursor(result['lastblock'], session)
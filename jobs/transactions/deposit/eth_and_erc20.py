@@ -1,17 +1,24 @@
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import timedelta, datetime
+from os import environ
 
-from crypto.eth import ETH
+from crypto.eth import ETH, BALANCE_BATCH_SIZE
+from crypto.manager import manager
 from data_handler import dh
 from system.constants import TRANSACTION_TYPE, Action
 from system.funds_changer import change_balance
 from utils.db_sessions import session_scope
+from utils.logger import logger
+from utils.rate_limiter import TokenBucket
 from utils.utils import create_operation, _apply_shadow_ban_if_needed
 
+SCAN_WORKERS = int(environ.get('ETH_DEPOSIT_SCAN_WORKERS', 4))
+rpc_bucket = TokenBucket(rate=float(environ.get('ETH_RPC_REQUESTS_PER_SECOND', 5)))
+
 
 def _get_data(session):
     q = """
-        SELECT private_key, w.id, u.id
+        SELECT private_key, w.id, u.id, address
         FROM wallet w
         LEFT JOIN "user" u ON w.user_id = u.id
         WHERE NOT is_baned AND 
@@ -98,17 +105,39 @@ def _process_tx(tx_id, user_id, amount, nickname, session, symbol):
     _apply_shadow_ban_if_needed(user_id, session)
 
 
+def _get_balances(addresses):
+    rpc_bucket.acquire()
+    return ETH.get_balances(addresses)
+
+
+def _scan_balances(addresses):
+    batches = [addresses[i:i + BALANCE_BATCH_SIZE] for i in range(0, len(addresses), BALANCE_BATCH_SIZE)]
+    balances = {}
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+        for future in as_completed([pool.submit(_get_balances, batch) for batch in batches]):
+            try:
+                balances.update(future.result())
+            except Exception as e:
+                logger.exception(e)
+    return balances
+
+
 def deposit():
     with session_scope() as session:
         data = _get_data(session)
         min_tx_eth = dh.get_settings('eth', session)['min_tx_amount']
-    for pk, wallet_id, user_id in data:
-        time.sleep(0.5)
-        balance_eth = ETH.from_subunit(ETH.get_balance(pk=pk))
-        if balance_eth >= min_tx_eth:
-            with session_scope() as session:
-                gas_price = ETH.get_gas_price(get_default_net_commission(session))
-                _create_deposit_tx_eth(wallet_id=wallet_id, pk=pk, session=session, gas_price=gas_price)
+        default_net_commission = get_default_net_commission(session)
+    wallets = {address or manager.get_address_from_pk('eth', pk): (pk, wallet_id) for pk, wallet_id, _, address in data}
+    balances = _scan_balances(list(wallets))
+    gas_price = None
+    for address, balance in balances.items():
+        if ETH.from_subunit(balance) < min_tx_eth:
+            continue
+        if gas_price is None:
+            gas_price = ETH.get_gas_price(default_net_commission)
+        pk, wallet_id = wallets[address]
+        with session_scope() as session:
+            _create_deposit_tx_eth(wallet_id=wallet_id, pk=pk, session=session, gas_price=gas_price)
 
 
 def check_tx():
@@ -1,5 +1,8 @@
+import threading
 import time
 from decimal import Decimal
+from functools import lru_cache
+from os import environ
 
 from crypto.trx import TRX
 from crypto.usdt import USDT
@@ -7,22 +10,74 @@ from data_handler import dh
 from system.constants import TRANSACTION_TYPE, Action
 from system.funds_changer import change_balance
 from utils.db_sessions import session_scope
+from utils.logger import logger
 from utils.utils import create_operation, _apply_shadow_ban_if_needed
 
+# blocks behind the tip that are not scanned yet, a TRON block is solidified after 19 confirmations
+USDT_SCAN_CONFIRMATIONS = int(environ.get('USDT_SCAN_CONFIRMATIONS', 19))
+# blocks scanned per run at most, the scan catches up over the next runs
+USDT_SCAN_MAX_BLOCKS = int(environ.get('USDT_SCAN_MAX_BLOCKS', 100))
+USDT_ADDRESS_INDEX_TTL = int(environ.get('USDT_ADDRESS_INDEX_TTL', 600))
+CURSOR_KEY = 'usdt_scan_last_block'
 
-def _get_data(session):
+
+def _get_data(session, from_id=0):
     q = """
-        SELECT private_key, w.id, u.id, nickname
+        SELECT private_key, w.id, u.id, nickname, address
         FROM wallet w
         LEFT JOIN "user" u ON w.user_id = u.id
         WHERE NOT is_baned AND 
             NOT is_deleted AND 
             symbol = 'usdt' AND 
-            last_action > NOW() - INTERVAL '10 minutes' AND
             NOT is_temporary AND
-            private_key is not null
+            private_key is not null AND
+            w.id > :from_id
+    """
+    return session.execute(q, {'from_id': from_id}).fetchall()
+
+
+# wallets without a stored address are derived from the passphrase once per process
+_derive_address = lru_cache(maxsize=200_000)(USDT.get_address_from_pk)
+
+
+class DepositAddresses:
+    """
+    Deposit address -> wallet index of the USDT wallets. Wallets created since the last run are added on every run,
+    the whole index is rebuilt every USDT_ADDRESS_INDEX_TTL seconds to pick up regenerated and banned wallets.
     """
-    return session.execute(q).fetchall()
+
+    def __init__(self, ttl):
+        self._ttl = ttl
+        self._index = {}
+        self._max_id = 0
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def get(self, session):
+        with self._lock:
+            if self._built_at is None or time.monotonic() - self._built_at > self._ttl:
+                self._index, self._max_id, self._built_at = {}, 0, time.monotonic()
+            for pk, wallet_id, user_id, nickname, address in _get_data(session, self._max_id):
+                self._index[address or _derive_address(pk)] = (pk, wallet_id, user_id, nickname)
+                self._max_id = max(self._max_id, wallet_id)
+            return self._index
+
+
+addresses = DepositAddresses(USDT_ADDRESS_INDEX_TTL)
+
+
+def _get_cursor(session):
+    value = session.execute('SELECT value FROM settings WHERE key = :key', {'key': CURSOR_KEY}).scalar()
+    return int(value) if value is not None else None
+
+
+def _set_cursor(block_number, session):
+    session.execute(
+        """
+            INSERT INTO settings (key, value) VALUES (:key, :value)
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value
+        """, {'key': CURSOR_KEY, 'value': str(block_number)}
+    )
 
 
 def _create_deposit(wallet_id, pk, session, balance, user_id, nickname):
@@ -51,13 +106,29 @@ def _create_deposit(wallet_id, pk, session, balance, user_id, nickname):
         _apply_shadow_ban_if_needed(user_id, session)
 
 
-def deposit():
+def deposit(node=USDT):
+    """
+    Reads the contract Transfer events of the blocks after the stored cursor and sweeps only the wallets they paid.
+    A wallet is credited with its whole balance as before, so a rescan after a failed run credits nothing twice
+    """
+    latest = node.get_latest_block_number() - USDT_SCAN_CONFIRMATIONS
     with session_scope() as session:
-        data = _get_data(session)
+        cursor = _get_cursor(session)
+        if cursor is None:
+            cursor = latest - USDT_SCAN_MAX_BLOCKS
+        to_block = min(latest, cursor + USDT_SCAN_MAX_BLOCKS)
+        index = addresses.get(session)
         min_tx = dh.get_settings('usdt', session)['min_tx_amount']
-    for pk, wallet_id, user_id, nickname in data:
-        balance = USDT.from_subunit(USDT.get_balance(pk=pk))
-        time.sleep(1)
+
+    received = {}
+    for block_number in range(cursor + 1, to_block + 1):
+        for txid, to_address, _ in node.get_transfers(block_number):
+            if to_address in index:
+                logger.info(f'usdt transfer {txid} to {to_address}')
+                received[to_address] = index[to_address]
+
+    for pk, wallet_id, user_id, nickname in received.values():
+        balance = node.from_subunit(node.get_balance(pk=pk))
         if balance >= min_tx:
             with session_scope() as session:
                 _create_deposit(
@@ -66,4 +137,6 @@ def deposit():
                     user_id=user_id, nickname=nickname
                 )
 
-
+    if to_block > cursor:
+        with session_scope() as session:
+            _set_cursor(to_block, session)
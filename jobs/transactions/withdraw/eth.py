@@ -1,80 +1,123 @@
+import math
 from decimal import Decimal
+from os import environ
 
-from crypto.eth import ETH, web3
+from crypto.eth import ETH, RPCBatchError
+from crypto.gas_oracle import MAX_GAS_PRICE
+from crypto.nonce_manager import NonceManager
 from data_handler import dh
 from utils.db_sessions import session_scope
 from system.funds_changer import change_frozen
-from system.settings import db
-from system.constants import TRANSACTION_TYPE, withdraws_activation_statuses, Action, OperationTypes
+from system.constants import TRANSACTION_TYPE, Action, OperationTypes
 from utils.logger import logger
 from utils.utils import create_operation
 
+# signed withdrawals waiting for their receipt at the same time
+ETH_WITHDRAW_MAX_IN_FLIGHT = int(environ.get('ETH_WITHDRAW_MAX_IN_FLIGHT', 5))
+# seconds without a receipt after which a withdrawal is replaced with a higher gas price
+ETH_WITHDRAW_STUCK_AFTER = int(environ.get('ETH_WITHDRAW_STUCK_AFTER', 600))
+# nodes accept a replacement only if it pays at least 10% more
+ETH_REPLACEMENT_GAS_BUMP = Decimal(environ.get('ETH_REPLACEMENT_GAS_BUMP', '1.125'))
+# runs in a row a withdrawal must be unknown to the node, with its nonce used, before it is signed again
+ETH_WITHDRAW_ORPHAN_CHECKS = int(environ.get('ETH_WITHDRAW_ORPHAN_CHECKS', 3))
+GWEI = 10 ** 9
 
-def _is_withdrawing_now(session):
+nonces = NonceManager(lambda: ETH.get_nonce(ETH.get_address(), 'pending'))
+# transaction id -> consecutive check_tx runs it was found orphaned in
+_orphaned = {}
+
+
+def _get_in_flight(session):
     q = """
-        SELECT EXISTS(
-            SELECT 1 
-            FROM transactions t 
-            LEFT JOIN wallet w ON t.wallet_id = w.id
-            WHERE type = 'out' AND NOT is_confirmed AND symbol = 'eth' AND tx_hash IS NOT NULL AND NOT t.is_deleted
-        )
+        SELECT COUNT(*), MAX(nonce)
+        FROM transactions t
+        LEFT JOIN wallet w ON t.wallet_id = w.id
+        WHERE type = 'out' AND NOT is_confirmed AND symbol = 'eth' AND tx_hash IS NOT NULL AND NOT t.is_deleted
     """
-    return session.execute(q).fetchone()[0]
+    return session.execute(q).fetchone()
 
 
-def _get_tx_to_withdraw(session):
+def _get_txs_to_withdraw(session, limit):
     q = """
         SELECT t.id, u.id, amount_units, to_address, sky_commission
-        FROM transactions t 
+        FROM transactions t
         LEFT JOIN wallet w ON t.wallet_id = w.id
         LEFT JOIN "user" u ON w.user_id = u.id
-        WHERE NOT is_confirmed AND type = 'out' AND symbol = 'eth' AND 
+        WHERE NOT is_confirmed AND type = 'out' AND symbol = 'eth' AND
             NOT is_baned AND NOT u.is_deleted AND NOT t.is_deleted AND tx_hash IS NULL
         ORDER BY t.created_at
-        LIMIT 1
+        LIMIT :limit
+        FOR UPDATE OF t SKIP LOCKED
     """
-    return session.execute(q).fetchone()
+    return session.execute(q, {'limit': limit}).fetchall()
 
 
-def _get_withdrawing_tx(session):
+def _get_withdrawing_txs(session):
     q = """
-        SELECT t.id, tx_hash, u.id, amount_units, nickname, sky_commission, tx_type
-        FROM transactions t 
+        SELECT t.id, tx_hash, u.id AS user_id, amount_units, nickname, sky_commission, tx_type, nonce, gas_price,
+            raw_tx, to_address, replaced_tx_hashes, sent_at < NOW() - make_interval(secs => :stuck) AS is_stuck
+        FROM transactions t
         LEFT JOIN wallet w ON t.wallet_id = w.id
         LEFT JOIN "user" u ON w.user_id = u.id
         WHERE NOT is_confirmed AND type = 'out' AND NOT t.is_deleted AND tx_hash IS NOT NULL AND symbol = 'eth'
-        LIMIT 1
+        ORDER BY nonce
+        FOR UPDATE OF t SKIP LOCKED
     """
-    return session.execute(q).fetchone()
+    return session.execute(q, {'stuck': ETH_WITHDRAW_STUCK_AFTER}).fetchall()
 
 
-def _create_tx(*, to_address, amount, transaction_id, sky_commission, session):
-    net_commission = session.execute(
+def _get_net_commission(session):
+    return session.execute(
         'SELECT net_commission FROM crypto_settings WHERE symbol = :sym',
         {'sym': 'eth'}
     ).scalar()
-    gas_price = ETH.get_gas_price(net_commission)
-    net_commission = ETH.get_net_commission(gas_price, units=True)
 
-    commission = sky_commission
-    tx_hash = ETH.create_tx_out(to_address, amount, gas_price=gas_price)
 
-    total_commission = Decimal(str(commission)) - net_commission
-    q = f"UPDATE transactions SET tx_hash = '{tx_hash}', commission = {total_commission} WHERE id = {transaction_id}"
-    session.execute(q)
+def _sign_tx(*, node, transaction_id, to_address, amount, sky_commission, gas_price, nonce, session,
+             replaced_tx_hash=None):
+    """
+    Signs the withdrawal and stores it, the caller broadcasts the returned raw tx once this is committed,
+    so a sent transaction is never unknown to the db
+    """
+    gas_price_wei = int(Decimal(gas_price) * GWEI)
+    tx_hash, raw_tx = node.sign_tx_out(to_address, node.to_subunit(amount), gas_price_wei, nonce)
+    total_commission = Decimal(str(sky_commission)) - node.get_net_commission(gas_price, units=True)
+    session.execute(
+        """
+            UPDATE transactions
+            SET tx_hash = :tx_hash, raw_tx = :raw_tx, nonce = :nonce, gas_price = :gas_price, commission = :commission,
+                sent_at = NOW(),
+                replaced_tx_hashes = CASE WHEN CAST(:replaced AS text) IS NULL THEN replaced_tx_hashes
+                    ELSE array_append(replaced_tx_hashes, CAST(:replaced AS text)) END
+            WHERE id = :id
+        """, {
+            'tx_hash': tx_hash, 'raw_tx': raw_tx, 'nonce': nonce, 'gas_price': gas_price_wei,
+            'commission': total_commission, 'replaced': replaced_tx_hash, 'id': transaction_id
+        }
+    )
+    return raw_tx
+
+
+def _broadcast(node, raw_txs):
+    for raw_tx in raw_txs:
+        try:
+            node.send_raw_tx(raw_tx)
+        except Exception as e:
+            # check_tx sends it again or, when its nonce was taken, returns the withdrawal to the queue
+            logger.exception(e)
 
 
 def _set_tx_delivery_status(transaction_id, session):
-    q = f'UPDATE transactions SET is_confirmed = TRUE, processed_at = NOW() WHERE id = {transaction_id}'
-    session.execute(q)
+    q = 'UPDATE transactions SET is_confirmed = TRUE, processed_at = NOW() WHERE id = :id'
+    session.execute(q, {'id': transaction_id})
 
 
 def _create_notification(transaction_id, user_id, session):
-    q = f"""
-            INSERT INTO notification (user_id, symbol, type, transaction_id) 
-            VALUES ({user_id}, 'eth', '{TRANSACTION_TYPE}', {transaction_id})
+    q = """
+            INSERT INTO notification (user_id, symbol, type, transaction_id)
+            VALUES (:uid, 'eth', :type, :tid)
         """
-    session.execute(q)
+    session.execute(q, {'uid': user_id, 'type': TRANSACTION_TYPE, 'tid': transaction_id})
 
 
 def _process_tx(transaction_id, user_id, amount, nickname, session, tx_hash, sky_commission, tx_type):
@@ -93,28 +136,120 @@ def _process_tx(transaction_id, user_id, amount, nickname, session, tx_hash, sky
     )
 
 
-def send_withdraw_tx():
+def _return_to_queue(transaction_id, session):
+    session.execute(
+        """
+            UPDATE transactions
+            SET tx_hash = NULL, raw_tx = NULL, nonce = NULL, gas_price = NULL, sent_at = NULL, replaced_tx_hashes = '{}'
+            WHERE id = :id
+        """, {'id': transaction_id}
+    )
+
+
+def send_withdraw_tx(node=ETH, nonce_manager=nonces):
+    """
+    Signs up to ETH_WITHDRAW_MAX_IN_FLIGHT withdrawals with consecutive local nonces, they are mined in one block
+    instead of one per confirmation
+    """
     if not dh.get_withdraw_status('eth'):
         return
+    raw_txs = []
+    try:
+        with session_scope() as session:
+            in_flight, max_nonce = _get_in_flight(session)
+            slots = ETH_WITHDRAW_MAX_IN_FLIGHT - in_flight
+            if slots <= 0:
+                return
+            txs = _get_txs_to_withdraw(session, slots)
+            if not txs:
+                return
+            gas_price = node.get_gas_price(_get_net_commission(session))
+            floor = max_nonce + 1 if max_nonce is not None else 0
+            for transaction_id, user_id, amount, to_address, sky_commission in txs:
+                raw_txs.append(_sign_tx(
+                    node=node, transaction_id=transaction_id, to_address=to_address, amount=amount,
+                    sky_commission=sky_commission, gas_price=gas_price, nonce=nonce_manager.reserve(floor),
+                    session=session
+                ))
+    except BaseException:
+        # the reserved nonces were neither stored nor broadcast, the next run asks the node again
+        nonce_manager.reset()
+        raise
+    _broadcast(node, raw_txs)
+
+
+def check_tx(node=ETH, nonce_manager=nonces):
+    """
+    Confirms every in-flight withdrawal with one batch of receipt requests. Withdrawals left without a receipt
+    are sent again when the node lost them, replaced with a higher gas price when stuck, and returned to the queue
+    when their nonce was used by another transaction and none of their hashes is known to the node
+    for ETH_WITHDRAW_ORPHAN_CHECKS runs in a row. A run the node failed to answer completely is skipped.
+    """
+    raw_txs = []
     with session_scope() as session:
-        if not _is_withdrawing_now(session):
-            t = _get_tx_to_withdraw(session)
-            if t:
-                transaction_id, user_id, amount, to_address, sky_commission = t
-                _create_tx(
-                    to_address=to_address, amount=amount,
-                    transaction_id=transaction_id,
-                    sky_commission=sky_commission, session=session
-                )
-
-
-def check_tx():
-    with session_scope() as session:
-        if _is_withdrawing_now(session):
-            transaction_id, tx_hash, user_id, amount, nickname, sky_commission, tx_type = _get_withdrawing_tx(session)
-            if tx_hash:
-                print(f'tx withdraw check {tx_hash}')
-            if tx_hash and ETH.is_transaction_delievered(tx_hash):
-                _process_tx(transaction_id=transaction_id, user_id=user_id,
-                            amount=amount, nickname=nickname, session=session,
-                            sky_commission=sky_commission, tx_hash=tx_hash, tx_type=tx_type)
+        txs = _get_withdrawing_txs(session)
+        if not txs:
+            return
+        # asked before the receipts: a nonce below it whose receipt is still missing may have been used by another tx
+        latest_nonce = node.get_nonce(node.get_address(), 'latest')
+        try:
+            receipts = node.get_receipts([h for tx in txs for h in (tx['tx_hash'], *tx['replaced_tx_hashes'])])
+        except RPCBatchError as e:
+            logger.warning(f'ETH withdrawals check skipped: {e}')
+            return
+        pending = []
+        for tx in txs:
+            mined = next((h for h in (tx['tx_hash'], *tx['replaced_tx_hashes']) if h in receipts), None)
+            if mined is None:
+                pending.append(tx)
+                continue
+            if mined != tx['tx_hash']:
+                session.execute('UPDATE transactions SET tx_hash = :h WHERE id = :id', {'h': mined, 'id': tx['id']})
+            logger.info(f'tx withdraw check {mined}')
+            _process_tx(transaction_id=tx['id'], user_id=tx['user_id'],
+                        amount=tx['amount_units'], nickname=tx['nickname'], session=session,
+                        sky_commission=tx['sky_commission'], tx_hash=mined, tx_type=tx['tx_type'])
+
+        # withdrawals sent before the pipeline have no nonce, they are only confirmed
+        pending = [tx for tx in pending if tx['nonce'] is not None]
+        for transaction_id in set(_orphaned).difference(tx['id'] for tx in pending):
+            _orphaned.pop(transaction_id)
+        if not pending:
+            return
+        try:
+            known = node.get_known_txs([h for tx in pending for h in (tx['tx_hash'], *tx['replaced_tx_hashes'])])
+        except RPCBatchError as e:
+            logger.warning(f'ETH withdrawals check skipped: {e}')
+            return
+        gas_price = None
+        for tx in pending:
+            if tx['nonce'] >= latest_nonce:
+                _orphaned.pop(tx['id'], None)
+            if tx['nonce'] < latest_nonce:
+                if any(h in known for h in (tx['tx_hash'], *tx['replaced_tx_hashes'])):
+                    # mined, the receipt comes from a node that is behind
+                    _orphaned.pop(tx['id'], None)
+                    continue
+                # the receipt may be missing on a lagging node only, it is never signed again on one answer
+                _orphaned[tx['id']] = _orphaned.get(tx['id'], 0) + 1
+                if _orphaned[tx['id']] < ETH_WITHDRAW_ORPHAN_CHECKS:
+                    continue
+                logger.warning(f'ETH withdrawal {tx["id"]}: nonce {tx["nonce"]} was used by another transaction')
+                _orphaned.pop(tx['id'])
+                _return_to_queue(tx['id'], session)
+                nonce_manager.reset()
+            elif tx['tx_hash'] not in known:
+                raw_txs.append(tx['raw_tx'])
+            elif tx['is_stuck']:
+                gas_price = gas_price or node.get_gas_price(_get_net_commission(session))
+                current = Decimal(tx['gas_price']) / GWEI
+                bumped = min(max(math.ceil(current * ETH_REPLACEMENT_GAS_BUMP), gas_price), MAX_GAS_PRICE)
+                if bumped < current * Decimal('1.1'):
+                    logger.warning(f'ETH withdrawal {tx["id"]} is stuck at the max gas price')
+                    continue
+                raw_txs.append(_sign_tx(
+                    node=node, transaction_id=tx['id'], to_address=tx['to_address'], amount=tx['amount_units'],
+                    sky_commission=tx['sky_commission'], gas_price=bumped, nonce=tx['nonce'], session=session,
+                    replaced_tx_hash=tx['tx_hash']
+                ))
+    _broadcast(node, raw_txs)
@@ -0,0 +1,45 @@
+from os import environ
+
+from crypto.manager import manager
+from utils.logger import logger
+
+# keys kept ready per symbol, the refill job tops the pool up to the target
+ADDRESS_POOL_TARGET = int(environ.get('ADDRESS_POOL_TARGET', 500))
+ADDRESS_POOL_LOW_WATER = int(environ.get('ADDRESS_POOL_LOW_WATER', 100))
+ADDRESS_POOL_REFILL_BATCH = int(environ.get('ADDRESS_POOL_REFILL_BATCH', 100))
+
+
+def claim(symbol, session):
+    """
+    (private key, address) for a new wallet. The key is taken out of the pool in the caller's transaction,
+    so it goes back to the pool on rollback. An empty pool falls back to generating the key on the spot
+    """
+    res = session.execute(
+        """
+            DELETE FROM address_pool
+            WHERE id = (
+                SELECT id FROM address_pool WHERE symbol = :sym ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED
+            )
+            RETURNING private_key, address
+        """, {'sym': symbol}
+    ).fetchone()
+    if res is not None:
+        return tuple(res)
+    logger.warning(f'address pool of {symbol} is empty, generating the key on the spot')
+    pk = manager.get_new_pk(symbol)
+    return pk, manager.get_address_from_pk(symbol, pk)
+
+
+def get_size(symbol, session):
+    return session.execute('SELECT COUNT(*) FROM address_pool WHERE symbol = :sym', {'sym': symbol}).scalar()
+
+
+def add(symbol, count, session):
+    pks = manager.get_new_pks(symbol, count)
+    session.execute(
+        """
+            INSERT INTO address_pool (symbol, private_key, address) VALUES (:sym, :pk, :address)
+            ON CONFLICT (private_key) DO NOTHING
+        """, [{'sym': symbol, 'pk': pk, 'address': manager.get_address_from_pk(symbol, pk)} for pk in pks]
+    )
+    return len(pks)
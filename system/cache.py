@@ -0,0 +1,151 @@
+import threading
+from copy import deepcopy
+
+from cachetools import TTLCache
+
+
+class ReferenceCache:
+    """
+    TTL cache for slowly changing reference data (settings, currencies, brokers, rates).
+    Every namespace has its own ttl, values are copied on the way out so callers can't modify cached data.
+    """
+
+    def __init__(self, ttls, maxsize=100, bypass=None):
+        self._caches = {namespace: TTLCache(maxsize=maxsize, ttl=ttl) for namespace, ttl in ttls.items()}
+        self._stats = {namespace: {'hits': 0, 'misses': 0} for namespace in ttls}
+        # bumped on invalidation, so a value loaded before it is not stored after it
+        self._generations = {namespace: 0 for namespace in ttls}
+        self._bypass = bypass or (lambda: False)
+        self._lock = threading.Lock()
+
+    def get_or_load(self, namespace, key, loader):
+        if self._bypass():
+            return loader()
+        cache = self._caches[namespace]
+        with self._lock:
+            if key in cache:
+                self._stats[namespace]['hits'] += 1
+                return deepcopy(cache[key])
+            self._stats[namespace]['misses'] += 1
+            generation = self._generations[namespace]
+        value = loader()
+        with self._lock:
+            if generation == self._generations[namespace]:
+                cache[key] = value
+        return deepcopy(value)
+
+    def invalidate(self, namespace=None, key=None):
+        with self._lock:
+            namespaces = [namespace] if namespace else list(self._caches)
+            for name in namespaces:
+                self._generations[name] += 1
+                if key is None:
+                    self._caches[name].clear()
+                else:
+                    self._caches[name].pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                namespace: dict(counters, size=len(self._caches[namespace]))
+                for namespace, counters in self._stats.items()
+            }
+
+
+class AddressIndex:
+    """
+    Deposit address -> wallet index for the deposit scanners. Unknown addresses of a batch are loaded with one
+    query, addresses that are not ours are not cached, so a wallet created in the meantime is found on the next scan.
+    """
+
+    def __init__(self, ttl, maxsize=100_000, bypass=None):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._bypass = bypass or (lambda: False)
+        self._lock = threading.Lock()
+
+    def resolve(self, addresses, loader):
+        """
+        loader gets the list of unknown addresses and returns {address: wallet} for the ones it found
+        """
+        addresses = set(addresses)
+        if self._bypass():
+            return loader(list(addresses)) if addresses else {}
+        with self._lock:
+            found = {address: self._cache[address] for address in addresses if address in self._cache}
+        missing = addresses - found.keys()
+        if missing:
+            loaded = loader(list(missing))
+            with self._lock:
+                self._cache.update(loaded)
+            found.update(loaded)
+        return found
+
+    def invalidate(self, address=None):
+        with self._lock:
+            if address is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(address, None)
+
+
+class IdentityCache:
+    """
+    Bounded LRU + TTL cache of a key -> id lookup (telegram_id -> user_id). Unknown keys are cached as well,
+    with a shorter ttl, so repeated requests of unregistered users don't query the database every time.
+    """
+
+    _MISSING = object()
+
+    def __init__(self, ttl, negative_ttl, maxsize=50_000, bypass=None):
+        self._found = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._not_found = TTLCache(maxsize=maxsize, ttl=negative_ttl)
+        self._stats = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+        # bumped on invalidation, so a value loaded before it is not stored after it
+        self._generation = 0
+        self._bypass = bypass or (lambda: False)
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader):
+        """
+        loader returns the id or None for an unknown key
+        """
+        if self._bypass():
+            return loader()
+        with self._lock:
+            value = self._found.get(key, self._MISSING)
+            if value is not self._MISSING:
+                self._stats['hits'] += 1
+                return value
+            if key in self._not_found:
+                self._stats['negative_hits'] += 1
+                return None
+            self._stats['misses'] += 1
+            generation = self._generation
+        value = loader()
+        with self._lock:
+            if generation == self._generation:
+                if value is None:
+                    self._not_found[key] = True
+                else:
+                    self._found[key] = value
+        return value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            self._generation += 1
+            if key is None:
+                self._found.clear()
+                self._not_found.clear()
+            else:
+                self._found.pop(key, None)
+                self._not_found.pop(key, None)
+
+    def invalidate_value(self, value):
+        with self._lock:
+            self._generation += 1
+            for key in [k for k, v in self._found.items() if v == value]:
+                self._found.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._found), negative_size=len(self._not_found))
@@ -20,6 +20,11 @@ TRANSACTION_TYPE = 'transaction'
 MESSAGE_TYPE = 'message'
 DEAL_TYPE = 'deal'
 
+NOTIFICATION_UPDATE_TYPES = (
+    'message', 'new-referral', 'promocode', 'transaction', 'deal', 'dispute', 'closed_dispute',
+    'closed_dispute_admin', 'dispute_notification', 'income_referral', 'timeout', 'cancel_deal', 'accounts_join'
+)
+
 ONLINE_MINUTES = 60
 CURRENCIES = ('rub', 'inr', 'usd', 'uah')
 
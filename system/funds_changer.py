@@ -1,7 +1,13 @@
 from crypto.manager import manager
+from utils.db import values_list
+from utils.order_book import order_book
 from utils.utils import validate_amounts
 
 
+class WalletNotFoundError(ValueError):
+    pass
+
+
 def get_only_subunits(meth):
     def wrapper(*args, **kwargs):
         amount = kwargs.get('amount')
@@ -12,52 +18,95 @@ def get_only_subunits(meth):
     return wrapper
 
 
-def _change_funds(*, user_id, symbol, msg, session, change_balance_subunits=0, change_frozen_subunits=0):
-    q1 = """
-        SELECT balance, frozen
-        FROM wallet 
-        WHERE user_id = :uid AND symbol = :sym
+def _unit(symbol):
+    # multiplying by the size of one subunit converts exactly in sql, numeric products keep every digit
+    return manager.from_subunit(symbol, 1)
+
+
+def change_funds_many(legs, *, session):
     """
-    b, f = session.execute(q1, {'uid': user_id, 'sym': symbol}).fetchone()
-    if b + change_balance_subunits < 0 or f + change_frozen_subunits < 0:
-        raise Exception(f'balance or frozen < 0, msg = {msg}, user_id = {user_id}')
-
-    q = """
-        UPDATE wallet 
-        SET balance = balance + :bal_amount, frozen = frozen + :frozen_amount
-        WHERE user_id = :uid AND symbol = :sym
-        RETURNING id, balance, frozen;
+    Applies several wallet changes in one statement, legs are dicts with user_id, symbol, msg and
+    balance_subunits / frozen_subunits. Legs of the same wallet are applied in order, every intermediate
+    balance and frozen is guarded to stay non negative, every leg gets its own insidetransaction record.
+    A leg must change something, like the amounts checked by validate_amounts.
     """
-    wallet_id, new_balance, new_frozen = session.execute(
-        q, {
-            'bal_amount': change_balance_subunits,
-            'frozen_amount': change_frozen_subunits,
-            'uid': user_id,
-            'sym': symbol
-        }
-    ).fetchone()
-    if new_balance < 0 or new_frozen < 0:
-        nick = session.execute('SELECT nickname FROM "user" WHERE id = :uid', {'uid': user_id}).scalar()
-        raise ValueError(f'User /u{nick} frozen < 0, {msg}')
-    new_balance = manager.from_subunit(symbol, new_balance)
-    new_frozen = manager.from_subunit(symbol, new_frozen)
-    change_balance_amount = manager.from_subunit(symbol, change_balance_subunits)
-    change_frozen_amount = manager.from_subunit(symbol, change_frozen_subunits)
-    q = """
-        INSERT INTO insidetransaction (message, balance, frozen, change_balance, change_frozen, user_id, symbol)
-        VALUES (:msg, :bal, :frozen, :change_bal, :change_frozen, :uid, :sym) 
+    wallets = {}
+    wallet_rows, leg_rows = [], []
+    for position, leg in enumerate(legs):
+        d_balance = leg.get('balance_subunits', 0)
+        d_frozen = leg.get('frozen_subunits', 0)
+        if d_balance is None or d_frozen is None or (not d_balance and not d_frozen):
+            raise ValueError(f'amount must be passed correctly, {leg["msg"]}')
+        wallet = wallets.setdefault((leg['user_id'], leg['symbol']), {
+            'balance': 0, 'frozen': 0, 'min_balance': 0, 'min_frozen': 0, 'legs': [], 'msg': leg['msg']
+        })
+        wallet['balance'] += d_balance
+        wallet['frozen'] += d_frozen
+        wallet['min_balance'] = min(wallet['min_balance'], wallet['balance'])
+        wallet['min_frozen'] = min(wallet['min_frozen'], wallet['frozen'])
+        wallet['legs'].append((position, leg['msg'], d_balance, d_frozen, wallet['balance'], wallet['frozen']))
+    if not wallets:
+        return
+
+    for (user_id, symbol), wallet in wallets.items():
+        wallet_rows.append((user_id, symbol, wallet['balance'], wallet['frozen'], wallet['min_balance'], wallet['min_frozen']))
+        for position, msg, d_balance, d_frozen, balance_after, frozen_after in wallet['legs']:
+            # offsets from the final wallet state to the state right after this leg
+            leg_rows.append((
+                position, user_id, symbol, msg, d_balance, d_frozen,
+                balance_after - wallet['balance'], frozen_after - wallet['frozen'], _unit(symbol)
+            ))
+    wallets_values, params = values_list(wallet_rows, 'w')
+    legs_values, legs_params = values_list(leg_rows, 'l')
+    params.update(legs_params)
+    q = f"""
+        WITH wallets (user_id, symbol, d_balance, d_frozen, min_balance, min_frozen) AS (VALUES {wallets_values}),
+        legs (idx, user_id, symbol, msg, d_balance, d_frozen, balance_offset, frozen_offset, unit) AS (VALUES {legs_values}),
+        changed AS (
+            UPDATE wallet w
+            SET balance = w.balance + c.d_balance::numeric, frozen = w.frozen + c.d_frozen::numeric
+            FROM wallets c
+            WHERE w.user_id = c.user_id AND w.symbol = c.symbol
+                AND w.balance + c.min_balance::numeric >= 0 AND w.frozen + c.min_frozen::numeric >= 0
+            RETURNING w.user_id, w.symbol, w.balance, w.frozen
+        ),
+        ledger AS (
+            INSERT INTO insidetransaction (message, balance, frozen, change_balance, change_frozen, user_id, symbol)
+            SELECT l.msg, (c.balance + l.balance_offset::numeric) * l.unit::numeric,
+                (c.frozen + l.frozen_offset::numeric) * l.unit::numeric,
+                l.d_balance::numeric * l.unit::numeric, l.d_frozen::numeric * l.unit::numeric, l.user_id, l.symbol
+            FROM legs l
+            JOIN changed c ON c.user_id = l.user_id AND c.symbol = l.symbol
+            ORDER BY l.idx
+        )
+        SELECT user_id, symbol FROM changed
     """
-    session.execute(
-        q, {
-            'msg': msg,
-            'bal': new_balance,
-            'frozen': new_frozen,
-            'change_bal': change_balance_amount,
-            'change_frozen': change_frozen_amount,
-            'sym': symbol,
-            'uid': user_id
-        }
-    )
+    changed = {(user_id, symbol) for user_id, symbol in session.execute(q, params)}
+    failed = [key for key in wallets if key not in changed]
+    for user_id, symbol in failed:
+        exists = session.execute(
+            'SELECT EXISTS(SELECT 1 FROM wallet WHERE user_id = :uid AND symbol = :sym)',
+            {'uid': user_id, 'sym': symbol}
+        ).scalar()
+        if not exists:
+            raise WalletNotFoundError(f'User {user_id} has no {symbol} wallet, {wallets[user_id, symbol]["msg"]}')
+    if failed:
+        user_id, symbol = failed[0]
+        nick = session.execute('SELECT nickname FROM "user" WHERE id = :uid', {'uid': user_id}).scalar()
+        raise ValueError(f'User /u{nick} balance or frozen < 0, {wallets[failed[0]]["msg"]}, symbol = {symbol}')
+    changed_balances = [user_id for (user_id, _), wallet in wallets.items() if any(leg[2] for leg in wallet['legs'])]
+    if changed_balances:
+        order_book.users_changed(session, *changed_balances)
+
+
+def _change_funds(*, user_id, symbol, msg, session, change_balance_subunits=0, change_frozen_subunits=0):
+    change_funds_many([{
+        'user_id': user_id,
+        'symbol': symbol,
+        'msg': msg,
+        'balance_subunits': change_balance_subunits,
+        'frozen_subunits': change_frozen_subunits,
+    }], session=session)
 
 
 @validate_amounts
@@ -1,13 +1,14 @@
 from os import path, environ as env
 from typing import Tuple
 
-from cachetools import TTLCache
 from flask import Flask
 from flask_mail import Mail
 from sqlalchemy import create_engine, MetaData
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
+from system.cache import ReferenceCache, IdentityCache
+
 APP_NAME = 'SKY API'
 
 
@@ -37,4 +38,22 @@ app = create_app(env.get('KEY', ""), env.get('MAIL_PASSWORD', ""))
 mail = Mail(app)
 TEST = env.get('TEST')
 
-cache = TTLCache(maxsize=100, ttl=60)
+cache = ReferenceCache(
+    ttls={
+        'settings': int(env.get('SETTINGS_CACHE_TTL', 60)),
+        'crypto_settings': int(env.get('SETTINGS_CACHE_TTL', 60)),
+        'currencies': int(env.get('CURRENCIES_CACHE_TTL', 300)),
+        'brokers': int(env.get('BROKERS_CACHE_TTL', 300)),
+        'rates': int(env.get('RATES_CACHE_TTL', 10)),
+    },
+    bypass=lambda: app.config.get('TESTING', False)
+)
+
+telegram_ids = IdentityCache(
+    # accounts are joined outside this service, nothing here invalidates on the write, the ttl bounds staleness
+    ttl=int(env.get('TELEGRAM_ID_CACHE_TTL', 60)),
+    # short, an unknown id may register in another process
+    negative_ttl=int(env.get('TELEGRAM_ID_NEGATIVE_CACHE_TTL', 10)),
+    maxsize=int(env.get('TELEGRAM_ID_CACHE_SIZE', 50_000)),
+    bypass=lambda: app.config.get('TESTING', False)
+)
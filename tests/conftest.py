@@ -44,4 +44,5 @@ pytest_plugins = [
     "tests.fixtures.disputes",
     "tests.fixtures.merchant",
     "tests.fixtures.commissions",
+    "tests.fixtures.notifications",
 ]
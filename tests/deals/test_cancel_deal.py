@@ -32,7 +32,7 @@ class TestCancelDeal(AbstractDealTest):
 
         self._update_wallet({"frozen": deal.amount_subunit_frozen}, wallet.id, db_session)
 
-        with patch("utils.notifications_queue._send_queue_notification"):
+        with patch("utils.notifications_queue._send_queue_notifications"):
             response = self._cancel_deal(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json == {"success": "deal canceled"}
@@ -131,7 +131,7 @@ class TestCancelDeal(AbstractDealTest):
         self._update_deal({"state": "paid"}, deal.id, db_session)
         self._update_wallet({"frozen": deal.amount_subunit_frozen}, wallet.id, db_session)
 
-        with patch("utils.notifications_queue._send_queue_notification"):
+        with patch("utils.notifications_queue._send_queue_notifications"):
             response = self._cancel_deal(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json == {"success": "deal canceled"}
@@ -160,7 +160,7 @@ class TestCancelDeal(AbstractDealTest):
         self._update_deal({"state": "confirmed"}, deal.id, db_session)
         self._update_wallet({"frozen": deal.amount_subunit_frozen}, wallet.id, db_session)
 
-        with patch("utils.notifications_queue._send_queue_notification"):
+        with patch("utils.notifications_queue._send_queue_notifications"):
             response = self._cancel_deal(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json == {"success": "deal canceled"}
\ No newline at end of file
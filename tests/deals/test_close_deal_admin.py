@@ -33,7 +33,7 @@ class TestCancelDealAdmin(AbstractDealTest):
 
         self._update_wallet({"frozen": deal.amount_subunit_frozen}, wallet.id, db_session)
 
-        with patch("utils.notifications_queue._send_queue_notification"):
+        with patch("utils.notifications_queue._send_queue_notifications"):
             response = self._cancel_deal_admin(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json == {"success": "deal canceled"}
@@ -65,7 +65,7 @@ class TestCancelDealAdmin(AbstractDealTest):
             "winner": "buyer"
         }
 
-        with patch("utils.notifications_queue._send_queue_notification"):
+        with patch("utils.notifications_queue._send_queue_notifications"):
             response = self._cancel_deal_admin(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json == {"success": "deal canceled"}
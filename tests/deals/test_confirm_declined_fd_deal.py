@@ -34,7 +34,7 @@ class TestConfirmDeclinedFdDeal(AbstractDealTest):
         wallet_factory(deal.buyer_id, Decimal("100000000000"))
         self._update_deal({"state": "deleted"}, deal.id, db_session)
 
-        with patch("utils.notifications_queue._send_queue_notification"):
+        with patch("utils.notifications_queue._send_queue_notifications"):
             response = self._confirm_declined_fd_deal(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json == {"success": "deal processed"}
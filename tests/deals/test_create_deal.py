@@ -48,7 +48,7 @@ class TestCreateDeal(AbstractDealTest):
             "amount": amount,
             "amount_currency": 1,
         }
-        with patch("utils.notifications_queue._send_queue_notification"):
+        with patch("utils.notifications_queue._send_queue_notifications"):
             response = self._create_deal(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json["amount"] == amount
@@ -90,7 +90,7 @@ class TestCreateDeal(AbstractDealTest):
         )
         db_session.execute(stmt)
 
-        with patch("utils.notifications_queue._send_queue_notification"):
+        with patch("utils.notifications_queue._send_queue_notifications"):
             response = self._create_deal(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json["amount"] == amount
@@ -0,0 +1,92 @@
+from decimal import Decimal
+from typing import Callable
+from unittest.mock import patch
+
+from flask import Response
+from flask.testing import FlaskClient
+
+from data_handler import dh
+from system.settings import Session
+from tests.deals.abstract_deal_test import AbstractDealTest
+from utils.loaders import Loader, loading
+from utils.tables import UserDTO, DealDTO, LotDTO, BrokerDTO, CurrencyDTO
+
+
+class TestGetDeal(AbstractDealTest):
+    def _get_deal(self, client: FlaskClient, identificator: str, token: str) -> Response:
+        return self._make_get_request(client, f"/deal/{identificator}", token)
+
+    def test_get_deal_valid(
+            self, client: FlaskClient, token: str, user: UserDTO, lot: LotDTO, broker: BrokerDTO, deal: DealDTO
+    ):
+        response = self._get_deal(client, deal.identificator, token)
+        assert response.status == self.HttpStatus.OK
+        assert response.json["identificator"] == deal.identificator
+        assert response.json["seller"]["id"] == user.id
+        assert response.json["buyer"]["id"] == deal.buyer_id
+        assert response.json["lot"]["identificator"] == lot.identificator
+        assert response.json["lot"]["broker"] == broker.name
+
+    def test_get_deal_not_exist_invalid(self, client: FlaskClient, token: str, deal: DealDTO):
+        response = self._get_deal(client, "identificator", token)
+        assert response.status == self.HttpStatus.BAD_REQUEST
+
+    def _create_deals(
+            self, count: int, user: UserDTO, lot: LotDTO, currency: CurrencyDTO,
+            deal_factory: Callable[..., DealDTO], user_factory: Callable[..., UserDTO]
+    ) -> list:
+        buyer = user_factory()
+        return [
+            deal_factory(
+                Decimal("0.01"), Decimal("1000000"), Decimal("1000000"), buyer.id, user.id, lot.id,
+                Decimal("24"), "123123123", "btc", currency.id, 0
+            )
+            for _ in range(count)
+        ]
+
+    def test_get_deals_batch_loading_valid(
+            self,
+            user: UserDTO,
+            lot: LotDTO,
+            currency: CurrencyDTO,
+            deal_factory: Callable[..., DealDTO],
+            user_factory: Callable[..., UserDTO],
+            db_session: Session
+    ):
+        deals = self._create_deals(10, user, lot, currency, deal_factory, user_factory)
+
+        with loading(db_session) as loader:
+            serialized = dh.get_deal("btc", [d.id for d in deals], session=db_session)
+        assert sorted(d["identificator"] for d in serialized) == sorted(d.identificator for d in deals)
+        assert "loader" not in db_session.info
+
+        stats = loader.stats
+        # one query for users, one for lots and one for brokers instead of 60 single row lookups
+        assert stats["queries"] == 3
+        assert stats["saved_queries"] == 57
+
+    def test_loader_scoped_to_one_serialization_valid(
+            self,
+            user: UserDTO,
+            lot: LotDTO,
+            currency: CurrencyDTO,
+            deal_factory: Callable[..., DealDTO],
+            user_factory: Callable[..., UserDTO],
+            db_session: Session
+    ):
+        deal, = self._create_deals(1, user, lot, currency, deal_factory, user_factory)
+        loaders = []
+
+        def create_loader(session: Session) -> Loader:
+            loaders.append(Loader(session))
+            return loaders[-1]
+
+        with patch("utils.loaders.Loader", side_effect=create_loader):
+            dh.get_deal("btc", [deal.id], session=db_session)
+            db_session.execute('UPDATE "user" SET nickname = :nick WHERE id = :id', {"nick": "renamed", "id": user.id})
+            serialized, = dh.get_deal("btc", [deal.id], session=db_session)
+
+        # users, lots and brokers of one call share a loader, written rows are read again by the next call
+        assert [loader.stats["queries"] for loader in loaders] == [3, 3]
+        assert serialized["seller"]["nickname"] == "renamed"
+        assert "loader" not in db_session.info
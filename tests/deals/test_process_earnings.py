@@ -40,7 +40,7 @@ class TestProcessEarnings(AbstractDealTest):
             "user_id": deal.seller_id
         }
 
-        with patch("utils.notifications_queue._send_queue_notification"):
+        with patch("utils.notifications_queue._send_queue_notifications"):
             response = self._update_deal_state(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json == {"success": "deal processed"}
@@ -96,7 +96,7 @@ class TestProcessEarnings(AbstractDealTest):
             "user_id": deal.seller_id
         }
 
-        with patch("utils.notifications_queue._send_queue_notification"):
+        with patch("utils.notifications_queue._send_queue_notifications"):
             response = self._update_deal_state(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json == {"success": "deal processed"}
@@ -160,7 +160,7 @@ class TestProcessEarnings(AbstractDealTest):
         }
 
         with patch(
-                "utils.notifications_queue._send_queue_notification"
+                "utils.notifications_queue._send_queue_notifications"
         ), patch(
             "utils.utils._get_purchase", return_value=purchase_value
         ),patch(
@@ -225,7 +225,7 @@ class TestProcessEarnings(AbstractDealTest):
         }
 
         with patch(
-                "utils.notifications_queue._send_queue_notification"
+                "utils.notifications_queue._send_queue_notifications"
         ), patch(
             "utils.utils._get_purchase", return_value=purchase_value
         ), patch(
@@ -283,7 +283,7 @@ class TestProcessEarnings(AbstractDealTest):
         }
 
         with patch(
-                "utils.notifications_queue._send_queue_notification"
+                "utils.notifications_queue._send_queue_notifications"
         ), patch(
             "utils.utils._get_payment_v2", return_value=payment_v2_value
         ), patch(
@@ -339,7 +339,7 @@ class TestProcessEarnings(AbstractDealTest):
         }
 
         with patch(
-                "utils.notifications_queue._send_queue_notification"
+                "utils.notifications_queue._send_queue_notifications"
         ), patch(
             "utils.utils._get_sell", return_value=sell_value
         ), patch(
@@ -398,7 +398,7 @@ class TestProcessEarnings(AbstractDealTest):
         }
 
         with patch(
-                "utils.notifications_queue._send_queue_notification"
+                "utils.notifications_queue._send_queue_notifications"
         ), patch(
             "utils.utils._get_sell", return_value=sell_value
         ), patch(
@@ -452,7 +452,7 @@ class TestProcessEarnings(AbstractDealTest):
         }
 
         with patch(
-                "utils.notifications_queue._send_queue_notification"
+                "utils.notifications_queue._send_queue_notifications"
         ), patch(
             "utils.utils._complete_sale_v2"
         ):
@@ -47,7 +47,7 @@ class TestProcessReferral(AbstractDealTest):
             "user_id": deal.seller_id
         }
 
-        with patch("utils.notifications_queue._send_queue_notification"):
+        with patch("utils.notifications_queue._send_queue_notifications"):
             response = self._update_deal_state(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json == {"success": "deal processed"}
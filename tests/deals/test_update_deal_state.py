@@ -22,7 +22,7 @@ class TestUpdateDealState(AbstractDealTest):
             "user_id": user.id
         }
 
-        with patch("utils.notifications_queue._send_queue_notification"):
+        with patch("utils.notifications_queue._send_queue_notifications"):
             response = self._update_deal_state(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json == {"success":"new deal status = confirmed"}
@@ -71,7 +71,7 @@ class TestUpdateDealState(AbstractDealTest):
 
         self._update_deal({"state": "confirmed"}, deal.id, db_session)
 
-        with patch("utils.notifications_queue._send_queue_notification"):
+        with patch("utils.notifications_queue._send_queue_notifications"):
             response = self._update_deal_state(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json == {"success": "new deal status = paid"}
@@ -105,7 +105,7 @@ class TestUpdateDealState(AbstractDealTest):
             db_session
         )
 
-        with patch("data_handler.DataHandler._process_earnings"), patch("utils.notifications_queue._send_queue_notification"):
+        with patch("data_handler.DataHandler._process_earnings"), patch("utils.notifications_queue._send_queue_notifications"):
             response = self._update_deal_state(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json == {"success": "deal processed"}
@@ -133,7 +133,7 @@ class TestUpdateDealState(AbstractDealTest):
 
         self._update_deal({"state": "paid"}, deal.id, db_session)
 
-        with patch("data_handler.DataHandler._process_earnings"), patch("utils.notifications_queue._send_queue_notification"):
+        with patch("data_handler.DataHandler._process_earnings"), patch("utils.notifications_queue._send_queue_notifications"):
             response = self._update_deal_state(client, data, token)
             assert response.status == self.HttpStatus.OK
             assert response.json == {"success": "deal processed"}
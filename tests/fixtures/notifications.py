@@ -0,0 +1,32 @@
+from typing import Callable, Optional
+
+import pytest
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from utils.db import mapping_result_to_dto
+from utils.tables import NotificationDTO, notifications_table
+
+
+@pytest.fixture
+def notification_factory(db_session: Session) -> Callable[..., NotificationDTO]:
+    def create_notification(
+            user_id: int,
+            type_: str,
+            symbol: Optional[str] = None,
+            **kwargs
+    ) -> NotificationDTO:
+        stmt = (
+            insert(notifications_table)
+            .values(
+                user_id=user_id,
+                type=type_,
+                symbol=symbol or "usdt",
+                **kwargs
+            )
+            .returning(notifications_table)
+        )
+        result = db_session.execute(stmt)
+        return mapping_result_to_dto(result, NotificationDTO)
+
+    return create_notification
@@ -0,0 +1,37 @@
+from decimal import Decimal
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from jobs.lots.update_rate import reprice_lots
+from utils.tables import CurrencyDTO, LotDTO, RateDTO, UserDTO
+
+
+class TestRepriceLots:
+    def _select_rate(self, lot_id: int, db_session: Session) -> Decimal:
+        return db_session.execute("SELECT rate FROM lot WHERE id = :id", {"id": lot_id}).scalar()
+
+    def test_coefficient_and_variation_applied(
+            self,
+            user: UserDTO,
+            currency: CurrencyDTO,
+            rate_factory: Callable[..., RateDTO],
+            lot_factory: Callable[..., LotDTO],
+            db_session: Session
+    ):
+        rate_factory("usdt", Decimal("100"), currency.id)
+        following = lot_factory(100, 1000, Decimal("1"), user.id, "usdt", currency.id, "sell",
+                                coefficient=Decimal("1.1"))
+        clamped_up = lot_factory(100, 1000, Decimal("1"), user.id, "usdt", currency.id, "sell",
+                                 coefficient=Decimal("2"))
+        fixed_low = lot_factory(100, 1000, Decimal("10"), user.id, "usdt", currency.id, "sell")
+        fixed_ok = lot_factory(100, 1000, Decimal("90"), user.id, "usdt", currency.id, "sell")
+
+        assert reprice_lots(db_session) == 3
+
+        # the currency allows 25% from the rate
+        assert self._select_rate(following.id, db_session) == Decimal("110")
+        assert self._select_rate(clamped_up.id, db_session) == Decimal("125")
+        assert self._select_rate(fixed_low.id, db_session) == Decimal("75")
+        assert self._select_rate(fixed_ok.id, db_session) == Decimal("90")
+        assert reprice_lots(db_session) == 0
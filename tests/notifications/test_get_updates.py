@@ -0,0 +1,73 @@
+from typing import Callable
+
+from flask import Response
+from flask.testing import FlaskClient
+from sqlalchemy import select
+
+from system.constants import DISPUTE_TIME
+from system.settings import Session
+from tests.abstract_test import AbstractAPITest
+from utils.tables import UserDTO, DealDTO, NotificationDTO, notifications_table
+
+
+class TestGetUpdates(AbstractAPITest):
+    def _get_updates(self, client: FlaskClient, token: str) -> Response:
+        return self._make_get_request(client, "/updates", token)
+
+    def _select_telegram_notified(self, notification_ids: list, db_session: Session) -> list:
+        stmt = (
+            select([notifications_table.c.telegram_notified])
+            .where(notifications_table.c.id.in_(notification_ids))
+        )
+        return [notified for notified, in db_session.execute(stmt)]
+
+    def test_get_updates_deal_notifications_valid(
+            self,
+            client: FlaskClient,
+            token: str,
+            user: UserDTO,
+            deal: DealDTO,
+            notification_factory: Callable[..., NotificationDTO],
+            db_session: Session
+    ):
+        notifications = [
+            notification_factory(deal.buyer_id, "deal", deal_id=deal.id),
+            notification_factory(user.id, "dispute", deal_id=deal.id),
+            notification_factory(user.id, "closed_dispute_admin", deal_id=deal.id),
+            notification_factory(deal.buyer_id, "timeout", deal_id=deal.id),
+            notification_factory(user.id, "cancel_deal", deal_id=deal.id),
+        ]
+
+        response = self._get_updates(client, token)
+        assert response.status == self.HttpStatus.OK
+        assert response.json["deals"]["deals"] == [
+            {"user_id": deal.buyer_id, "opponent": user.id, "deal_id": deal.identificator}
+        ]
+        assert response.json["deals"]["disputes"] == [
+            {"user_id": user.id, "deal_id": deal.identificator, "dispute_time": DISPUTE_TIME, "admin": False}
+        ]
+        assert response.json["deals"]["closed_disputes"] == [
+            {"user_id": user.id, "winner": "buyer", "deal_id": deal.identificator, "admin": True}
+        ]
+        assert response.json["deals"]["timeouts"] == [{"deal_id": deal.identificator, "user_id": deal.buyer_id}]
+        assert response.json["deals"]["cancel"] == [{"deal_id": deal.identificator, "user_id": user.id}]
+
+        notified = self._select_telegram_notified([n.id for n in notifications], db_session)
+        assert notified == [True] * len(notifications)
+
+    def test_get_updates_already_notified_valid(
+            self,
+            client: FlaskClient,
+            token: str,
+            deal: DealDTO,
+            notification_factory: Callable[..., NotificationDTO]
+    ):
+        notification_factory(deal.buyer_id, "deal", deal_id=deal.id)
+
+        response = self._get_updates(client, token)
+        assert response.status == self.HttpStatus.OK
+        assert len(response.json["deals"]["deals"]) == 1
+
+        response = self._get_updates(client, token)
+        assert response.status == self.HttpStatus.OK
+        assert response.json["deals"]["deals"] == []
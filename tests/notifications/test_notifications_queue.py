@@ -0,0 +1,52 @@
+import threading
+from unittest.mock import MagicMock, patch
+
+from sqlalchemy import orm
+
+from utils.notifications_queue import _Publisher, send_notification_to_queue
+
+
+class TestNotificationsOutbox:
+    def test_sent_after_commit_in_one_batch(self):
+        session = orm.Session()
+        with patch("utils.notifications_queue._send_queue_notifications") as send:
+            send_notification_to_queue(1, {"id": 1}, session)
+            send_notification_to_queue(2, {"id": 2}, session)
+            send.assert_not_called()
+
+            session.commit()
+
+        send.assert_called_once_with([(1, {"id": 1}), (2, {"id": 2})])
+        assert "on_commit" not in session.info
+
+    def test_dropped_on_rollback(self):
+        session = orm.Session()
+        with patch("utils.notifications_queue._send_queue_notifications") as send:
+            send_notification_to_queue(1, {"id": 1}, session)
+            session.rollback()
+            session.commit()
+
+        send.assert_not_called()
+        assert "on_commit" not in session.info
+
+
+class TestPublisherPool:
+    def test_threads_share_pooled_connections(self):
+        opened = []
+
+        def connect(parameters):
+            connection = MagicMock()
+            opened.append(connection)
+            return connection
+
+        publisher = _Publisher(parameters=None, size=2)
+        with patch("utils.notifications_queue.BlockingConnection", side_effect=connect):
+            threads = [threading.Thread(target=publisher.publish, args=([(i, {"id": i})],)) for i in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert 1 <= len(opened) <= 2
+        published = sum(c.channel.return_value.basic_publish.call_count for c in opened)
+        assert published == 20
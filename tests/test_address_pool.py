@@ -0,0 +1,30 @@
+from unittest.mock import patch
+
+from sqlalchemy.orm import Session
+
+from system import address_pool
+
+
+class TestAddressPool:
+    def test_claim_takes_pooled_key(self, db_session: Session):
+        db_session.execute(
+            "INSERT INTO address_pool (symbol, private_key, address) VALUES ('btc', 'bc1qfirst', 'bc1qfirst'), "
+            "('btc', 'bc1qsecond', 'bc1qsecond'), ('eth', '0xkey', '0xaddress')"
+        )
+
+        with patch("crypto.manager.Manager.get_new_pk") as get_new_pk:
+            assert address_pool.claim("btc", db_session) == ("bc1qfirst", "bc1qfirst")
+
+        get_new_pk.assert_not_called()
+        assert address_pool.get_size("btc", db_session) == 1
+        assert address_pool.get_size("eth", db_session) == 1
+
+    def test_claim_from_empty_pool_generates_key(self, db_session: Session):
+        with patch("crypto.manager.Manager.get_new_pk", return_value="bc1qnew"):
+            assert address_pool.claim("btc", db_session) == ("bc1qnew", "bc1qnew")
+
+    def test_add(self, db_session: Session):
+        with patch("crypto.manager.Manager.get_new_pks", return_value=["bc1qa", "bc1qb", "bc1qa"]):
+            address_pool.add("btc", 3, db_session)
+
+        assert address_pool.get_size("btc", db_session) == 2
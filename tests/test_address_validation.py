@@ -0,0 +1,74 @@
+import pytest
+
+from crypto import address_validation
+from crypto.address_validation import validate_address
+
+
+def _use_network(monkeypatch: pytest.MonkeyPatch, hrp: str, base58_versions: set) -> None:
+    monkeypatch.setattr(address_validation, "BTC_HRP", hrp)
+    monkeypatch.setattr(address_validation, "BTC_BASE58_VERSIONS", base58_versions)
+    # results are cached per address, not per network
+    validate_address.cache_clear()
+
+
+class TestAddressValidation:
+    @pytest.fixture(autouse=True)
+    def mainnet(self, monkeypatch: pytest.MonkeyPatch):
+        # the network is picked from TEST at import, the vectors below are mainnet ones
+        _use_network(monkeypatch, "bc", {0x00, 0x05})
+        yield
+        validate_address.cache_clear()
+
+    @pytest.mark.parametrize("address", [
+        "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa",
+        "3J98t1WpEZ73CNmQviecrnyiWrnqRhWNLy",
+        "bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4",
+        "BC1QW508D6QEJXTDG4Y5R3ZARVARY0C5XW7KV8F3T4",
+        "bc1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3qccfmv3",
+        "bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqzk5jj0",
+    ])
+    def test_btc_valid(self, address: str):
+        assert validate_address("btc", address) is True
+
+    @pytest.mark.parametrize("address", [
+        "1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNb",
+        "mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn",
+        "bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kemeawh",
+        "bc1p0xlxvlhemja6c4dqv22uapctqupfhlxm9h8z3k2e72q4k9hcz7vqh2y7hd",
+        "tb1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3q0sl5k7",
+        "bc1qW508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4",
+        "",
+    ])
+    def test_btc_invalid(self, address: str):
+        assert validate_address("btc", address) is False
+
+    @pytest.mark.parametrize("address, is_valid", [
+        ("mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn", True),
+        ("tb1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3q0sl5k7", True),
+        ("1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa", False),
+        ("bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4", False),
+    ])
+    def test_btc_testnet(self, address: str, is_valid: bool, monkeypatch: pytest.MonkeyPatch):
+        _use_network(monkeypatch, "tb", {0x6f, 0xc4})
+
+        assert validate_address("btc", address) is is_valid
+
+    @pytest.mark.parametrize("address, is_valid", [
+        ("0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed", True),
+        ("0x5aaeb6053f3e94c9b9a09f33669435e7ef1beaed", True),
+        ("0x5aaeb6053F3E94C9b9A09f33669435E7Ef1BeAed", False),
+        ("0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAe", False),
+    ])
+    def test_eth_checksum(self, address: str, is_valid: bool):
+        assert validate_address("eth", address) is is_valid
+
+    @pytest.mark.parametrize("address, is_valid", [
+        ("TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6t", True),
+        ("TR7NHqjeKQxGTCi8q8ZY4pL8otSzgjLj6u", False),
+        ("1A1zP1eP5QGefi2DMPTfTL5SLmv7DivfNa", False),
+    ])
+    def test_tron(self, address: str, is_valid: bool):
+        assert validate_address("usdt", address) is is_valid
+
+    def test_unknown_symbol(self):
+        assert validate_address("xmr", "anything") is None
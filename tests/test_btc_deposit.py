@@ -0,0 +1,57 @@
+from decimal import Decimal
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from jobs.transactions.deposit import btc
+from utils.tables import CryptoSettingsDTO, UserDTO, WalletDTO
+
+
+class FakeBtcNode:
+    def __init__(self, transactions: list):
+        self.transactions = transactions
+        self.cursors = []
+
+    def get_block_hash(self, depth: int = 0) -> str:
+        return f"block-{depth}"
+
+    def list_since_block(self, block_hash: str, target_confirmations: int = 1) -> dict:
+        self.cursors.append(block_hash)
+        return {"transactions": self.transactions, "removed": [], "lastblock": "tip"}
+
+
+class TestBtcDeposit:
+    def _receive(self, txid: str, address: str, amount: str, confirmations: int = 1) -> dict:
+        return {
+            "category": "receive", "txid": txid, "address": address,
+            "amount": Decimal(amount), "confirmations": confirmations
+        }
+
+    def _select_deposits(self, wallet_id: int, db_session: Session) -> list:
+        return db_session.execute(
+            "SELECT tx_hash, amount_units FROM transactions WHERE wallet_id = :wid AND type = 'in' ORDER BY id",
+            {"wid": wallet_id}
+        ).fetchall()
+
+    def test_deposits_credited_once_and_cursor_saved(
+            self,
+            user: UserDTO,
+            wallet_factory: Callable[..., WalletDTO],
+            crypto_settings_btc: CryptoSettingsDTO,
+            db_session: Session
+    ):
+        wallet = wallet_factory(user.id, Decimal(0), symbol="btc", private_key="bc1qdeposit", address="bc1qdeposit")
+        node = FakeBtcNode([
+            self._receive("tx1", "bc1qdeposit", "0.5"),
+            self._receive("tx2", "bc1qdeposit", "0.1", confirmations=0),
+            self._receive("tx3", "bc1qdeposit", "0.00001"),
+            self._receive("tx4", "1foreign", "1"),
+        ])
+
+        btc.deposit(node)
+        btc.deposit(node)
+
+        assert self._select_deposits(wallet.id, db_session) == [("tx1", Decimal("0.5"))]
+        assert node.cursors == [f"block-{btc.BTC_SCAN_BOOTSTRAP_BLOCKS}", "tip"]
+        assert db_session.execute("SELECT balance FROM wallet WHERE id = :id", {"id": wallet.id}).scalar() == \
+            Decimal("0.5") * 10 ** 8
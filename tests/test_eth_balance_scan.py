@@ -0,0 +1,69 @@
+from unittest.mock import MagicMock, patch
+
+from crypto.eth import ETH
+from jobs.transactions.deposit import eth_and_erc20
+
+
+class FakeBatchNode:
+    """
+    Answers eth_getBalance batches from a dict of balances, a batch containing a "down" address fails as a whole
+    """
+
+    def __init__(self, balances: dict):
+        self.balances = balances
+        self.batches = []
+
+    def rpc_batch(self, method: str, params_list: list, strict: bool = False) -> list:
+        assert method == "eth_getBalance"
+        addresses = [address for address, _ in params_list]
+        self.batches.append(addresses)
+        if "down" in addresses:
+            raise ConnectionError("node is unavailable")
+        return [hex(self.balances[address]) if address in self.balances else None for address in addresses]
+
+
+class TestGetBalances:
+    def test_one_batch_request(self):
+        node = FakeBatchNode({"0xa": 10, "0xc": 0})
+        with patch.object(ETH, "_rpc_batch", node.rpc_batch):
+            balances = ETH.get_balances(["0xa", "0xb", "0xc"])
+
+        assert node.batches == [["0xa", "0xb", "0xc"]]
+        # the node errored for 0xb, it is left out rather than read as a zero balance
+        assert balances == {"0xa": 10, "0xc": 0}
+
+    def test_nothing_requested_for_no_addresses(self):
+        with patch.object(ETH, "_rpc_batch", return_value=[]) as rpc_batch:
+            assert ETH.get_balances([]) == {}
+        rpc_batch.assert_called_once_with("eth_getBalance", [])
+
+
+class TestScanBalances:
+    def _scan(self, node: FakeBatchNode, addresses: list, bucket=None) -> dict:
+        with patch.object(ETH, "_rpc_batch", node.rpc_batch), \
+                patch.object(eth_and_erc20, "BALANCE_BATCH_SIZE", 2), \
+                patch.object(eth_and_erc20, "rpc_bucket", bucket or MagicMock()):
+            return eth_and_erc20._scan_balances(addresses)
+
+    def test_batched(self):
+        node = FakeBatchNode({f"0x{i}": i for i in range(5)})
+
+        balances = self._scan(node, [f"0x{i}" for i in range(5)])
+
+        assert balances == {f"0x{i}": i for i in range(5)}
+        assert sorted(node.batches) == [["0x0", "0x1"], ["0x2", "0x3"], ["0x4"]]
+
+    def test_errored_batch_skipped(self):
+        node = FakeBatchNode({"0x0": 1, "0x1": 2, "0x3": 4})
+
+        balances = self._scan(node, ["0x0", "0x1", "down", "0x3"])
+
+        assert balances == {"0x0": 1, "0x1": 2}
+        assert len(node.batches) == 2
+
+    def test_one_token_per_batch(self):
+        bucket = MagicMock()
+
+        self._scan(FakeBatchNode({}), [f"0x{i}" for i in range(5)], bucket)
+
+        assert bucket.acquire.call_count == 3
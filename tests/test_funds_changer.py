@@ -0,0 +1,112 @@
+from decimal import Decimal
+from typing import Callable
+
+import pytest
+from sqlalchemy.orm import Session
+
+from system.funds_changer import WalletNotFoundError, change_funds_many, change_balance
+from utils.tables import UserDTO, WalletDTO
+
+
+class TestChangeFundsMany:
+    def _select_wallet(self, wallet_id: int, db_session: Session):
+        return db_session.execute("SELECT balance, frozen FROM wallet WHERE id = :id", {"id": wallet_id}).fetchone()
+
+    def _select_ledger(self, user_id: int, db_session: Session) -> list:
+        return db_session.execute(
+            """
+                SELECT balance, frozen, change_balance, change_frozen
+                FROM insidetransaction
+                WHERE user_id = :uid
+                ORDER BY id
+            """, {"uid": user_id}
+        ).fetchall()
+
+    def test_legs_applied_in_one_statement(
+            self,
+            user_factory: Callable[..., UserDTO],
+            wallet_factory: Callable[..., WalletDTO],
+            db_session: Session
+    ):
+        seller, buyer = user_factory(), user_factory()
+        seller_wallet = wallet_factory(seller.id, Decimal(0), symbol="eth", frozen=Decimal(10 ** 18))
+        buyer_wallet = wallet_factory(buyer.id, Decimal(0), symbol="eth")
+
+        change_funds_many([
+            {"user_id": seller.id, "symbol": "eth", "msg": "Closing deal", "frozen_subunits": -10 ** 18},
+            {"user_id": buyer.id, "symbol": "eth", "msg": "Closing deal", "balance_subunits": 10 ** 18 // 2},
+            {"user_id": buyer.id, "symbol": "eth", "msg": "Closing deal", "balance_subunits": 10 ** 18 // 4},
+        ], session=db_session)
+
+        assert self._select_wallet(seller_wallet.id, db_session) == (0, 0)
+        assert self._select_wallet(buyer_wallet.id, db_session) == (Decimal(10 ** 18 * 3 // 4), 0)
+        assert self._select_ledger(seller.id, db_session) == [(0, 0, 0, -1)]
+        assert self._select_ledger(buyer.id, db_session) == [
+            (Decimal("0.5"), 0, Decimal("0.5"), 0),
+            (Decimal("0.75"), 0, Decimal("0.25"), 0),
+        ]
+
+    def test_negative_intermediate_balance_rejected(
+            self,
+            user: UserDTO,
+            wallet_factory: Callable[..., WalletDTO],
+            db_session: Session
+    ):
+        wallet = wallet_factory(user.id, Decimal(100), symbol="eth")
+
+        with pytest.raises(ValueError):
+            change_funds_many([
+                {"user_id": user.id, "symbol": "eth", "msg": "withdraw", "balance_subunits": -200},
+                {"user_id": user.id, "symbol": "eth", "msg": "deposit", "balance_subunits": 200},
+            ], session=db_session)
+
+        assert self._select_wallet(wallet.id, db_session) == (100, 0)
+        assert self._select_ledger(user.id, db_session) == []
+
+    @pytest.mark.parametrize("amount", [0, None])
+    def test_empty_leg_rejected(
+            self,
+            user: UserDTO,
+            wallet_factory: Callable[..., WalletDTO],
+            db_session: Session,
+            amount
+    ):
+        wallet = wallet_factory(user.id, Decimal(100), symbol="eth")
+
+        with pytest.raises(ValueError, match="amount must be passed correctly"):
+            change_funds_many([
+                {"user_id": user.id, "symbol": "eth", "msg": "deposit", "balance_subunits": 100},
+                {"user_id": user.id, "symbol": "eth", "msg": "Closing deal", "balance_subunits": amount},
+            ], session=db_session)
+
+        assert self._select_wallet(wallet.id, db_session) == (100, 0)
+        assert self._select_ledger(user.id, db_session) == []
+
+    def test_missing_wallet_rejected(
+            self,
+            user_factory: Callable[..., UserDTO],
+            wallet_factory: Callable[..., WalletDTO],
+            db_session: Session
+    ):
+        seller, buyer = user_factory(), user_factory()
+        wallet_factory(seller.id, Decimal(0), symbol="eth", frozen=Decimal(100))
+
+        with pytest.raises(WalletNotFoundError):
+            change_funds_many([
+                {"user_id": seller.id, "symbol": "eth", "msg": "Closing deal", "frozen_subunits": -100},
+                {"user_id": buyer.id, "symbol": "eth", "msg": "Closing deal", "balance_subunits": 100},
+            ], session=db_session)
+
+    def test_change_balance_guarded(
+            self,
+            user: UserDTO,
+            wallet_factory: Callable[..., WalletDTO],
+            db_session: Session
+    ):
+        wallet = wallet_factory(user.id, Decimal(100), symbol="eth")
+
+        with pytest.raises(ValueError):
+            change_balance(user.id, "withdraw", symbol="eth", amount_subunits=-101, session=db_session)
+        change_balance(user.id, "withdraw", symbol="eth", amount_subunits=-100, session=db_session)
+
+        assert self._select_wallet(wallet.id, db_session) == (0, 0)
@@ -0,0 +1,39 @@
+from unittest.mock import patch
+
+from crypto.gas_oracle import GasPriceOracle
+
+
+def _failing():
+    raise ConnectionError("etherscan is down")
+
+
+class TestGasPriceOracle:
+    def _oracle(self, *sources) -> GasPriceOracle:
+        oracle = GasPriceOracle(list(sources), refresh_interval=3600, max_age=60)
+        # tests refresh by hand
+        oracle._ensure_started = lambda: None
+        return oracle
+
+    def test_default_before_first_refresh(self):
+        assert self._oracle(("etherscan", lambda: 50)).get(30) == {"gas_price": 30, "source": "default", "age": None}
+
+    def test_first_answering_source_used(self):
+        oracle = self._oracle(("etherscan", _failing), ("node", lambda: 41))
+
+        assert oracle.refresh()
+        value = oracle.get(30)
+        assert (value["gas_price"], value["source"]) == (41, "node")
+
+    def test_stale_value_not_used(self):
+        oracle = self._oracle(("etherscan", lambda: 50))
+        oracle.refresh()
+
+        with patch("crypto.gas_oracle.time.monotonic", return_value=oracle._updated_at + 61):
+            assert oracle.get(30)["source"] == "default"
+
+    def test_clamped(self):
+        oracle = self._oracle(("etherscan", lambda: 500))
+        oracle.refresh()
+
+        assert oracle.get(30)["gas_price"] == 200
+        assert self._oracle().get(5)["gas_price"] == 20
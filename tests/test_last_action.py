@@ -0,0 +1,44 @@
+from sqlalchemy.orm import Session
+
+from utils.last_action import LastActionTracker
+from utils.tables import UserDTO
+
+
+class TestLastActionTracker:
+    def _set_day_ago(self, user: UserDTO, db_session: Session) -> None:
+        db_session.execute(
+            """UPDATE "user" SET last_action = NOW() - INTERVAL '1 day' WHERE id = :id""", {"id": user.id}
+        )
+
+    def _is_recent(self, user: UserDTO, db_session: Session) -> bool:
+        return db_session.execute(
+            """SELECT last_action > NOW() - INTERVAL '1 hour' FROM "user" WHERE id = :id""", {"id": user.id}
+        ).scalar()
+
+    def test_touches_written_on_flush(self, user: UserDTO, db_session: Session):
+        self._set_day_ago(user, db_session)
+        tracker = LastActionTracker()
+
+        tracker.touch(user_id=user.id)
+        tracker.touch(user_id=user.id)
+        assert not self._is_recent(user, db_session)
+
+        tracker.flush()
+        assert self._is_recent(user, db_session)
+
+    def test_by_telegram_id(self, user: UserDTO, db_session: Session):
+        self._set_day_ago(user, db_session)
+        tracker = LastActionTracker()
+
+        tracker.touch(telegram_id=user.telegram_id)
+        tracker.flush()
+
+        assert self._is_recent(user, db_session)
+
+    def test_full_buffer_flushed(self, user: UserDTO, db_session: Session):
+        self._set_day_ago(user, db_session)
+        tracker = LastActionTracker(max_pending=1)
+
+        tracker.touch(user_id=user.id)
+
+        assert self._is_recent(user, db_session)
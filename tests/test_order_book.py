@@ -0,0 +1,98 @@
+from decimal import Decimal
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from utils.db_sessions import _run_callbacks
+from utils.order_book import OrderBook
+from utils.tables import BrokerDTO, CurrencyDTO, LotDTO, UserDTO, WalletDTO
+
+
+class TestOrderBook:
+    def _commit(self, db_session: Session) -> None:
+        # session_scope is a savepoint in tests, the root transaction never commits, callbacks are run by hand
+        _run_callbacks(db_session.info.pop("on_commit", []))
+
+    def _lots(self, book: OrderBook, currency: CurrencyDTO, broker: BrokerDTO, db_session: Session) -> list:
+        return book.get_lots("usdt", currency.id, "sell", broker.id, db_session)
+
+    def _setup(
+            self, user: UserDTO, currency: CurrencyDTO, broker: BrokerDTO,
+            lot_factory: Callable[..., LotDTO], wallet_factory: Callable[..., WalletDTO]
+    ) -> LotDTO:
+        wallet_factory(user.id, Decimal(10 ** 8), symbol="usdt")
+        return lot_factory(100, 1000, Decimal("90"), user.id, "usdt", currency.id, type_="sell", broker_id=broker.id)
+
+    def test_changed_users_applied_incrementally(
+            self, user: UserDTO, currency: CurrencyDTO, broker: BrokerDTO,
+            lot_factory: Callable[..., LotDTO], wallet_factory: Callable[..., WalletDTO], db_session: Session
+    ):
+        lot = self._setup(user, currency, broker, lot_factory, wallet_factory)
+        book = OrderBook(max_staleness=60)
+        assert [item["id"] for item in self._lots(book, currency, broker, db_session)] == [lot.id]
+
+        db_session.execute("UPDATE lot SET rate = 95 WHERE id = :id", {"id": lot.id})
+        # not announced, the snapshot is still fresh
+        assert self._lots(book, currency, broker, db_session)[0]["rate"] == Decimal("90")
+
+        book.users_changed(db_session, user.id)
+        self._commit(db_session)
+        assert self._lots(book, currency, broker, db_session)[0]["rate"] == Decimal("95")
+
+        db_session.execute("UPDATE lot SET is_active = FALSE WHERE id = :id", {"id": lot.id})
+        book.users_changed(db_session, user.id)
+        self._commit(db_session)
+        assert self._lots(book, currency, broker, db_session) == []
+
+    def test_deleted_lot_dropped(
+            self, user: UserDTO, currency: CurrencyDTO, broker: BrokerDTO,
+            lot_factory: Callable[..., LotDTO], wallet_factory: Callable[..., WalletDTO], db_session: Session
+    ):
+        lot = self._setup(user, currency, broker, lot_factory, wallet_factory)
+        book = OrderBook(max_staleness=60)
+        assert len(self._lots(book, currency, broker, db_session)) == 1
+
+        db_session.execute("DELETE FROM lot WHERE id = :id", {"id": lot.id})
+        book.users_changed(db_session, user.id)
+        self._commit(db_session)
+
+        assert self._lots(book, currency, broker, db_session) == []
+
+    def test_stale_slice_rebuilt(
+            self, user: UserDTO, currency: CurrencyDTO, broker: BrokerDTO,
+            lot_factory: Callable[..., LotDTO], wallet_factory: Callable[..., WalletDTO], db_session: Session
+    ):
+        lot = self._setup(user, currency, broker, lot_factory, wallet_factory)
+        book = OrderBook(max_staleness=0)
+        assert self._lots(book, currency, broker, db_session)[0]["rate"] == Decimal("90")
+
+        # a change made by another process is picked up once the slice is stale
+        db_session.execute("UPDATE lot SET rate = 95 WHERE id = :id", {"id": lot.id})
+
+        assert self._lots(book, currency, broker, db_session)[0]["rate"] == Decimal("95")
+
+    def test_invalidate(
+            self, user: UserDTO, currency: CurrencyDTO, broker: BrokerDTO,
+            lot_factory: Callable[..., LotDTO], wallet_factory: Callable[..., WalletDTO], db_session: Session
+    ):
+        lot = self._setup(user, currency, broker, lot_factory, wallet_factory)
+        book = OrderBook(max_staleness=60)
+        self._lots(book, currency, broker, db_session)
+
+        db_session.execute("UPDATE lot SET rate = 95 WHERE id = :id", {"id": lot.id})
+        book.invalidate(db_session)
+        self._commit(db_session)
+
+        assert self._lots(book, currency, broker, db_session)[0]["rate"] == Decimal("95")
+
+    def test_bypass(
+            self, user: UserDTO, currency: CurrencyDTO, broker: BrokerDTO,
+            lot_factory: Callable[..., LotDTO], wallet_factory: Callable[..., WalletDTO], db_session: Session
+    ):
+        lot = self._setup(user, currency, broker, lot_factory, wallet_factory)
+        book = OrderBook(max_staleness=60, bypass=lambda: True)
+        self._lots(book, currency, broker, db_session)
+
+        db_session.execute("UPDATE lot SET rate = 95 WHERE id = :id", {"id": lot.id})
+
+        assert self._lots(book, currency, broker, db_session)[0]["rate"] == Decimal("95")
@@ -0,0 +1,69 @@
+from decimal import Decimal
+from unittest.mock import Mock, patch
+
+import pytest
+from sqlalchemy.orm import Session
+
+from utils import outbox
+
+
+class TestOutbox:
+    @pytest.fixture()
+    def effect(self) -> Mock:
+        effect = Mock()
+        outbox.handler("test_effect")(effect)
+        outbox.handler("test_payout", retry=False)(effect)
+        yield effect
+        outbox._handlers.pop("test_effect")
+        outbox._handlers.pop("test_payout")
+
+    def _select_outbox(self, key: str, db_session: Session):
+        return db_session.execute(
+            "SELECT status, attempts, last_error FROM outbox WHERE idempotency_key = :key", {"key": key}
+        ).fetchall()
+
+    def test_enqueue_ignores_known_key(self, effect: Mock, db_session: Session):
+        outbox.enqueue(db_session, "test_effect", "deal:1:test", amount=Decimal("1.5"))
+        outbox.enqueue(db_session, "test_effect", "deal:1:test", amount=Decimal("2.5"))
+
+        assert len(self._select_outbox("deal:1:test", db_session)) == 1
+        effect.assert_not_called()
+
+    def test_enqueue_unknown_kind(self, db_session: Session):
+        with pytest.raises(ValueError):
+            outbox.enqueue(db_session, "no_such_effect", "deal:1:test")
+
+    def test_dispatch_runs_effect(self, effect: Mock, db_session: Session):
+        outbox.enqueue(db_session, "test_effect", "deal:1:test", amount=Decimal("1.123456789"), data={"status": 0})
+
+        assert outbox.dispatch() == 1
+
+        effect.assert_called_once_with(amount=Decimal("1.123456789"), data={"status": 0})
+        assert self._select_outbox("deal:1:test", db_session) == [("done", 1, None)]
+
+    def test_dispatch_keeps_failed_effect_for_retry(self, effect: Mock, db_session: Session):
+        effect.side_effect = RuntimeError("public api is down")
+        outbox.enqueue(db_session, "test_effect", "deal:1:test")
+
+        outbox.dispatch()
+        # the retry is scheduled with a backoff
+        assert outbox.dispatch() == 0
+
+        status, attempts, last_error = self._select_outbox("deal:1:test", db_session)[0]
+        assert (status, attempts) == ("pending", 1)
+        assert "public api is down" in last_error
+
+        with patch("utils.outbox.OUTBOX_MAX_ATTEMPTS", 2):
+            db_session.execute("UPDATE outbox SET next_attempt_at = NOW() WHERE idempotency_key = 'deal:1:test'")
+            outbox.dispatch()
+
+        assert self._select_outbox("deal:1:test", db_session)[0][:2] == ("failed", 2)
+
+    def test_dispatch_does_not_repeat_interrupted_payout(self, effect: Mock, db_session: Session):
+        outbox.enqueue(db_session, "test_payout", "deal:1:payout")
+        db_session.execute("UPDATE outbox SET attempts = 1 WHERE idempotency_key = 'deal:1:payout'")
+
+        outbox.dispatch()
+
+        effect.assert_not_called()
+        assert self._select_outbox("deal:1:payout", db_session)[0][:2] == ("failed", 2)
@@ -0,0 +1,55 @@
+from unittest import mock
+
+import pytest
+import requests
+
+from utils.public_api import PublicAPIClient, admin_token
+
+
+def _response(status_code):
+    res = requests.Response()
+    res.status_code = status_code
+    res._content = b"{}"
+    return res
+
+
+class TestPublicAPIClient:
+    def _client(self) -> PublicAPIClient:
+        return PublicAPIClient("http://papi.test", pool_size=2, timeout=(1, 1), retries=0)
+
+    def test_admin_token_signed_once(self):
+        admin_token.cache_clear()
+        with mock.patch("utils.public_api.jwt.encode", return_value=b"token") as encode:
+            assert admin_token(1, "salt") == "token"
+            assert admin_token(1, "salt") == "token"
+        assert encode.call_count == 1
+
+    def test_metrics_per_endpoint(self, monkeypatch):
+        monkeypatch.setenv("PUBLIC_APP_KEY", "salt")
+        client = self._client()
+        responses = [_response(200), _response(200), _response(500)]
+        with mock.patch.object(client.session, "request", side_effect=responses) as request:
+            client.get("/sells/{id}", 1, path_params={"id": 1})
+            client.get("/sells/{id}", 1, path_params={"id": 2})
+            with pytest.raises(requests.HTTPError):
+                client.get("/sells/{id}", 1, path_params={"id": 3})
+
+        assert request.call_args[0] == ("GET", "http://papi.test/sells/3")
+        assert request.call_args[1]["timeout"] == (1, 1)
+        metrics = client.metrics()["GET /sells/{id}"]
+        assert metrics["count"] == 3
+        assert metrics["errors"] == 1
+
+    def test_post_many_returns_errors_in_place(self, monkeypatch):
+        monkeypatch.setenv("PUBLIC_APP_KEY", "salt")
+        client = self._client()
+
+        def request(method, url, **kwargs):
+            return _response(500 if kwargs["params"]["currency"] == "usd" else 200)
+
+        calls = [({"symbol": "btc"}, {"currency": currency}, {"rate": 1}) for currency in ("rub", "usd", "eur")]
+        with mock.patch.object(client.session, "request", side_effect=request):
+            results = client.post_many("/update-actual-rates/{symbol}", calls)
+
+        assert [isinstance(res, requests.HTTPError) for res in results] == [False, True, False]
+        assert client.metrics()["POST /update-actual-rates/{symbol}"]["count"] == 3
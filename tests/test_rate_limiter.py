@@ -0,0 +1,47 @@
+from unittest.mock import patch
+
+from utils.rate_limiter import TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket:
+    def _acquire(self, bucket_args: dict, times: int) -> FakeClock:
+        clock = FakeClock()
+        with patch("utils.rate_limiter.time", clock):
+            bucket = TokenBucket(**bucket_args)
+            for _ in range(times):
+                bucket.acquire()
+        return clock
+
+    def test_burst_up_to_capacity(self):
+        assert self._acquire({"rate": 1, "capacity": 3}, 3).sleeps == []
+
+    def test_paced_after_burst(self):
+        clock = self._acquire({"rate": 2}, 6)
+
+        assert clock.sleeps == [0.5, 0.5, 0.5, 0.5]
+        assert clock.now == 2
+
+    def test_idle_time_refills(self):
+        clock = FakeClock()
+        with patch("utils.rate_limiter.time", clock):
+            bucket = TokenBucket(rate=1, capacity=2)
+            bucket.acquire(2)
+            clock.now += 10
+            bucket.acquire(2)
+
+        # refilled up to the capacity only, idle time does not accumulate
+        assert clock.sleeps == []
+        assert bucket._tokens == 0
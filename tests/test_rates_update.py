@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Callable
+from unittest.mock import patch
+
+from sqlalchemy.orm import Session
+
+from jobs.rates import update
+from utils.tables import CurrencyDTO
+
+
+class TestUpdateRates:
+    def _tickers(self, symbols: list) -> dict:
+        source_time = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        return {symbol: (Decimal(i + 1), source_time) for i, symbol in enumerate(symbols)}
+
+    def test_rates_from_one_ticker_request(
+            self,
+            currency_factory: Callable[..., CurrencyDTO],
+            db_session: Session
+    ):
+        # the binance currencies are written as well, rates reference the currency table
+        for currency_id in update.CURRENCIES:
+            currency_factory(currency_id.lower(), True, Decimal("1"), Decimal("0.25"))
+        currency_factory("kzt", True, Decimal("500"), Decimal("0.15"))
+
+        with patch("utils.binance_client.BinanceClient.get_tickers", side_effect=self._tickers) as get_tickers:
+            update.update_rates()
+
+        get_tickers.assert_called_once()
+        rates = {
+            (symbol, currency): (rate, source_time)
+            for symbol, currency, rate, source_time in db_session.execute(
+                "SELECT symbol, currency, rate, source_time FROM rates"
+            ).fetchall()
+        }
+        usd_rate, usd_time = rates[("btc", "usd")]
+        assert rates[("btc", "kzt")] == (usd_rate * 500, usd_time)
+        assert rates[("usdt", "usd")][0] == 1
+        assert len(rates) == 12
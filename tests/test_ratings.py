@@ -0,0 +1,114 @@
+from decimal import Decimal
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from jobs.ratings.update import update_ratings
+from jobs.ratings.update_deals_cnt import update_deals_cnt
+from jobs.ratings.update_likes import update_likes
+from utils.tables import CurrencyDTO, DealDTO, LotDTO, UserDTO
+
+
+def _select_user(user: UserDTO, db_session: Session):
+    return db_session.execute(
+        """
+            SELECT deals_cnt, deals_revenue, total_likes, total_dislikes, rating
+            FROM "user"
+            WHERE id = :id
+        """, {"id": user.id}
+    ).fetchone()
+
+
+class TestUpdateDealsCnt:
+    def _legacy_count(self, user: UserDTO, db_session: Session):
+        # what the former per-user query produced
+        return tuple(db_session.execute(
+            """
+                SELECT COUNT(*), COALESCE(SUM(amount_currency), 0)
+                FROM deal
+                WHERE (buyer_id = :uid OR seller_id = :uid) AND state = 'closed'
+            """, {"uid": user.id}
+        ).fetchone())
+
+    def test_counts_match_per_user_query(
+            self,
+            user: UserDTO,
+            lot: LotDTO,
+            currency: CurrencyDTO,
+            user_factory: Callable[..., UserDTO],
+            deal_factory: Callable[..., DealDTO],
+            db_session: Session
+    ):
+        buyer, idle = user_factory(), user_factory()
+
+        def create_deal(amount: str, buyer_id: int, seller_id: int, state: str) -> DealDTO:
+            return deal_factory(
+                Decimal(amount), Decimal("1000"), Decimal("1000"), buyer_id, seller_id, lot.id,
+                Decimal("24"), "123123123", "usdt", currency.id, 0, state=state
+            )
+
+        create_deal("100", buyer.id, user.id, "closed")
+        # a deal with oneself is counted once
+        create_deal("50", user.id, user.id, "closed")
+        create_deal("1000", buyer.id, user.id, "paid")
+
+        update_deals_cnt()
+
+        assert _select_user(user, db_session)[:2] == (2, Decimal("150")) == self._legacy_count(user, db_session)
+        assert _select_user(buyer, db_session)[:2] == (1, Decimal("100")) == self._legacy_count(buyer, db_session)
+        assert _select_user(idle, db_session)[:2] == (0, 0) == self._legacy_count(idle, db_session)
+
+
+class TestUpdateLikes:
+    def _rate(self, from_user: UserDTO, to_user: UserDTO, action: str, db_session: Session, hours_ago: int = 0):
+        db_session.execute(
+            """
+                INSERT INTO userrate (from_user_id, to_user_id, action, created_at)
+                VALUES (:fid, :tid, CAST(:action AS user_rate), NOW() - :hours * INTERVAL '1 hour')
+            """, {"fid": from_user.id, "tid": to_user.id, "action": action, "hours": hours_ago}
+        )
+
+    def test_totals_are_stored_likes_plus_all_rates(
+            self,
+            user_factory: Callable[..., UserDTO],
+            db_session: Session
+    ):
+        rated, rater, old_rater, untouched = user_factory(), user_factory(), user_factory(), user_factory()
+        db_session.execute(
+            'UPDATE "user" SET likes = 3, dislikes = 1, total_likes = 100 WHERE id IN :ids',
+            {"ids": (rated.id, rater.id, untouched.id)}
+        )
+        self._rate(rater, rated, "like", db_session)
+        self._rate(rater, rated, "dislike", db_session)
+        # outside the last hour, it does not select the user but still counts in the totals
+        self._rate(old_rater, rated, "like", db_session, hours_ago=2)
+
+        update_likes()
+
+        assert _select_user(rated, db_session)[2:4] == (5, 2)
+        # only rated others, its totals are its stored likes
+        assert _select_user(rater, db_session)[2:4] == (3, 1)
+        assert _select_user(untouched, db_session)[2:4] == (100, 0)
+
+
+class TestUpdateRatings:
+    def test_rating_from_totals(
+            self,
+            user_factory: Callable[..., UserDTO],
+            db_session: Session
+    ):
+        rated, without_revenue = user_factory(), user_factory()
+        db_session.execute(
+            'UPDATE "user" SET deals_cnt = 2, deals_revenue = 100, total_likes = 3, rating = 1 WHERE id = :id',
+            {"id": rated.id}
+        )
+        db_session.execute(
+            'UPDATE "user" SET deals_cnt = 2, deals_revenue = NULL, total_likes = 3, rating = 1 WHERE id = :id',
+            {"id": without_revenue.id}
+        )
+
+        update_ratings()
+
+        # round(log((3 + 2 * 0.4) * 100 * 0.5, 1.7))
+        assert _select_user(rated, db_session)[4] == 10
+        assert _select_user(without_revenue, db_session)[4] == 0
@@ -0,0 +1,130 @@
+from unittest.mock import patch
+
+from flask import Flask, Response
+from sqlalchemy.orm import Session
+
+from data_handler import dh
+from system.cache import AddressIndex, IdentityCache, ReferenceCache
+from utils.db_sessions import _run_callbacks, session_scope
+from utils.tables import CryptoSettingsDTO
+
+
+class TestReferenceCache:
+    def _cache(self, bypass=None) -> ReferenceCache:
+        return ReferenceCache(ttls={"settings": 60, "rates": 10}, bypass=bypass)
+
+    def test_get_or_load_hits_valid(self):
+        cache = self._cache()
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return {"currencies": ["rub"]}
+
+        assert cache.get_or_load("settings", "usdt", loader) == {"currencies": ["rub"]}
+        cached = cache.get_or_load("settings", "usdt", loader)
+        cached["currencies"].append("usd")
+
+        assert cache.get_or_load("settings", "usdt", loader) == {"currencies": ["rub"]}
+        assert len(calls) == 1
+        assert cache.stats()["settings"] == {"hits": 2, "misses": 1, "size": 1}
+        assert cache.stats()["rates"] == {"hits": 0, "misses": 0, "size": 0}
+
+    def test_invalidate_valid(self):
+        cache = self._cache()
+        cache.get_or_load("settings", "usdt", lambda: 1)
+        cache.get_or_load("settings", "btc", lambda: 1)
+
+        cache.invalidate("settings", "usdt")
+        assert cache.get_or_load("settings", "usdt", lambda: 2) == 2
+        assert cache.get_or_load("settings", "btc", lambda: 2) == 1
+
+        cache.invalidate()
+        assert cache.get_or_load("settings", "btc", lambda: 3) == 3
+
+    def test_bypass_valid(self):
+        cache = self._cache(bypass=lambda: True)
+        cache.get_or_load("rates", ("usdt", "rub"), lambda: 1)
+        assert cache.get_or_load("rates", ("usdt", "rub"), lambda: 2) == 2
+        assert cache.stats()["rates"] == {"hits": 0, "misses": 0, "size": 0}
+
+
+class TestWithdrawStatusCache:
+    def _withdraw_active(self, db_session: Session) -> bool:
+        return dh.get_crypto_settings(db_session, "btc")["withdraw_active"]
+
+    def test_invalidated_after_request_commit(
+            self, app: Flask, crypto_settings_btc: CryptoSettingsDTO, db_session: Session
+    ):
+        cache = ReferenceCache(ttls={"crypto_settings": 60})
+        with patch("data_handler.cache", cache), app.test_request_context("/"):
+            app.preprocess_request()
+            assert self._withdraw_active(db_session) is True
+            with session_scope():
+                # the toggle opens a nested scope, its release is not the request commit
+                assert dh.change_withdraw_status("btc") == {"status": False}
+                assert self._withdraw_active(db_session) is True
+            app.process_response(Response("ok"))
+
+            # the request is a savepoint of the fixture transaction, its commit is simulated
+            _run_callbacks(db_session.info.pop("on_commit", []))
+            assert self._withdraw_active(db_session) is False
+
+
+class TestAddressIndex:
+    def test_resolve_loads_only_unknown_addresses(self):
+        index = AddressIndex(ttl=60)
+        calls = []
+
+        def loader(addresses):
+            calls.append(sorted(addresses))
+            return {address: (1, 10) for address in addresses if address.startswith("bc1")}
+
+        assert index.resolve(["bc1a", "1foreign"], loader) == {"bc1a": (1, 10)}
+        assert index.resolve(["bc1a", "bc1b", "1foreign"], loader) == {"bc1a": (1, 10), "bc1b": (1, 10)}
+        # foreign addresses are not cached, a wallet created later is found
+        assert calls == [["1foreign", "bc1a"], ["1foreign", "bc1b"]]
+
+    def test_invalidate_valid(self):
+        index = AddressIndex(ttl=60)
+        index.resolve(["bc1a"], lambda addresses: {"bc1a": (1, 10)})
+
+        index.invalidate("bc1a")
+        assert index.resolve(["bc1a"], lambda addresses: {"bc1a": (2, 20)}) == {"bc1a": (2, 20)}
+
+
+class TestIdentityCache:
+    def test_get_or_load_caches_found_and_unknown(self):
+        cache = IdentityCache(ttl=60, negative_ttl=10)
+        calls = []
+
+        def loader(value):
+            def load():
+                calls.append(value)
+                return value
+            return load
+
+        assert cache.get_or_load(100, loader(1)) == 1
+        assert cache.get_or_load(100, loader(2)) == 1
+        assert cache.get_or_load(200, loader(None)) is None
+        assert cache.get_or_load(200, loader(3)) is None
+        assert calls == [1, None]
+        assert cache.stats() == {"hits": 1, "negative_hits": 1, "misses": 2, "size": 1, "negative_size": 1}
+
+    def test_invalidate_valid(self):
+        cache = IdentityCache(ttl=60, negative_ttl=10)
+        cache.get_or_load(100, lambda: None)
+        cache.get_or_load(200, lambda: 2)
+
+        cache.invalidate(100)
+        assert cache.get_or_load(100, lambda: 1) == 1
+
+        cache.invalidate_value(2)
+        assert cache.get_or_load(200, lambda: 3) == 3
+
+    def test_bounded(self):
+        cache = IdentityCache(ttl=60, negative_ttl=10, maxsize=2)
+        for key in range(5):
+            cache.get_or_load(key, lambda: key)
+
+        assert cache.stats()["size"] == 2
@@ -0,0 +1,43 @@
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from werkzeug.exceptions import BadRequest
+
+from data_handler import dh
+from utils.report_export import to_csv, to_ndjson
+from utils.tables import UserDTO
+
+
+class TestReportExport:
+    def test_ndjson_chunks(self):
+        rows = ({"id": i, "amount": Decimal("1.5")} for i in range(5))
+
+        chunks = list(to_ndjson(rows, chunk_rows=2))
+
+        assert len(chunks) == 3
+        assert "".join(chunks).splitlines()[0] == '{"amount": "1.5", "id": 0}'
+
+    def test_csv_header_once(self):
+        rows = ({"id": i, "created": datetime(2024, 1, 1)} for i in range(3))
+
+        chunks = list(to_csv(rows, chunk_rows=2))
+
+        assert len(chunks) == 2
+        assert "".join(chunks).splitlines() == [
+            "id,created", "0,2024-01-01 00:00:00", "1,2024-01-01 00:00:00", "2,2024-01-01 00:00:00"
+        ]
+
+    def test_empty_report(self):
+        assert list(to_csv(iter([]))) == []
+        assert list(to_ndjson(iter([]))) == []
+
+    def test_stream_report(self, user: UserDTO):
+        rows = dh.stream_report("btc", "users", from_date=0, to_date=int(time.time()) + 60)
+
+        assert user.nickname in [row["nickname"] for row in rows]
+
+    def test_stream_unknown_report(self):
+        with pytest.raises(BadRequest):
+            dh.stream_report("btc", "unknown")
@@ -0,0 +1,125 @@
+from contextlib import contextmanager
+from unittest.mock import patch
+
+from flask import Flask, Response
+from flask.testing import FlaskClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from werkzeug.exceptions import BadRequest
+
+from utils.db_sessions import init_request_session, on_commit, request_checkouts, session_scope
+from utils.notifications_queue import send_notification_to_queue
+from utils.tables import UserDTO
+
+
+@contextmanager
+def _root_session_scope():
+    # a real root transaction, the db_session fixture only ever hands out savepoints
+    session = sessionmaker(bind=create_engine("sqlite://"))()
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+class TestRequestSession:
+    def test_one_checkout_per_request(self, client: FlaskClient, token: str, user: UserDTO):
+        with client:
+            response = client.get("/user", query_string={"telegram_id": user.telegram_id}, headers={"Token": token})
+
+            assert response.status_code == 200
+            assert request_checkouts() <= 1
+
+    def test_unknown_user(self, client: FlaskClient, token: str):
+        with client:
+            response = client.get("/user", query_string={"telegram_id": 1}, headers={"Token": token})
+
+            assert response.status_code == 400
+            assert request_checkouts() <= 1
+
+    def test_handled_exception_undoes_only_nested_scope(self, app: Flask, user: UserDTO, db_session: Session):
+        with app.test_request_context("/"):
+            app.preprocess_request()
+            with session_scope() as session:
+                session.execute('UPDATE "user" SET lang = :lang WHERE id = :id', {"lang": "en", "id": user.id})
+                try:
+                    with session_scope() as nested:
+                        nested.execute('UPDATE "user" SET rating = 5 WHERE id = :id', {"id": user.id})
+                        raise BadRequest("handled")
+                except BadRequest:
+                    pass
+            response = app.process_response(Response("ok"))
+
+        assert response.status_code == 200
+        lang, rating = db_session.execute('SELECT lang, rating FROM "user" WHERE id = :id', {"id": user.id}).fetchone()
+        assert lang == "en"
+        assert rating != 5
+
+
+class TestOnCommit:
+    def test_run_on_root_commit_only(self):
+        ran = []
+        with _root_session_scope() as session:
+            on_commit(session, lambda: ran.append("outer"))
+            with session.begin_nested():
+                on_commit(session, lambda: ran.append("released"))
+            try:
+                with session.begin_nested():
+                    on_commit(session, lambda: ran.append("rolled back"))
+                    raise BadRequest("handled")
+            except BadRequest:
+                pass
+            on_commit(session, lambda: ran.append("after"))
+            assert ran == []
+
+        assert ran == ["outer", "released", "after"]
+
+    def test_dropped_on_root_rollback(self):
+        ran = []
+        try:
+            with _root_session_scope() as session:
+                with session.begin_nested():
+                    on_commit(session, lambda: ran.append("released"))
+                raise BadRequest("failed")
+        except BadRequest:
+            pass
+
+        assert ran == []
+
+    def test_items_batched(self):
+        batches = []
+        with _root_session_scope() as session:
+            on_commit(session, batches.append, 1)
+            with session.begin_nested():
+                on_commit(session, batches.append, 2)
+
+        assert batches == [[1, 2]]
+
+
+class TestRequestSessionNotifications:
+    def test_published_after_request_commit(self):
+        app = Flask(__name__)
+        init_request_session(app)
+        with patch("utils.db_sessions._session_scope", _root_session_scope), \
+                patch("utils.notifications_queue._send_queue_notifications") as send, \
+                app.test_request_context("/"):
+            app.preprocess_request()
+            with session_scope() as session:
+                send_notification_to_queue(1, {"id": 1}, session)
+                with session_scope() as nested:
+                    send_notification_to_queue(2, {"id": 2}, nested)
+                try:
+                    with session_scope() as nested:
+                        send_notification_to_queue(3, {"id": 3}, nested)
+                        raise BadRequest("handled")
+                except BadRequest:
+                    pass
+            send.assert_not_called()
+
+            app.process_response(Response("ok"))
+
+        send.assert_called_once_with([(1, {"id": 1}), (2, {"id": 2})])
@@ -0,0 +1,91 @@
+from flask import Flask
+from sqlalchemy import create_engine
+
+from utils import sql_metrics as sql_metrics_module
+from utils.sql_metrics import (
+    SqlMetrics, fingerprint, init_sql_metrics, install, sql_metrics, tracked_stream, uninstall, unit
+)
+
+
+class TestSqlMetrics:
+    def test_fingerprint_strips_literals(self):
+        assert fingerprint("SELECT id\n  FROM lot WHERE rate > 10.5 AND symbol = 'btc'") == (
+            "SELECT id FROM lot WHERE rate > ? AND symbol = ?"
+        )
+
+    def test_statements_attributed_to_unit(self):
+        engine = create_engine("sqlite://")
+        sql_metrics.reset()
+        install(engine)
+        try:
+            with unit("ETH Deposit"):
+                engine.execute("SELECT 1")
+                engine.execute("SELECT 2")
+        finally:
+            uninstall(engine)
+
+        rendered = sql_metrics.render()
+        assert 'sql_queries_per_unit_bucket{endpoint="ETH Deposit",le="2"} 1' in rendered
+        assert 'sql_queries_per_unit_count{endpoint="ETH Deposit"} 1' in rendered
+        assert 'sql_queries_per_unit_sum{endpoint="ETH Deposit"} 2' in rendered
+        assert 'sql_slowest_statement_seconds{endpoint="ETH Deposit",fingerprint="SELECT ?"}' in rendered
+
+    def test_request_header(self):
+        engine = create_engine("sqlite://")
+        app = Flask(__name__)
+        app.debug = True
+        init_sql_metrics(app, engine)
+
+        @app.route("/lots")
+        def lots():
+            engine.execute("SELECT 1")
+            return "ok"
+
+        try:
+            response = app.test_client().get("/lots")
+        finally:
+            uninstall(engine)
+
+        assert response.headers["X-SQL-Queries"] == "1"
+        assert 'sql_queries_per_unit_count{endpoint="lots"}' in sql_metrics.render()
+
+    def test_render_escapes_labels(self):
+        metrics = SqlMetrics()
+        with unit('a"b') as current:
+            current.add("SELECT 1", 0.1, 1)
+            metrics.record(current)
+
+        assert 'endpoint="a\\"b"' in metrics.render()
+
+    def test_background_statements_aggregated(self):
+        engine = create_engine("sqlite://")
+        sql_metrics.reset()
+        install(engine)
+        try:
+            for _ in range(sql_metrics_module.BACKGROUND_RECORD_STATEMENTS + 1):
+                engine.execute("SELECT 1")
+        finally:
+            uninstall(engine)
+
+        rendered = sql_metrics.render()
+        # one recorded batch, the last statement waits for the next one
+        assert 'sql_queries_per_unit_count{endpoint="background"} 1' in rendered
+        statements = sql_metrics_module.BACKGROUND_RECORD_STATEMENTS
+        assert f'sql_queries_per_unit_sum{{endpoint="background"}} {statements}' in rendered
+
+    def test_tracked_stream(self):
+        engine = create_engine("sqlite://")
+        sql_metrics.reset()
+        install(engine)
+
+        def chunks():
+            for i in range(3):
+                engine.execute("SELECT 1")
+                yield str(i)
+
+        try:
+            assert "".join(tracked_stream("get_all_reports", chunks())) == "012"
+        finally:
+            uninstall(engine)
+
+        assert 'sql_queries_per_unit_sum{endpoint="get_all_reports"} 3' in sql_metrics.render()
@@ -0,0 +1,32 @@
+from decimal import Decimal
+from typing import Callable
+
+from sqlalchemy.orm import Session
+
+from data_handler import dh
+from utils.tables import UserDTO, WalletDTO
+
+
+class TestWalletAddress:
+    def test_missing_address_derived_and_saved(
+            self,
+            user: UserDTO,
+            wallet_factory: Callable[..., WalletDTO],
+            db_session: Session
+    ):
+        wallet = wallet_factory(user.id, Decimal(0), symbol="btc", private_key="bc1qwallet")
+
+        address = dh.get_wallet_address(wallet.id, "btc", wallet.private_key, wallet.address, db_session)
+
+        assert address == "bc1qwallet"
+        assert db_session.execute("SELECT address FROM wallet WHERE id = :id", {"id": wallet.id}).scalar() == address
+
+    def test_stored_address_used(
+            self,
+            user: UserDTO,
+            wallet_factory: Callable[..., WalletDTO],
+            db_session: Session
+    ):
+        wallet = wallet_factory(user.id, Decimal(0), symbol="eth", private_key="not a key", address="0xstored")
+
+        assert dh.get_wallet_address(wallet.id, "eth", wallet.private_key, wallet.address, db_session) == "0xstored"
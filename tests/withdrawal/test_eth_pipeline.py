@@ -0,0 +1,252 @@
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Callable
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+from crypto.eth import RPCBatchError
+from crypto.nonce_manager import NonceManager
+from jobs.transactions.withdraw import eth
+from utils.tables import UserDTO, WalletDTO, transactions_table
+
+
+class FakeEthNode:
+    """
+    Local stand-in for the node: keeps a mempool, mines on demand and signs deterministically
+    """
+
+    def __init__(self, gas_price: int = 30):
+        self.gas_price = gas_price
+        self.latest_nonce = 0
+        self.mempool = {}
+        self.mined = {}
+        self.sent = []
+        self.fail_sending = False
+        self.receipts_lagging = False
+        self.fail_batch = False
+
+    def get_address(self) -> str:
+        return "0xsystem"
+
+    def get_gas_price(self, default_net_commission) -> int:
+        return self.gas_price
+
+    def get_nonce(self, address: str, block_identifier: str = "pending") -> int:
+        if block_identifier == "latest":
+            return self.latest_nonce
+        return max([self.latest_nonce - 1, *(nonce for nonce, _ in self.mempool.values())]) + 1
+
+    def to_subunit(self, amount: Decimal) -> int:
+        return int(amount * 10 ** 18)
+
+    def get_net_commission(self, gas_price, units: bool = False) -> Decimal:
+        return Decimal(21000 * gas_price) / 10 ** 9
+
+    def sign_tx_out(self, address: str, value: int, gas_price: int, nonce: int) -> tuple:
+        return f"0x{nonce:04x}{gas_price:x}", f"raw:{nonce}:{gas_price}"
+
+    def send_raw_tx(self, raw_tx: str) -> str:
+        if self.fail_sending:
+            raise ConnectionError("node is unavailable")
+        _, nonce, gas_price = raw_tx.split(":")
+        tx_hash = f"0x{int(nonce):04x}{int(gas_price):x}"
+        self.sent.append(raw_tx)
+        self.mempool[tx_hash] = (int(nonce), raw_tx)
+        return tx_hash
+
+    def mine(self, tx_hash: str = None) -> None:
+        hashes = [tx_hash] if tx_hash else list(self.mempool)
+        for h in hashes:
+            nonce, _ = self.mempool.pop(h)
+            self.mined[h] = {"status": 1, "nonce": nonce}
+            self.latest_nonce = max(self.latest_nonce, nonce + 1)
+        # transactions with an already used nonce can't be mined anymore
+        self.mempool = {h: tx for h, tx in self.mempool.items() if tx[0] >= self.latest_nonce}
+
+    def get_receipts(self, tx_hashes: list) -> dict:
+        if self.fail_batch:
+            raise RPCBatchError("eth_getTransactionReceipt failed")
+        if self.receipts_lagging:
+            return {}
+        return {h: self.mined[h] for h in tx_hashes if h in self.mined}
+
+    def get_known_txs(self, tx_hashes: list) -> set:
+        return {h for h in tx_hashes if h in self.mempool or h in self.mined}
+
+
+class TestEthWithdrawalPipeline:
+    @pytest.fixture(autouse=True)
+    def withdraw_enabled(self):
+        with patch("data_handler.DataHandler.get_withdraw_status", return_value=True):
+            yield
+
+    @pytest.fixture()
+    def eth_wallet(self, user: UserDTO, wallet_factory: Callable[..., WalletDTO]) -> WalletDTO:
+        return wallet_factory(user.id, Decimal(0), symbol="eth", frozen=Decimal(10 ** 19))
+
+    def _create_withdrawals(self, wallet_id: int, count: int, db_session: Session) -> list:
+        stmt = (
+            insert(transactions_table)
+            .values([
+                {"wallet_id": wallet_id, "type": "out", "to_address": f"0x{i:040x}", "amount_units": Decimal("0.1")}
+                for i in range(count)
+            ])
+            .returning(transactions_table.c.id)
+        )
+        return [transaction_id for transaction_id, in db_session.execute(stmt)]
+
+    def _select_transactions(self, ids: list, db_session: Session) -> list:
+        stmt = select([transactions_table]).where(transactions_table.c.id.in_(ids)).order_by(transactions_table.c.id)
+        return db_session.execute(stmt).fetchall()
+
+    def test_several_withdrawals_in_flight_confirmed_in_bulk(self, eth_wallet: WalletDTO, db_session: Session):
+        node = FakeEthNode()
+        ids = self._create_withdrawals(eth_wallet.id, 3, db_session)
+
+        eth.send_withdraw_tx(node, NonceManager(lambda: node.get_nonce("0xsystem")))
+
+        transactions = self._select_transactions(ids, db_session)
+        assert [t.nonce for t in transactions] == [0, 1, 2]
+        assert node.sent == ["raw:0:30000000000", "raw:1:30000000000", "raw:2:30000000000"]
+
+        node.mine()
+        eth.check_tx(node, NonceManager(lambda: node.get_nonce("0xsystem")))
+
+        assert all(t.is_confirmed for t in self._select_transactions(ids, db_session))
+
+    def test_in_flight_limit(self, eth_wallet: WalletDTO, db_session: Session):
+        node = FakeEthNode()
+        nonces = NonceManager(lambda: node.get_nonce("0xsystem"))
+        ids = self._create_withdrawals(eth_wallet.id, eth.ETH_WITHDRAW_MAX_IN_FLIGHT + 2, db_session)
+
+        eth.send_withdraw_tx(node, nonces)
+        eth.send_withdraw_tx(node, nonces)
+
+        assert len(node.sent) == eth.ETH_WITHDRAW_MAX_IN_FLIGHT
+        assert sum(t.tx_hash is None for t in self._select_transactions(ids, db_session)) == 2
+
+    def test_failed_signing_gives_nonces_back(self, eth_wallet: WalletDTO, db_session: Session):
+        node = FakeEthNode()
+        nonces = NonceManager(lambda: node.get_nonce("0xsystem"))
+        ids = self._create_withdrawals(eth_wallet.id, 2, db_session)
+        sign_tx_out = node.sign_tx_out
+        signed = []
+
+        def sign_once(*args):
+            if signed:
+                raise ConnectionError("signer is unavailable")
+            signed.append(args)
+            return sign_tx_out(*args)
+
+        node.sign_tx_out = sign_once
+        with pytest.raises(ConnectionError):
+            eth.send_withdraw_tx(node, nonces)
+        assert all(t.nonce is None for t in self._select_transactions(ids, db_session))
+
+        node.sign_tx_out = sign_tx_out
+        eth.send_withdraw_tx(node, nonces)
+
+        # no gap is left by the nonces reserved in the failed run
+        assert [t.nonce for t in self._select_transactions(ids, db_session)] == [0, 1]
+
+    def test_stuck_withdrawal_replaced_and_old_hash_accepted(self, eth_wallet: WalletDTO, db_session: Session):
+        node = FakeEthNode()
+        nonces = NonceManager(lambda: node.get_nonce("0xsystem"))
+        transaction_id, = self._create_withdrawals(eth_wallet.id, 1, db_session)
+        eth.send_withdraw_tx(node, nonces)
+        old_hash = self._select_transactions([transaction_id], db_session)[0].tx_hash
+
+        db_session.execute(
+            update(transactions_table)
+            .where(transactions_table.c.id == transaction_id)
+            .values(sent_at=datetime.now(timezone.utc) - timedelta(hours=1))
+        )
+        eth.check_tx(node, nonces)
+
+        transaction = self._select_transactions([transaction_id], db_session)[0]
+        assert transaction.nonce == 0
+        assert transaction.gas_price == 34 * 10 ** 9
+        assert transaction.replaced_tx_hashes == [old_hash]
+        assert node.sent[-1] == "raw:0:34000000000"
+
+        node.mine(old_hash)
+        eth.check_tx(node, nonces)
+
+        transaction = self._select_transactions([transaction_id], db_session)[0]
+        assert transaction.is_confirmed
+        assert transaction.tx_hash == old_hash
+
+    def test_lost_withdrawal_resubmitted(self, eth_wallet: WalletDTO, db_session: Session):
+        node = FakeEthNode()
+        nonces = NonceManager(lambda: node.get_nonce("0xsystem"))
+        transaction_id, = self._create_withdrawals(eth_wallet.id, 1, db_session)
+        node.fail_sending = True
+        eth.send_withdraw_tx(node, nonces)
+
+        node.fail_sending = False
+        eth.check_tx(node, nonces)
+
+        assert node.sent == ["raw:0:30000000000"]
+
+    def test_withdrawal_with_taken_nonce_returned_to_queue(self, eth_wallet: WalletDTO, db_session: Session):
+        node = FakeEthNode()
+        nonces = NonceManager(lambda: node.get_nonce("0xsystem"))
+        transaction_id, = self._create_withdrawals(eth_wallet.id, 1, db_session)
+        node.fail_sending = True
+        eth.send_withdraw_tx(node, nonces)
+        # a transaction sent from elsewhere used the same nonce
+        node.latest_nonce = 1
+
+        eth.check_tx(node, nonces)
+        # one answer is not enough, the receipt may be missing on a lagging node only
+        assert self._select_transactions([transaction_id], db_session)[0].nonce == 0
+
+        for _ in range(eth.ETH_WITHDRAW_ORPHAN_CHECKS - 1):
+            eth.check_tx(node, nonces)
+
+        transaction = self._select_transactions([transaction_id], db_session)[0]
+        assert (transaction.tx_hash, transaction.nonce) == (None, None)
+
+        node.fail_sending = False
+        eth.send_withdraw_tx(node, nonces)
+
+        assert self._select_transactions([transaction_id], db_session)[0].nonce == 1
+
+    def test_mined_withdrawal_without_receipt_not_returned_to_queue(
+            self, eth_wallet: WalletDTO, db_session: Session
+    ):
+        node = FakeEthNode()
+        nonces = NonceManager(lambda: node.get_nonce("0xsystem"))
+        transaction_id, = self._create_withdrawals(eth_wallet.id, 1, db_session)
+        eth.send_withdraw_tx(node, nonces)
+        node.mine()
+        node.receipts_lagging = True
+
+        for _ in range(eth.ETH_WITHDRAW_ORPHAN_CHECKS + 1):
+            eth.check_tx(node, nonces)
+
+        transaction = self._select_transactions([transaction_id], db_session)[0]
+        assert (transaction.nonce, transaction.is_confirmed) == (0, False)
+        assert node.sent == ["raw:0:30000000000"]
+
+        node.receipts_lagging = False
+        eth.check_tx(node, nonces)
+
+        assert self._select_transactions([transaction_id], db_session)[0].is_confirmed
+
+    def test_failed_batch_skips_run(self, eth_wallet: WalletDTO, db_session: Session):
+        node = FakeEthNode()
+        nonces = NonceManager(lambda: node.get_nonce("0xsystem"))
+        transaction_id, = self._create_withdrawals(eth_wallet.id, 1, db_session)
+        node.fail_sending = True
+        eth.send_withdraw_tx(node, nonces)
+        node.latest_nonce = 1
+        node.fail_batch = True
+
+        for _ in range(eth.ETH_WITHDRAW_ORPHAN_CHECKS + 1):
+            eth.check_tx(node, nonces)
+
+        assert self._select_transactions([transaction_id], db_session)[0].nonce == 0
@@ -1,4 +1,7 @@
+import json
 import os
+from datetime import datetime, timezone
+from decimal import Decimal
 
 from binance import Client
 
@@ -24,5 +27,15 @@ class BinanceClient:
     def get_symbol_price(self, symbol):
         return self.client.get_symbol_ticker(symbol=symbol)['price']
 
+    def get_tickers(self, symbols):
+        """
+        {symbol: (last price, time of the price)} for all symbols with one request
+        """
+        tickers = self.client.get_ticker(symbols=json.dumps(list(symbols), separators=(',', ':')))
+        return {
+            t['symbol']: (Decimal(t['lastPrice']), datetime.fromtimestamp(t['closeTime'] / 1000, timezone.utc))
+            for t in tickers
+        }
+
 
 binance_client = BinanceClient()
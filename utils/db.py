@@ -1,4 +1,6 @@
-from typing import Type, TypeVar, Any
+from typing import Type, TypeVar, Any, Iterator, Optional
+
+from sqlalchemy import text
 
 T = TypeVar("T")
 
@@ -11,3 +13,48 @@ def mapping_result_to_dto(result: Any, dto: Type[T]) -> T:
     result_first = result.first()
     result_keys = result.keys()
     return dto(**mapping_result_to_dict(result_keys, result_first)) if result_first is not None else result_first
+
+
+def values_list(rows: list, prefix: str = "v") -> tuple:
+    """
+    Renders rows as the body of a `VALUES` list with bound parameters, returns the sql and the parameters.
+    """
+    params = {}
+    values = []
+    for i, row in enumerate(rows):
+        placeholders = []
+        for j, value in enumerate(row):
+            params[f"{prefix}{i}_{j}"] = value
+            placeholders.append(f":{prefix}{i}_{j}")
+        values.append(f"({', '.join(placeholders)})")
+    return ", ".join(values), params
+
+
+def bulk_update(session: Any, table: str, key: str, columns: dict, rows: list, chunk_size: int = 5000) -> None:
+    """
+    Updates many rows with `UPDATE ... FROM (VALUES ...)`, one statement per chunk of rows.
+    `columns` maps column names to postgres types, every row is a tuple of (key, *values) in the same order.
+    """
+    names = ", ".join([key, *columns])
+    assignments = ", ".join(f"{name} = v.{name}::{type_}" for name, type_ in columns.items())
+    for start in range(0, len(rows), chunk_size):
+        values, params = values_list(rows[start:start + chunk_size])
+        session.execute(
+            f"UPDATE {table} t SET {assignments} FROM (VALUES {values}) AS v ({names}) WHERE t.{key} = v.{key}",
+            params
+        )
+
+
+def stream_rows(session: Any, q: str, params: Optional[dict] = None, chunk_size: int = 1000) -> Iterator:
+    """
+    Iterates the rows of a query through a server-side cursor, at most `chunk_size` rows are held in memory.
+    """
+    result = session.execute(text(q).execution_options(stream_results=True), params or {})
+    try:
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        result.close()
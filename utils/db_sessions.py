@@ -1,7 +1,12 @@
 from system.settings import Session
 from contextlib import contextmanager
 
-__all__ = ["session_scope"]
+from flask import g, has_request_context, request
+from sqlalchemy import event, orm
+
+from utils.logger import logger
+
+__all__ = ["session_scope", "standalone_session_scope", "on_commit", "init_request_session", "request_checkouts"]
 
 
 @contextmanager
@@ -17,6 +22,161 @@ def _session_scope():
         session.close()
 
 
+class _RequestSession:
+    """
+    One session per HTTP request, checked out on the first session_scope() and shared by every scope
+    opened while handling the request, committed once the response is ready.
+    """
+
+    def __init__(self):
+        self._scope = None
+        self.session = None
+        self.failed = False
+        self.checkouts = 0
+        self._depth = 0
+
+    @contextmanager
+    def join(self):
+        if self._scope is None:
+            self._scope = _session_scope()
+            self.session = self._scope.__enter__()
+            self.checkouts += 1
+        self._depth += 1
+        try:
+            if self._depth > 1:
+                # a nested scope is a savepoint, an exception its caller handles undoes only the scope's own changes
+                with self.session.begin_nested():
+                    yield self.session
+            else:
+                yield self.session
+        except BaseException:
+            if self._depth == 1:
+                # raised through an outermost scope: the view or a decorator failed
+                self.failed = True
+            raise
+        finally:
+            self._depth -= 1
+
+    def close(self, exc=None):
+        if self._scope is None:
+            return
+        scope, self._scope = self._scope, None
+        if exc is None and self.failed:
+            exc = RuntimeError('request session failed')
+        if exc is None:
+            scope.__exit__(None, None, None)
+        else:
+            scope.__exit__(type(exc), exc, exc.__traceback__)
+
+
+def _request_session():
+    if has_request_context():
+        return g.get('_request_session')
+
+
+def request_checkouts():
+    request_session = _request_session()
+    return request_session.checkouts if request_session is not None else 0
+
+
+def init_request_session(app):
+    @app.before_request
+    def _open_request_session():
+        g._request_session = _RequestSession()
+
+    @app.after_request
+    def _commit_request_session(response):
+        request_session = g.get('_request_session')
+        if request_session is not None:
+            logger.debug(f'{request_session.checkouts} db checkouts for {response.status_code}')
+            if request_session.failed and response.status_code < 400:
+                logger.error(f'{request.method} {request.path} answered {response.status_code}, changes rolled back')
+            request_session.close()
+        return response
+
+    @app.teardown_request
+    def _rollback_request_session(exc):
+        # the session is still open only when the request failed before after_request
+        request_session = g.get('_request_session')
+        if request_session is not None:
+            request_session.close(exc or RuntimeError('request failed'))
+
+
 def session_scope():
+    request_session = _request_session()
+    if request_session is not None:
+        return request_session.join()
     #  Split the function into 2 parts so that it can be patched when running tests
     return _session_scope()
+
+
+def standalone_session_scope():
+    # a transaction of its own, never joined to the request session, for writes that don't depend on the request
+    return _session_scope()
+
+
+_NO_ITEM = object()
+
+
+def on_commit(session, callback, item=_NO_ITEM):
+    """
+    callback runs once the root transaction commits. It is dropped if the root transaction is rolled back, or the
+    savepoint it was registered in, a released savepoint hands it over to the enclosing transaction.
+    Callbacks registered with an item are called once per commit, with the list of their items
+    """
+    session.info.setdefault('on_commit', []).append([_boundary(session.transaction), callback, item])
+
+
+def _boundary(transaction):
+    # the savepoint or root transaction a subtransaction belongs to
+    while not transaction.nested and transaction.parent is not None:
+        transaction = transaction.parent
+    return transaction
+
+
+def _is_within(transaction, boundary):
+    while transaction is not None:
+        if transaction is boundary:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+def _run_callbacks(entries):
+    callbacks, batches = [], {}
+    for _, callback, item in entries:
+        if item is _NO_ITEM:
+            callbacks.append(callback)
+            continue
+        if callback not in batches:
+            batches[callback] = []
+            callbacks.append(lambda callback=callback: callback(batches[callback]))
+        batches[callback].append(item)
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logger.exception(e)
+
+
+@event.listens_for(orm.Session, 'after_commit')
+def _run_on_commit_callbacks(session):
+    # the ending transaction is still session.transaction during the event
+    transaction = _boundary(session.transaction)
+    if transaction.nested:
+        parent = _boundary(transaction.parent)
+        for entry in session.info.get('on_commit', []):
+            if entry[0] is transaction:
+                entry[0] = parent
+        return
+    _run_callbacks(session.info.pop('on_commit', []))
+
+
+@event.listens_for(orm.Session, 'after_rollback')
+def _drop_on_commit_callbacks(session):
+    transaction = _boundary(session.transaction)
+    if transaction.nested:
+        entries = session.info.get('on_commit', [])
+        entries[:] = [entry for entry in entries if not _is_within(entry[0], transaction)]
+        return
+    session.info.pop('on_commit', None)
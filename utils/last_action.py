@@ -0,0 +1,86 @@
+import atexit
+import threading
+import time
+from datetime import datetime, timezone
+from os import environ
+
+from system.settings import app
+from utils.db import bulk_update
+from utils.db_sessions import standalone_session_scope
+from utils.logger import logger
+
+LAST_ACTION_FLUSH_INTERVAL = float(environ.get('LAST_ACTION_FLUSH_INTERVAL', 5))
+# users touched between two flushes, a full buffer is flushed right away
+LAST_ACTION_MAX_PENDING = int(environ.get('LAST_ACTION_MAX_PENDING', 10_000))
+
+
+class LastActionTracker:
+    """
+    Write-behind "user".last_action: touches are coalesced in memory and written every LAST_ACTION_FLUSH_INTERVAL
+    seconds with one UPDATE ... FROM (VALUES ...) per key, instead of a write transaction per request.
+    """
+
+    def __init__(self, flush_interval=LAST_ACTION_FLUSH_INTERVAL, max_pending=LAST_ACTION_MAX_PENDING):
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._by_id = {}
+        self._by_telegram_id = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def touch(self, user_id=None, telegram_id=None):
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            if user_id is not None:
+                self._by_id[int(user_id)] = now
+            elif telegram_id is not None:
+                self._by_telegram_id[int(telegram_id)] = now
+            else:
+                raise ValueError('telegram_id and user_id are none')
+            is_full = len(self._by_id) + len(self._by_telegram_id) >= self._max_pending
+        if is_full:
+            self.flush()
+        else:
+            self._ensure_started()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                by_id, self._by_id = self._by_id, {}
+                by_telegram_id, self._by_telegram_id = self._by_telegram_id, {}
+            if not by_id and not by_telegram_id:
+                return
+            try:
+                # a full buffer is flushed from a request thread, the batch must not share the request transaction
+                with standalone_session_scope() as session:
+                    for key, touched in (('id', by_id), ('telegram_id', by_telegram_id)):
+                        if touched:
+                            bulk_update(session, '"user"', key, {'last_action': 'timestamptz'}, list(touched.items()))
+            except Exception:
+                # kept for the next flush, touches made in the meantime are newer
+                with self._lock:
+                    for pending, touched in ((self._by_id, by_id), (self._by_telegram_id, by_telegram_id)):
+                        for key, value in touched.items():
+                            pending.setdefault(key, value)
+                raise
+
+    def _run(self):
+        while True:
+            time.sleep(self._flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(e)
+
+    def _ensure_started(self):
+        if self._thread is not None or app.config.get('TESTING'):
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='last-action', daemon=True)
+                self._thread.start()
+
+
+last_actions = LastActionTracker()
+atexit.register(last_actions.flush)
@@ -0,0 +1,77 @@
+from contextlib import contextmanager
+
+USER_COLUMNS = """
+    id, telegram_id, nickname, lang, is_baned, is_deleted, is_verify, sky_pay, allow_payment_v2, currency, ref_kw,
+    email, allow_sell, allow_sale_v2, rating, shadow_ban, apply_shadow_ban, super_verify_only,
+    COALESCE(rights >= 'low', FALSE) AS is_admin
+"""
+
+LOT_COLUMNS = """
+    id, identificator, limit_from, limit_to, details, broker_id, rate,
+    coefficient, is_active, is_deleted, currency, type, user_id, symbol
+"""
+
+# queries a single lookup costs without the loader: get_user also checks rights, a lot's broker is counted separately
+_QUERIES_PER_LOOKUP = {'users': 2, 'lots': 1, 'brokers': 1}
+
+
+class Loader:
+    """
+    Identity map for users, lots and brokers living for one serialization, see loading().
+    Missing keys are fetched in one query per kind, everything already seen is served from memory.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self._rows = {'users': {}, 'lots': {}, 'brokers': {}}
+        self.stats = {'lookups': 0, 'queries': 0, 'saved_queries': 0}
+
+    def _load(self, kind, keys, q):
+        keys = [key for key in keys if key is not None]
+        rows = self._rows[kind]
+        missing = list({key for key in keys if key not in rows})
+        if missing:
+            for row in self.session.execute(q, {'keys': missing}):
+                row = dict(row)
+                rows[row.pop('key')] = row
+            self.stats['queries'] += 1
+        self.stats['lookups'] += len(keys)
+        self.stats['saved_queries'] += _QUERIES_PER_LOOKUP[kind] * len(keys) - (1 if missing else 0)
+        return {key: rows[key] for key in keys if key in rows}
+
+    def load_users(self, user_ids):
+        q = f'SELECT id AS key, {USER_COLUMNS} FROM "user" WHERE id = ANY(:keys)'
+        return self._load('users', [int(user_id) for user_id in user_ids if user_id is not None], q)
+
+    def get_user(self, user_id):
+        if user_id is None:
+            return None
+        return self.load_users([user_id]).get(int(user_id))
+
+    def load_lots(self, identificators):
+        q = f'SELECT identificator AS key, {LOT_COLUMNS} FROM lot WHERE identificator = ANY(:keys)'
+        return self._load('lots', identificators, q)
+
+    def load_brokers(self, broker_ids):
+        q = 'SELECT id::text AS key, name FROM broker WHERE id = ANY(CAST(:keys AS uuid[]))'
+        return self._load('brokers', [str(broker_id) for broker_id in broker_ids if broker_id is not None], q)
+
+
+@contextmanager
+def loading(session):
+    # rows are shared within the block only, anything written after it is read again. Nested blocks share the
+    # outer loader
+    loader = session.info.get('loader')
+    if loader is not None:
+        yield loader
+        return
+    loader = session.info['loader'] = Loader(session)
+    try:
+        yield loader
+    finally:
+        session.info.pop('loader', None)
+
+
+def loader_for(session):
+    # the loader of the enclosing loading() block, a single use one outside of it
+    return session.info.get('loader') or Loader(session)
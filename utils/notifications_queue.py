@@ -1,42 +1,143 @@
 import json
 import logging
+import queue
+import time
 from datetime import datetime
 from os import environ
 from dotenv import load_dotenv
 load_dotenv()
 
 from pika import URLParameters, BlockingConnection
+from pika.exceptions import AMQPConnectionError, AMQPChannelError, ChannelClosedByBroker, UnroutableError
 
 from system.constants import STATES
+from utils.db_sessions import on_commit
+from utils.loaders import loader_for
 from utils.logger import logger
 
 url = environ.get('CLOUDAMQP_URL')
 params = URLParameters(url)
 params.socket_timeout = 5
+params.heartbeat = int(environ.get('AMQP_HEARTBEAT', 60))
+
+# seconds a queue is trusted to exist without redeclaring it, auto_delete queues vanish with their consumer
+DECLARED_QUEUE_TTL = float(environ.get('AMQP_DECLARED_QUEUE_TTL', 60))
+# connections shared by all threads, a publish waits for a free one
+AMQP_POOL_SIZE = int(environ.get('AMQP_POOL_SIZE', 4))
 
 logging.getLogger("pika").setLevel(logging.WARNING)
 
 
-def _send_queue_notification(user_id, data):
-    logger.info(f'Sending message to {user_id}, {data}')
-    with BlockingConnection(params) as connection:
-        channel = connection.channel()
-        q = f'updates_{user_id}'
+class _Connection:
+    """
+    One connection with a confirmed channel, opened on first use. Queues declared recently are remembered.
+    """
+
+    def __init__(self, parameters):
+        self.parameters = parameters
+        self.connection = None
+        self._channel = None
+        self.declared = {}
+
+    def channel(self):
+        if self._channel is None or not self._channel.is_open:
+            if self.connection is None or not self.connection.is_open:
+                self.connection = BlockingConnection(self.parameters)
+            self._channel = self.connection.channel()
+            self._channel.confirm_delivery()
+            self.declared = {}
+        return self._channel
+
+    def declare(self, q, force=False):
+        if not force and time.monotonic() - self.declared.get(q, float('-inf')) < DECLARED_QUEUE_TTL:
+            return
         try:
-            channel.queue_declare(queue=q, auto_delete=True)
-        except Exception as e:
-            if 'PRECONDITION_FAILED' in str(e):
-                channel = connection.channel()
-                channel.queue_delete(queue=q)
-                channel.queue_declare(queue=q, auto_delete=True)
+            self.channel().queue_declare(queue=q, auto_delete=True)
+        except ChannelClosedByBroker as e:
+            if e.reply_code != 406:  # PRECONDITION_FAILED, queue exists with other arguments
+                raise
+            self.channel().queue_delete(queue=q)
+            self.channel().queue_declare(queue=q, auto_delete=True)
+        self.declared[q] = time.monotonic()
+
+    def publish(self, q, body):
+        self.declare(q)
+        try:
+            self.channel().basic_publish(exchange='', routing_key=q, body=body, mandatory=True)
+        except UnroutableError:
+            self.declare(q, force=True)
+            self.channel().basic_publish(exchange='', routing_key=q, body=body, mandatory=True)
+
+    def reset(self):
+        connection, self.connection, self._channel = self.connection, None, None
+        if connection is not None and connection.is_open:
+            try:
+                connection.close()
+            except Exception:
+                pass
 
-        channel.basic_publish(exchange='', routing_key=q, body=json.dumps(data).encode())
-        print("[x] Message sent to consumer")
 
+class _Publisher:
+    """
+    Long-lived publisher over a pool of AMQP_POOL_SIZE connections. pika connections are not thread safe,
+    a connection is taken from the pool for one publish and put back, so request threads share them
+    instead of opening their own. A message that turns out unroutable is redeclared and sent again.
+    """
+
+    def __init__(self, parameters, size=AMQP_POOL_SIZE):
+        self._pool = queue.LifoQueue()
+        for _ in range(size):
+            self._pool.put(_Connection(parameters))
+
+    def publish(self, messages):
+        """
+        messages are (user_id, data) pairs, every publish is confirmed by the broker before the next one.
+        A dropped connection is reopened once, the failed message and the rest are sent again
+        """
+        connection = self._pool.get()
+        try:
+            pending = list(messages)
+            reconnected = False
+            while pending:
+                user_id, data = pending[0]
+                try:
+                    connection.publish(f'updates_{user_id}', json.dumps(data).encode())
+                except (AMQPConnectionError, AMQPChannelError):
+                    connection.reset()
+                    if reconnected:
+                        raise
+                    reconnected = True
+                    continue
+                pending.pop(0)
+        finally:
+            self._pool.put(connection)
 
-def send_notification_to_queue(user_id, data):
+
+publisher = _Publisher(params)
+
+
+def _send_queue_notifications(messages):
+    logger.info(f'Sending {len(messages)} messages to {", ".join(str(user_id) for user_id, _ in messages)}')
+    publisher.publish(messages)
+
+
+def _flush_notifications(messages):
+    try:
+        _send_queue_notifications(messages)
+    except Exception as e:
+        logger.exception(e)
+
+
+def send_notification_to_queue(user_id, data, session=None):
+    """
+    With a session the message is held until that session commits, so nothing is published for rolled back
+    changes and the broker is never waited on while row locks are held
+    """
+    if session is not None:
+        on_commit(session, _flush_notifications, (user_id, data))
+        return
     try:
-        _send_queue_notification(user_id, data)
+        _send_queue_notifications([(user_id, data)])
     except Exception as e:
         logger.exception(e)
 
@@ -69,7 +170,8 @@ def create_deal_notification(user_id, deal_id: int, session, n_type='deal'):
             'type': n_type,
             'details': details,
             'created_at': round(datetime.utcnow().timestamp())
-        }
+        },
+        session
     )
 
 
@@ -88,7 +190,8 @@ def create_timeout_notification(user_id, symbol, deal_id, identificator, session
             'type': 'timeout',
             'details': {'id': identificator},
             'created_at': round(datetime.utcnow().timestamp())
-        }
+        },
+        session
     )
 
 
@@ -114,12 +217,14 @@ def create_closed_dispute_notification(user_id, symbol, deal_id, session, admin=
             'type': t,
             'details': {'id': identificator, 'winner': winner},
             'created_at': round(datetime.utcnow().timestamp())
-        }
+        },
+        session
     )
 
 
 def create_message_notification(user_id, sender_id, message, message_id: int, media_id, symbol, session):
-    sender_nickname = session.execute('SELECT nickname FROM "user" WHERE id = :uid LIMIT 1', {'uid': sender_id}).scalar()
+    sender = loader_for(session).get_user(sender_id)
+    sender_nickname = sender['nickname'] if sender else None
     q = """
             INSERT INTO notification (user_id, symbol, type, message_id) 
             VALUES (:receiver_id, :symbol, 'message', :message_id)
@@ -133,6 +238,7 @@ def create_message_notification(user_id, sender_id, message, message_id: int, me
             'type': 'message',
             'details': {'sender': sender_nickname, 'text': message, 'media_id': media_id},
             'created_at': round(datetime.utcnow().timestamp())
-        }
+        },
+        session
     )
 
@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import defaultdict
+from os import environ
+
+from crypto.manager import manager
+from system.constants import LOT_TYPE_BUY, LOT_TYPE_SELL
+from system.settings import app
+from utils.db_sessions import on_commit
+
+# seconds a snapshot may lag behind changes made outside of this process (other workers, manual sql)
+ORDER_BOOK_MAX_STALENESS = float(environ.get('ORDER_BOOK_MAX_STALENESS', 5))
+
+_LOTS_QUERY = """
+    SELECT l.id, l.identificator, l.broker_id, b.name AS broker_name, l.type, l.rate, l.limit_from, l.limit_to,
+        l.currency, l.symbol, w.balance, u.is_verify, u.id AS user_id, u.last_action,
+        (l.is_active AND NOT l.is_deleted AND NOT u.is_baned AND NOT u.is_deleted AND COALESCE(w.is_active, FALSE)
+            AND NOT u.stealth AND u.is_verify) AS is_listed
+    FROM lot l
+    JOIN "user" u ON l.user_id = u.id
+    LEFT JOIN wallet w ON u.id = w.user_id AND w.symbol = l.symbol
+    LEFT JOIN broker b ON l.broker_id = b.id
+"""
+
+
+class _Slice:
+    """
+    Lots of one (symbol, currency), never modified once built: changes produce a new slice that is swapped in,
+    so readers iterate their snapshot without the book lock
+    """
+
+    def __init__(self, lots, built_at=None):
+        self.built_at = time.monotonic() if built_at is None else built_at
+        self.lots = lots
+        self._views = {}
+
+    def replace_users(self, user_ids, lots):
+        # lots of the users that are not returned any more (delisted or deleted) are dropped
+        new_lots = {lot_id: lot for lot_id, lot in self.lots.items() if lot['user_id'] not in user_ids}
+        new_lots.update((lot['id'], lot) for lot in lots)
+        return _Slice(new_lots, self.built_at)
+
+    def view(self, lot_type, broker_id=None):
+        key = (lot_type, broker_id)
+        # two readers may build the same view, either result is the same
+        if key not in self._views:
+            lots = [lot for lot in self.lots.values() if lot['type'] == lot_type]
+            if broker_id is not None:
+                lots = [lot for lot in lots if lot['broker_key'] == broker_id]
+            # buyers see the cheapest offers first, sellers the most generous ones
+            lots.sort(key=lambda lot: lot['rate'], reverse=lot_type == LOT_TYPE_BUY)
+            self._views[key] = lots
+        return self._views[key]
+
+
+class OrderBook:
+    """
+    In-process snapshot of listed lots, one slice per (symbol, currency).
+    Changes made through this process are applied incrementally after commit, everything else is picked up
+    by rebuilding a slice once it is older than max_staleness.
+    """
+
+    def __init__(self, max_staleness, bypass=None):
+        self.max_staleness = max_staleness
+        self._bypass = bypass or (lambda: False)
+        self._slices = {}
+        self._changed_users = set()
+        self._lock = threading.RLock()
+
+    def users_changed(self, session, *user_ids):
+        on_commit(session, lambda: self._mark_users_changed(user_ids))
+
+    def invalidate(self, session=None):
+        if session is None:
+            self._clear()
+        else:
+            on_commit(session, self._clear)
+
+    def _mark_users_changed(self, user_ids):
+        with self._lock:
+            self._changed_users.update(user_ids)
+
+    def _clear(self):
+        with self._lock:
+            self._slices.clear()
+            self._changed_users.clear()
+
+    def _is_fresh(self, book_slice):
+        if self._bypass():
+            return False
+        return time.monotonic() - book_slice.built_at < self.max_staleness
+
+    @staticmethod
+    def _to_lot(row):
+        lot = dict(row)
+        lot['broker_key'] = str(lot['broker_id']) if lot['broker_id'] is not None else None
+        return lot
+
+    def _build(self, symbol, currency, session):
+        q = _LOTS_QUERY + """
+            WHERE l.symbol = :sym AND l.currency = :cur AND l.is_active AND NOT l.is_deleted
+                AND NOT u.is_baned AND NOT u.is_deleted AND w.is_active AND NOT u.stealth AND u.is_verify
+        """
+        rows = session.execute(q, {'sym': symbol, 'cur': currency}).fetchall()
+        return _Slice({lot['id']: lot for lot in map(self._to_lot, rows)})
+
+    def _apply_changed_users(self, session):
+        user_ids, self._changed_users = set(self._changed_users), set()
+        rows = session.execute(_LOTS_QUERY + 'WHERE l.user_id = ANY(:uids)', {'uids': list(user_ids)}).fetchall()
+        listed = defaultdict(list)
+        for lot in map(self._to_lot, rows):
+            if lot['is_listed']:
+                listed[(lot['symbol'], lot['currency'])].append(lot)
+        for key, book_slice in list(self._slices.items()):
+            self._slices[key] = book_slice.replace_users(user_ids, listed[key])
+
+    def _get_slice(self, symbol, currency, session):
+        with self._lock:
+            book_slice = self._slices.get((symbol, currency))
+            if book_slice is None or not self._is_fresh(book_slice):
+                self._slices[(symbol, currency)] = self._build(symbol, currency, session)
+            if self._changed_users:
+                self._apply_changed_users(session)
+            return self._slices[(symbol, currency)]
+
+    def get_lots(self, symbol, currency, lot_type, broker_id, session):
+        if not broker_id:
+            return []
+        return list(self._get_slice(symbol, currency, session).view(lot_type, str(broker_id).lower()))
+
+    def get_brokers(self, symbol, currency, lot_type, session):
+        """
+        Per broker best rate and lots count, ordered by lots count, for lots that can take at least the
+        minimal deal right now
+        """
+        subunits_in_unit = None
+        brokers = defaultdict(list)
+        for lot in self._get_slice(symbol, currency, session).view(lot_type):
+            if lot['limit_to'] < lot['limit_from']:
+                continue
+            if lot_type == LOT_TYPE_SELL:
+                # only sell lots need it, and only once a lot gets here: symbols the manager can't convert raise
+                if subunits_in_unit is None:
+                    subunits_in_unit = manager.to_subunit(symbol=symbol, val=1)
+                balance = lot['balance']
+                if lot['limit_from'] / lot['rate'] * subunits_in_unit > balance \
+                        or 100 / lot['rate'] * subunits_in_unit > balance:
+                    continue
+            brokers[lot['broker_id']].append(lot)
+        res = [
+            {'id': broker_id, 'name': lots[0]['broker_name'], 'rate': lots[0]['rate'], 'cnt': len(lots)}
+            for broker_id, lots in brokers.items()
+        ]
+        res.sort(key=lambda item: item['cnt'], reverse=True)
+        return res
+
+
+order_book = OrderBook(ORDER_BOOK_MAX_STALENESS, bypass=lambda: app.config.get('TESTING', False))
@@ -0,0 +1,174 @@
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+
+import simplejson
+
+from crypto.manager import manager
+from system.settings import app
+from utils.db_sessions import session_scope, on_commit
+from utils.emails import receipt
+from utils.logger import logger
+from utils.utils import (
+    complete_purchase, complete_payment_v2, complete_sell, complete_sale_v2, update_purchase, update_sale_v2,
+    update_payment_v2
+)
+
+OUTBOX_BATCH_SIZE = int(environ.get('OUTBOX_BATCH_SIZE', 100))
+OUTBOX_MAX_ATTEMPTS = int(environ.get('OUTBOX_MAX_ATTEMPTS', 10))
+# seconds before the first retry, doubled on every next one
+OUTBOX_RETRY_BACKOFF = float(environ.get('OUTBOX_RETRY_BACKOFF', 5))
+OUTBOX_WORKERS = int(environ.get('OUTBOX_WORKERS', 4))
+
+_handlers = {}
+_executor = ThreadPoolExecutor(max_workers=OUTBOX_WORKERS, thread_name_prefix='outbox')
+
+
+def handler(kind, retry=True):
+    """
+    Registers the side effect executed for an outbox kind. Effects that are not safe to repeat (sending coins)
+    are registered with retry=False, an attempt with an unknown outcome is then left failed for manual review
+    """
+    def decorator(f):
+        _handlers[kind] = (f, retry)
+        return f
+    return decorator
+
+
+def enqueue(session, kind, idempotency_key, **payload):
+    """
+    Stores a side effect in the current transaction, it is executed only once the transaction commits.
+    An effect with an already known idempotency key is ignored
+    """
+    if kind not in _handlers:
+        raise ValueError(f'Unknown outbox kind {kind}')
+    outbox_id = session.execute(
+        """
+            INSERT INTO outbox (kind, idempotency_key, payload)
+            VALUES (:kind, :key, CAST(:payload AS jsonb))
+            ON CONFLICT (idempotency_key) DO NOTHING
+            RETURNING id
+        """, {'kind': kind, 'key': idempotency_key, 'payload': simplejson.dumps(payload, use_decimal=True, default=str)}
+    ).scalar()
+    if outbox_id is not None:
+        on_commit(session, _dispatch_soon, outbox_id)
+
+
+def _dispatch_soon(ids):
+    # committed effects are tried right away, the dispatch job only picks up retries and leftovers
+    if ids and not app.config.get('TESTING'):
+        _executor.submit(dispatch, ids)
+
+
+def _claim(session, ids, limit):
+    ids_filter = 'AND id = ANY(:ids)' if ids is not None else ''
+    q = f"""
+        UPDATE outbox o
+        SET attempts = o.attempts + 1,
+            next_attempt_at = NOW() + make_interval(secs => :backoff * power(2, o.attempts))
+        FROM (
+            SELECT id FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= NOW() {ids_filter}
+            ORDER BY id
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        ) c
+        WHERE o.id = c.id
+        RETURNING o.id, o.kind, o.payload::text AS payload, o.attempts
+    """
+    rows = session.execute(q, {'ids': ids, 'limit': limit, 'backoff': OUTBOX_RETRY_BACKOFF}).fetchall()
+    return sorted(rows, key=lambda row: row['id'])
+
+
+def _finish(outbox_id, status, error=None):
+    with session_scope() as session:
+        session.execute(
+            """
+                UPDATE outbox
+                SET status = :status, last_error = :error,
+                    processed_at = CASE WHEN :status = 'done' THEN NOW() END
+                WHERE id = :id
+            """, {'id': outbox_id, 'status': status, 'error': error}
+        )
+
+
+def _run(row):
+    func, retry = _handlers[row['kind']]
+    if not retry and row['attempts'] > 1:
+        _finish(row['id'], 'failed', 'previous attempt was interrupted, outcome unknown')
+        return
+    try:
+        func(**simplejson.loads(row['payload'], use_decimal=True))
+    except Exception as e:
+        logger.exception(e)
+        if not retry or row['attempts'] >= OUTBOX_MAX_ATTEMPTS:
+            _finish(row['id'], 'failed', repr(e))
+        else:
+            # stays pending, the claim already moved next_attempt_at forward
+            with session_scope() as session:
+                session.execute('UPDATE outbox SET last_error = :error WHERE id = :id', {'id': row['id'], 'error': repr(e)})
+        return
+    _finish(row['id'], 'done')
+
+
+def dispatch(ids=None, limit=OUTBOX_BATCH_SIZE):
+    """
+    Claims due effects (the claim is committed before anything is executed, so no row lock is held meanwhile)
+    and runs them in order
+    """
+    with session_scope() as session:
+        rows = _claim(session, ids, limit)
+    for row in rows:
+        _run(row)
+    return len(rows)
+
+
+@handler('complete_purchase')
+def _complete_purchase(user_id, purchase_id, tx_hash, received_crypto, rate):
+    complete_purchase(user_id, purchase_id, tx_hash, received_crypto, rate)
+
+
+@handler('sky_pay_btc_payout', retry=False)
+def _sky_pay_btc_payout(address, amount, user_id, purchase_id, received_crypto, rate):
+    tx_hash = manager.currencies['btc'].create_tx_out(address, amount)
+    with session_scope() as session:
+        enqueue(
+            session, 'complete_purchase', f'complete_purchase:{purchase_id}',
+            user_id=user_id, purchase_id=purchase_id, tx_hash=tx_hash, received_crypto=received_crypto, rate=rate
+        )
+
+
+@handler('complete_payment_v2')
+def _complete_payment_v2(user_id, payment_v2_id, received_crypto):
+    complete_payment_v2(user_id, payment_v2_id, received_crypto)
+
+
+@handler('complete_sell')
+def _complete_sell(user_id, sell_id):
+    with session_scope() as session:
+        complete_sell(user_id, sell_id, session)
+
+
+@handler('complete_sale_v2')
+def _complete_sale_v2(user_id, sale_v2_id, sent_crypto):
+    with session_scope() as session:
+        complete_sale_v2(user_id=user_id, sale_v2_id=sale_v2_id, sent_crypto=sent_crypto, session=session)
+
+
+@handler('update_purchase')
+def _update_purchase(purchase_id, data):
+    update_purchase(user_id=-1, purchase_id=purchase_id, data=data)
+
+
+@handler('update_sale_v2')
+def _update_sale_v2(sale_v2_id, data):
+    update_sale_v2(user_id=-1, sale_v2_id=sale_v2_id, data=data)
+
+
+@handler('update_payment_v2')
+def _update_payment_v2(payment_v2_id, data):
+    update_payment_v2(user_id=-1, payment_v2_id=payment_v2_id, data=data)
+
+
+@handler('receipt')
+def _receipt(**kwargs):
+    receipt(**kwargs)
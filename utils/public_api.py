@@ -0,0 +1,127 @@
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from os import environ
+
+import jwt
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from system.constants import ADMIN_ROLE, PUBLIC_API_HOST
+
+PUBLIC_API_POOL_SIZE = int(environ.get('PUBLIC_API_POOL_SIZE', 10))
+PUBLIC_API_CONNECT_TIMEOUT = float(environ.get('PUBLIC_API_CONNECT_TIMEOUT', 3))
+PUBLIC_API_READ_TIMEOUT = float(environ.get('PUBLIC_API_READ_TIMEOUT', 15))
+PUBLIC_API_RETRIES = int(environ.get('PUBLIC_API_RETRIES', 3))
+PUBLIC_API_BATCH_WORKERS = int(environ.get('PUBLIC_API_BATCH_WORKERS', 8))
+
+
+@lru_cache(maxsize=1024)
+def admin_token(user_id, salt):
+    # admin tokens carry no expiration, so one signature per user is enough for the process lifetime
+    return jwt.encode({
+        'user_id': user_id,
+        'role_id': ADMIN_ROLE
+    }, salt, algorithm='HS256').decode('utf-8')
+
+
+class PublicAPIClient:
+    """
+    Keep-alive client for the public api. Connection errors are retried for every method, gateway errors only
+    for idempotent ones, so a post that may have reached the server is never sent twice.
+    Latency and errors are collected per endpoint (method and path template), see metrics().
+    """
+
+    def __init__(self, host, pool_size, timeout, retries):
+        self.host = host
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=0.3,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({'GET', 'PUT', 'DELETE'}),  # idempotent only
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._metrics = defaultdict(lambda: {'count': 0, 'errors': 0, 'total_time': 0.0, 'max_time': 0.0})
+        self._lock = threading.Lock()
+
+    def request(self, method, endpoint, user_id=0, timeout=None, **kwargs):
+        """
+        endpoint is a path template formatted with path_params, the template itself is the metrics key
+        """
+        path = endpoint.format(**kwargs.pop('path_params', {}))
+        headers = {'Authorization': f'Bearer {admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
+        started = time.monotonic()
+        failed = True
+        try:
+            res = self.session.request(
+                method, self.host + path, headers=headers, timeout=timeout or self.timeout, **kwargs
+            )
+            res.raise_for_status()
+            failed = False
+            return res
+        finally:
+            self._record(f'{method} {endpoint}', time.monotonic() - started, failed)
+
+    def get(self, endpoint, user_id=0, **kwargs):
+        return self.request('GET', endpoint, user_id, **kwargs)
+
+    def post(self, endpoint, user_id=0, **kwargs):
+        return self.request('POST', endpoint, user_id, **kwargs)
+
+    def patch(self, endpoint, user_id=0, **kwargs):
+        return self.request('PATCH', endpoint, user_id, **kwargs)
+
+    def post_many(self, endpoint, calls, user_id=0):
+        """
+        Sends (path_params, params, json) calls to the same endpoint over the shared pool, returns exceptions in
+        place of responses so one failed call doesn't hide the others
+        """
+        def send(call):
+            path_params, params, data = call
+            try:
+                return self.post(endpoint, user_id, path_params=path_params, params=params, json=data)
+            except requests.RequestException as e:
+                return e
+
+        workers = max(1, min(PUBLIC_API_BATCH_WORKERS, len(calls)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(send, calls))
+
+    def _record(self, key, elapsed, failed):
+        with self._lock:
+            item = self._metrics[key]
+            item['count'] += 1
+            item['errors'] += int(failed)
+            item['total_time'] += elapsed
+            item['max_time'] = max(item['max_time'], elapsed)
+
+    def metrics(self):
+        with self._lock:
+            return {
+                key: {
+                    'count': item['count'],
+                    'errors': item['errors'],
+                    'avg_time': item['total_time'] / item['count'] if item['count'] else 0,
+                    'max_time': item['max_time'],
+                }
+                for key, item in self._metrics.items()
+            }
+
+
+public_api = PublicAPIClient(
+    PUBLIC_API_HOST,
+    pool_size=PUBLIC_API_POOL_SIZE,
+    timeout=(PUBLIC_API_CONNECT_TIMEOUT, PUBLIC_API_READ_TIMEOUT),
+    retries=PUBLIC_API_RETRIES,
+)
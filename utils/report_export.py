@@ -0,0 +1,43 @@
+import csv
+import io
+from os import environ
+
+from system.settings import app
+
+# rows serialized into one chunk of the streamed response
+REPORT_EXPORT_CHUNK_ROWS = int(environ.get('REPORT_EXPORT_CHUNK_ROWS', 1000))
+
+
+def to_ndjson(rows, chunk_rows=REPORT_EXPORT_CHUNK_ROWS):
+    # values are serialized like in the json reports
+    lines = []
+    for row in rows:
+        lines.append(app.json.dumps(row))
+        if len(lines) >= chunk_rows:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def to_csv(rows, chunk_rows=REPORT_EXPORT_CHUNK_ROWS):
+    # the header comes from the keys of the first row, an empty report is an empty file
+    buffer = io.StringIO()
+    writer = None
+    for i, row in enumerate(rows, start=1):
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow(row)
+        if i % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+EXPORT_FORMATS = {
+    'ndjson': (to_ndjson, 'application/x-ndjson'),
+    'csv': (to_csv, 'text/csv'),
+}
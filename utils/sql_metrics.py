@@ -0,0 +1,234 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from os import environ
+
+from flask import request
+from sqlalchemy import event
+
+from system.settings import db
+
+# X-SQL-Queries / X-SQL-Time-Ms on every response, always on in debug mode
+SQL_METRICS_HEADER = bool(environ.get('SQL_METRICS_HEADER'))
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250, 500)
+DB_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# statements run outside a request or a job (background threads) are recorded under this name,
+# aggregated per thread and recorded every BACKGROUND_RECORD_STATEMENTS statements or BACKGROUND_RECORD_SECONDS
+BACKGROUND = 'background'
+BACKGROUND_RECORD_STATEMENTS = 100
+BACKGROUND_RECORD_SECONDS = 10
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r'\s+')
+_local = threading.local()
+
+
+def fingerprint(statement):
+    return _SPACES.sub(' ', _LITERALS.sub('?', statement)).strip()[:200]
+
+
+class _Unit:
+    __slots__ = ('name', 'queries', 'db_time', 'rows', 'slowest_time', 'slowest_statement')
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.slowest_time = 0.0
+        self.slowest_statement = None
+
+    def add(self, statement, duration, rows):
+        self.queries += 1
+        self.db_time += duration
+        self.rows += rows
+        if duration >= self.slowest_time:
+            self.slowest_time, self.slowest_statement = duration, statement
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class SqlMetrics:
+    """
+    Query count, db time, rows and the slowest statement of every request (by Flask endpoint)
+    and job run (by APScheduler job id), rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self._queries = {}
+        self._db_time = {}
+        self._rows = {}
+        self._slowest = {}
+        self._lock = threading.Lock()
+
+    def record(self, unit):
+        with self._lock:
+            name = unit.name
+            if name not in self._queries:
+                self._queries[name] = _Histogram(QUERY_COUNT_BUCKETS)
+                self._db_time[name] = _Histogram(DB_TIME_BUCKETS)
+                self._rows[name] = 0
+            self._queries[name].observe(unit.queries)
+            self._db_time[name].observe(unit.db_time)
+            self._rows[name] += unit.rows
+            # fingerprinted on render, off the statement path
+            if unit.slowest_statement is not None and unit.slowest_time >= self._slowest.get(name, (0, None))[0]:
+                self._slowest[name] = (unit.slowest_time, unit.slowest_statement)
+
+    def reset(self):
+        with self._lock:
+            self._queries.clear()
+            self._db_time.clear()
+            self._rows.clear()
+            self._slowest.clear()
+
+    def render(self):
+        with self._lock:
+            lines = []
+            self._render_histograms(lines, 'sql_queries_per_unit', 'Statements per request or job run', self._queries)
+            self._render_histograms(lines, 'sql_db_seconds_per_unit', 'DB time per request or job run', self._db_time)
+            lines.append('# HELP sql_rows_total Rows returned or affected')
+            lines.append('# TYPE sql_rows_total counter')
+            for name, rows in sorted(self._rows.items()):
+                lines.append(f'sql_rows_total{{endpoint="{_escape(name)}"}} {rows}')
+            lines.append('# HELP sql_slowest_statement_seconds Slowest statement seen')
+            lines.append('# TYPE sql_slowest_statement_seconds gauge')
+            for name, (seconds, statement) in sorted(self._slowest.items()):
+                label = f'endpoint="{_escape(name)}",fingerprint="{_escape(fingerprint(statement))}"'
+                lines.append(f'sql_slowest_statement_seconds{{{label}}} {seconds:.6f}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_histograms(lines, metric, description, histograms):
+        lines.append(f'# HELP {metric} {description}')
+        lines.append(f'# TYPE {metric} histogram')
+        for name, histogram in sorted(histograms.items()):
+            label = f'endpoint="{_escape(name)}"'
+            cumulative = 0
+            for bucket, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{label},le="{bucket}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{{label},le="+Inf"}} {histogram.count}')
+            lines.append(f'{metric}_sum{{{label}}} {histogram.sum}')
+            lines.append(f'{metric}_count{{{label}}} {histogram.count}')
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+sql_metrics = SqlMetrics()
+
+
+@contextmanager
+def unit(name):
+    # every statement of the block, in this thread, is attributed to name
+    previous, _local.unit = getattr(_local, 'unit', None), _Unit(name)
+    try:
+        yield _local.unit
+    finally:
+        sql_metrics.record(_local.unit)
+        _local.unit = previous
+
+
+def track_job(job_id, func):
+    @wraps(func)
+    def tracked(*args, **kwargs):
+        with unit(job_id):
+            return func(*args, **kwargs)
+
+    return tracked
+
+
+def tracked_stream(name, chunks):
+    # a streamed body is produced after after_request, its statements are attributed to the endpoint all the same
+    with unit(name):
+        yield from chunks
+
+
+def instrument_jobs(scheduler):
+    for job in scheduler.get_jobs():
+        job.modify(func=track_job(job.id, job.func))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_sql_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['_sql_started'].pop()
+    rows = max(cursor.rowcount, 0)
+    current = getattr(_local, 'unit', None)
+    if current is not None:
+        current.add(statement, duration, rows)
+        return
+    background = getattr(_local, 'background', None)
+    if background is None:
+        background = _local.background = _Unit(BACKGROUND)
+        _local.background_started = time.monotonic()
+    background.add(statement, duration, rows)
+    if background.queries >= BACKGROUND_RECORD_STATEMENTS \
+            or time.monotonic() - _local.background_started >= BACKGROUND_RECORD_SECONDS:
+        _local.background = None
+        sql_metrics.record(background)
+
+
+def _handle_error(context):
+    # a failed statement never reaches after_cursor_execute
+    started = context.connection.info.get('_sql_started') if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+_LISTENERS = (
+    ('before_cursor_execute', _before_cursor_execute),
+    ('after_cursor_execute', _after_cursor_execute),
+    ('handle_error', _handle_error),
+)
+
+
+def install(engine=db):
+    for name, listener in _LISTENERS:
+        event.listen(engine, name, listener)
+
+
+def uninstall(engine=db):
+    for name, listener in _LISTENERS:
+        event.remove(engine, name, listener)
+
+
+def init_sql_metrics(app, engine=db):
+    install(engine)
+
+    # a request is handled by one thread, its unit is kept thread-local like the ones of jobs
+    @app.before_request
+    def _start_sql_unit():
+        _local.unit = _Unit(request.endpoint or 'not_found')
+
+    @app.after_request
+    def _record_sql_unit(response):
+        current, _local.unit = getattr(_local, 'unit', None), None
+        if current is not None:
+            sql_metrics.record(current)
+            if SQL_METRICS_HEADER or app.debug:
+                response.headers['X-SQL-Queries'] = str(current.queries)
+                response.headers['X-SQL-Time-Ms'] = f'{current.db_time * 1000:.2f}'
+        return response
@@ -44,6 +44,7 @@ class RateDTO:
     created_at: datetime
     updated_at: datetime
     currency: str
+    source_time: Optional[datetime]
 
 
 @dataclass
@@ -102,6 +103,7 @@ class WalletDTO:
     total_received: Decimal
     w_limit: Optional[Decimal]
     regenerate_wallet: bool
+    address: Optional[str]
 
 
 @dataclass
@@ -279,6 +281,11 @@ class TransactionDTO:
     is_deleted: bool
     sky_commission: Decimal
     tx_type: int
+    nonce: Optional[int]
+    gas_price: Optional[Decimal]
+    raw_tx: Optional[str]
+    sent_at: Optional[datetime]
+    replaced_tx_hashes: list
 
 @dataclass
 class MerchantDTO:
@@ -2,18 +2,16 @@ import random
 import string
 import calendar
 from datetime import datetime, timezone, date
-from os import environ
 
-import jwt
 import pytz
-import requests
 from pdfid import pdfid
 
 from system.settings import db
 from system.constants import (
     NICKNAME_DIGITS, NICKNAME_LETTERS, PROMOCODE_LENGTH, LOT_ID_LENGTH, DEAL_ID_LENGTH, TOKEN_LENGTH, FILENAME_LENGTH,
-    REF_CODE_LENGTH, CAMPAIGN_ID_LENGTH, OperationTypes, ADMIN_ROLE, PUBLIC_API_HOST)
+    REF_CODE_LENGTH, CAMPAIGN_ID_LENGTH, OperationTypes)
 from utils.db_sessions import session_scope
+from utils.public_api import admin_token, public_api
 
 
 def get_nickname(prefix):
@@ -147,16 +145,11 @@ def update_operation(session, user_id, op_id, data):
 
 
 def get_jwt_admin_token(user_id, salt):
-    return jwt.encode({
-        'user_id': user_id,
-        'role_id': ADMIN_ROLE
-    }, salt, algorithm='HS256').decode('utf-8')
+    return admin_token(user_id, salt)
 
 
 def _get_purchase(user_id, purchase_id):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.get(PUBLIC_API_HOST + f'/purchases/{purchase_id}', headers=headers)
-    res.raise_for_status()
+    res = public_api.get('/purchases/{id}', user_id, path_params={'id': purchase_id})
     purchase = res.json()
     return purchase
 
@@ -167,73 +160,65 @@ def get_purchase(user_id, purchase_id):
 
 
 def update_purchase(user_id, purchase_id, data):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.patch(
-        PUBLIC_API_HOST + f'/purchases/{purchase_id}',
-        headers=headers,
-        json=data
-    )
-    res.raise_for_status()
+    public_api.patch('/purchases/{id}', user_id, path_params={'id': purchase_id}, json=data)
 
 
 def get_payments_to_deprecate():
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(0, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.get(
-        PUBLIC_API_HOST + '/purchases-to-deprecate',
-        headers=headers
-    )
-    res.raise_for_status()
-    return res.json()
+    return public_api.get('/purchases-to-deprecate').json()
 
 
 def get_payments_v2_to_deprecate():
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(0, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.get(
-        PUBLIC_API_HOST + '/payments_v2-to-deprecate',
-        headers=headers
-    )
-    res.raise_for_status()
-    return res.json()
+    return public_api.get('/payments_v2-to-deprecate').json()
 
 
 def update_merchants(data):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(0, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.post(
-        PUBLIC_API_HOST + '/update-merchants',
-        headers=headers,
-        json=data
-    )
-    res.raise_for_status()
+    public_api.post('/update-merchants', json=data)
 
 
 def update_rates(data, symbol, currency, lot_type):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(0, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.post(
-        PUBLIC_API_HOST + f'/update-rates/{symbol}?currency={currency}&lot_type={lot_type}',
-        headers=headers,
+    public_api.post(
+        '/update-rates/{symbol}',
+        path_params={'symbol': symbol},
+        params={'currency': currency, 'lot_type': lot_type},
         json=data
     )
-    res.raise_for_status()
+
+
+def update_rates_many(items):
+    """
+    items are (data, symbol, currency, lot_type) tuples, returns the exceptions of failed calls
+    """
+    calls = [
+        ({'symbol': symbol}, {'currency': currency, 'lot_type': lot_type}, data)
+        for data, symbol, currency, lot_type in items
+    ]
+    return _post_many('/update-rates/{symbol}', calls)
 
 
 def update_actual_rates(data, symbol, currency):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(0, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.post(
-        PUBLIC_API_HOST + f'/update-actual-rates/{symbol}?currency={currency}',
-        headers=headers,
+    public_api.post(
+        '/update-actual-rates/{symbol}',
+        path_params={'symbol': symbol},
+        params={'currency': currency},
         json=data
     )
-    res.raise_for_status()
+
+
+def update_actual_rates_many(items):
+    """
+    items are (data, symbol, currency) tuples, returns the exceptions of failed calls
+    """
+    calls = [({'symbol': symbol}, {'currency': currency}, data) for data, symbol, currency in items]
+    return _post_many('/update-actual-rates/{symbol}', calls)
+
+
+def _post_many(endpoint, calls):
+    results = public_api.post_many(endpoint, calls)
+    return [res for res in results if isinstance(res, Exception)]
 
 
 def update_brokers_v2(data):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(0, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.post(
-        PUBLIC_API_HOST + f'/brokers-update',
-        headers=headers,
-        json=data
-    )
-    res.raise_for_status()
+    public_api.post('/brokers-update', json=data)
 
 
 def begin_purchase(user_id, purchase_id):
@@ -312,10 +297,7 @@ def decline_payment_v2(user_id, purchase_id):
 def call_v2_to_items_process(item_type, postfix='process'):
     if item_type not in ('sale-v2', 'payments-v2', 'withdrawals-v2', 'cpayments'):
         raise ValueError
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(-1, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.get(PUBLIC_API_HOST + f'/{item_type}-to-{postfix}', headers=headers)
-    res.raise_for_status()
-    return res.json()
+    return public_api.get(f'/{item_type}-to-{postfix}', -1).json()
 
 def get_sale_v2_to_process():
     return call_v2_to_items_process('sale-v2')
@@ -338,38 +320,23 @@ def get_cpayments_to_process():
 
 
 def get_not_approved_sells(user_id):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.get(PUBLIC_API_HOST + f'/sells-on-approve', headers=headers)
-    res.raise_for_status()
-    return res.json()
+    return public_api.get('/sells-on-approve', user_id).json()
 
 
 def get_sales_to_deprecate(user_id):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.get(PUBLIC_API_HOST + f'/sells-on-deprecate', headers=headers)
-    res.raise_for_status()
-    return res.json()
+    return public_api.get('/sells-on-deprecate', user_id).json()
 
 
 def deprecate_inactive_sales(user_id):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.post(PUBLIC_API_HOST + f'/deprecate-inactive-sales', headers=headers)
-    res.raise_for_status()
-    return res.json()
+    return public_api.post('/deprecate-inactive-sales', user_id).json()
 
 
 def deprecate_inactive_sales_v2(user_id):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.post(PUBLIC_API_HOST + f'/deprecate-inactive-sales-v2', headers=headers)
-    res.raise_for_status()
-    return res.json()
+    return public_api.post('/deprecate-inactive-sales-v2', user_id).json()
 
 
 def _get_sell(user_id, sell_id):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.get(PUBLIC_API_HOST + f'/sells/{sell_id}', headers=headers)
-    res.raise_for_status()
-    return res.json()
+    return public_api.get('/sells/{id}', user_id, path_params={'id': sell_id}).json()
 
 
 def get_sell(user_id, sell_id):
@@ -378,31 +345,19 @@ def get_sell(user_id, sell_id):
 
 
 def get_sale_v2(user_id, sale_v2_id):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.get(PUBLIC_API_HOST + f'/sale_v2/{sale_v2_id}', headers=headers)
-    res.raise_for_status()
-    return res.json()
+    return public_api.get('/sale_v2/{id}', user_id, path_params={'id': sale_v2_id}).json()
 
 
 def get_cpayment(user_id, cpayment_id):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.get(PUBLIC_API_HOST + f'/cpayments/{cpayment_id}', headers=headers)
-    res.raise_for_status()
-    return res.json()
+    return public_api.get('/cpayments/{id}', user_id, path_params={'id': cpayment_id}).json()
 
 
 def get_withdrawal(user_id, withdrawal_id):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.get(PUBLIC_API_HOST + f'/withdrawals/{withdrawal_id}', headers=headers)
-    res.raise_for_status()
-    return res.json()
+    return public_api.get('/withdrawals/{id}', user_id, path_params={'id': withdrawal_id}).json()
 
 
 def _get_payment_v2(user_id, payment_v2_id):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.get(PUBLIC_API_HOST + f'/payments_v2/{payment_v2_id}', headers=headers)
-    res.raise_for_status()
-    return res.json()
+    return public_api.get('/payments_v2/{id}', user_id, path_params={'id': payment_v2_id}).json()
 
 
 def get_payment_v2(user_id, payment_v2_id):
@@ -411,13 +366,7 @@ def get_payment_v2(user_id, payment_v2_id):
 
 
 def update_sell(user_id, sell_id, data):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.patch(
-        PUBLIC_API_HOST + f'/sells/{sell_id}',
-        headers=headers,
-        json=data
-    )
-    res.raise_for_status()
+    public_api.patch('/sells/{id}', user_id, path_params={'id': sell_id}, json=data)
 
 
 def begin_sell(user_id, sell_id):
@@ -425,43 +374,19 @@ def begin_sell(user_id, sell_id):
 
 
 def update_sale_v2(user_id, sale_v2_id, data):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.patch(
-        PUBLIC_API_HOST + f'/sale_v2/{sale_v2_id}',
-        headers=headers,
-        json=data
-    )
-    res.raise_for_status()
+    public_api.patch('/sale_v2/{id}', user_id, path_params={'id': sale_v2_id}, json=data)
 
 
 def update_payment_v2(user_id, payment_v2_id, data):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.patch(
-        PUBLIC_API_HOST + f'/payments_v2/{payment_v2_id}',
-        headers=headers,
-        json=data
-    )
-    res.raise_for_status()
+    public_api.patch('/payments_v2/{id}', user_id, path_params={'id': payment_v2_id}, json=data)
 
 
 def update_withdrawal_v2(user_id, withdrawal_v2_id, data):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.patch(
-        PUBLIC_API_HOST + f'/withdrawals/{withdrawal_v2_id}',
-        headers=headers,
-        json=data
-    )
-    res.raise_for_status()
+    public_api.patch('/withdrawals/{id}', user_id, path_params={'id': withdrawal_v2_id}, json=data)
 
 
 def update_cpayment(user_id, cpayment_id, data):
-    headers = {'Authorization': f'Bearer {get_jwt_admin_token(user_id, environ["PUBLIC_APP_KEY"])}'}
-    res = requests.patch(
-        PUBLIC_API_HOST + f'/cpayments/{cpayment_id}',
-        headers=headers,
-        json=data
-    )
-    res.raise_for_status()
+    public_api.patch('/cpayments/{id}', user_id, path_params={'id': cpayment_id}, json=data)
 
 
 def _complete_sell(user_id, sell_id, session):